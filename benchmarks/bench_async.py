@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import zip7
+import zip7async
+from synth7z import build_archive, make_data
+
+"""
+Benchmark for zip7async: opening many archives and reading their steg data from a single event loop
+Reports the throughput against plain sequential Zip7 use, and how long the event loop went without running (its
+worst stall), measured by a ticker task that should wake up every millisecond
+"""
+
+TICK = 0.001
+
+
+def sequential(file_names):
+    for file_name in file_names:
+        with zip7.Zip7(file_name, lazy=True) as file:
+            bytes(file.steg.center_data)
+
+
+# Run coroutine while a ticker task records the longest gap between its wake-ups
+async def with_stall(coroutine):
+    worst = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal worst
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(TICK)
+            now = time.perf_counter()
+            worst = max(worst, now - last - TICK)
+            last = now
+
+    task = asyncio.ensure_future(ticker())
+    # Let the ticker take its first reading before the work starts
+    await asyncio.sleep(0)
+    try:
+        result = await coroutine
+    finally:
+        running = False
+        await task
+    return result, worst
+
+
+async def blocking(file_names):
+    sequential(file_names)
+
+
+async def concurrent(file_names, limit, runner):
+    return await zip7async.map_archives(lambda file: file.read_center(), file_names, limit, runner)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the asyncio front end over many archives.')
+    parser.add_argument('-n', '--archives', type=int, default=2000, help='number of archives; DEFAULT 2000')
+    parser.add_argument('-s', '--size', type=int, default=64 << 10, help='bytes of steg data per archive; DEFAULT 64 KiB')
+    parser.add_argument('-l', '--limit', type=int, default=zip7async.DEFAULT_LIMIT, help='archives open at once; DEFAULT %d' % zip7async.DEFAULT_LIMIT)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        template = os.path.join(folder, 'template.7z')
+        build_archive(template, [('file.bin', make_data(4096))], center=make_data(args.size, 1))
+        file_names = [os.path.join(folder, 'archive_%d.7z' % i) for i in range(args.archives)]
+        for file_name in file_names:
+            shutil.copyfile(template, file_name)
+
+        print('%d archives, %d KiB of steg data each' % (args.archives, args.size >> 10))
+        with zip7async.Zip7Runner() as runner:
+            cases = [
+                ('blocking', lambda: blocking(file_names)),
+                ('async', lambda: concurrent(file_names, args.limit, runner))
+            ]
+            for name, case in cases:
+                start = time.perf_counter()
+                result, stall = asyncio.run(with_stall(case()))
+                elapsed = time.perf_counter() - start
+                print('%-10s %8.2f s %10.0f archives/s   worst stall %8.1f ms' % (name, elapsed, args.archives / elapsed, stall * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+import argparse
+import os
+import random
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from zip7bytestream import Zip7ByteStream
+from synth7z import encode_number
+
+"""
+Micro-benchmark for Zip7ByteStream: decoding the long runs of 7z numbers found in footers with many streams
+Compares against the original slice/pad/unpack implementation, kept below for reference
+"""
+
+
+class LegacyByteStream(object):
+    def __init__(self, data=b''):
+        self._stream = data
+        self._length = len(data)
+        self._cursor = 0
+
+    def read(self, count=1):
+        data = self._stream[self._cursor: self._cursor + count]
+        self._cursor += count
+        return data
+
+    def read_int(self, count=1):
+        if count == 0:
+            return 0
+        data = self.read(count)
+        if count not in [i+1 for i in range(8)]:
+            raise Exception("Valid integer lengths: 1-8")
+        data += (8 - count) * b'\x00'
+        return struct.unpack('<Q', data)[0]
+
+    def read_number(self):
+        test_byte = self.read_int()
+        for i in range(8):
+            if (test_byte >> (7 - i) & 1) == 0:
+                return ((test_byte & (0xFF >> (1+i))) << (8 * i)) + self.read_int(i)
+        return self.read_int(8)
+
+
+# Pack sizes spread over every encoded width, like a footer for an archive with many streams
+def make_numbers(count, seed=0):
+    rng = random.Random(seed)
+    values = [rng.getrandbits(rng.choice([6, 13, 20, 27, 34, 48, 62])) for i in range(count)]
+    return values, b''.join(encode_number(value) for value in values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks 7z number decoding in Zip7ByteStream.')
+    parser.add_argument('-n', '--numbers', type=int, default=100000, help='numbers per footer; DEFAULT 100000')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='timing repetitions (best is kept); DEFAULT 5')
+    args = parser.parse_args()
+
+    values, data = make_numbers(args.numbers)
+    count = len(values)
+
+    # Sanity check before timing anything
+    assert Zip7ByteStream(data).read_numbers(count) == values
+    assert LegacyByteStream(data).read_number() == values[0]
+
+    cases = [
+        ('legacy read_number', lambda: [stream.read_number() for stream in [LegacyByteStream(data)] for i in range(count)]),
+        ('read_number', lambda: [stream.read_number() for stream in [Zip7ByteStream(data)] for i in range(count)]),
+        ('read_numbers', lambda: Zip7ByteStream(data).read_numbers(count)),
+        ('legacy read_int', lambda: [stream.read_int() for stream in [LegacyByteStream(data)] for i in range(len(data))]),
+        ('read_int', lambda: [stream.read_int() for stream in [Zip7ByteStream(data)] for i in range(len(data))]),
+    ]
+
+    print('%d numbers, %d bytes' % (count, len(data)))
+    results = dict()
+    for name, case in cases:
+        results[name] = min(timeit.repeat(case, number=1, repeat=args.repeat))
+        print('%-20s %8.2f ms' % (name, results[name] * 1000))
+    print('read_number speedup:  %.1fx' % (results['legacy read_number'] / results['read_number']))
+    print('read_numbers speedup: %.1fx' % (results['legacy read_number'] / results['read_numbers']))
+    print('read_int speedup:     %.1fx' % (results['legacy read_int'] / results['read_int']))
+
+
+if __name__ == "__main__":
+    main()
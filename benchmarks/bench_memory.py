@@ -0,0 +1,88 @@
+#!/usr/bin/python3
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+from array import array
+from dataclasses import field, make_dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import zip7
+from zip7helpers import Header, Encoder, Folder, Footer, Body, Steg
+from zip7bytestream import Zip7ByteStream
+from synth7z import build_archive, make_data
+
+"""
+Memory benchmark for the parsed models: bytes kept alive per archive when the metadata of many archives is held at once
+Compares against the original layout (plain dataclasses with a __dict__, lists of ints, and the footer's parse state
+kept alive), mirrored below from the current models
+"""
+
+# Plain dataclass copies of each model, and the parse state the original Footer held on to
+LEGACY_FOOTER_STATE = [('stream', Zip7ByteStream), ('expected', list), ('sections', list)]
+LEGACY = {
+    cls: make_dataclass('Legacy' + cls.__name__,
+                        [(name, object, field(default=None)) for name in cls.__slots__ if name != 'parse'] +
+                        ([(name, kind, field(default=None)) for name, kind in LEGACY_FOOTER_STATE] if cls is Footer else []))
+    for cls in (Header, Encoder, Folder, Footer, Body, Steg)
+}
+
+
+# The same metadata laid out the original way
+def legacy_copy(value):
+    if type(value) in LEGACY:
+        copy = LEGACY[type(value)](**{name: legacy_copy(getattr(value, name)) for name in value.__slots__ if name != 'parse'})
+        if type(value) is Footer:
+            copy.stream = Zip7ByteStream(value.data)
+            copy.stream._cursor = len(value.data)
+            copy.expected = []
+            copy.sections = []
+        return copy
+    if isinstance(value, (list, array)):
+        return [legacy_copy(item) for item in value]
+    return value
+
+
+def parse(file_name):
+    with zip7.Zip7(file_name, lazy=True, mapped=False) as file:
+        file.archive_footer
+        return file.header, file.footer, file.decoded_footer, file.body, file.steg
+
+
+# Bytes still allocated after keeping count parsed archives (as converted by convert)
+def measure(file_name, count, convert):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [convert(parse(file_name)) for i in range(count)]
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks memory kept per parsed archive.')
+    parser.add_argument('-n', '--archives', type=int, default=2000, help='parsed archives to keep; DEFAULT 2000')
+    parser.add_argument('-f', '--files', type=int, default=64, help='files (one folder each) per archive; DEFAULT 64')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'bench.7z')
+        build_archive(file_name, [('file_%d.bin' % i, make_data(1024, i)) for i in range(args.files)])
+        # Every parse decodes the same packed header; don't let the cache share it between them
+        zip7.Zip7.DECODED_FOOTER_CACHE_SIZE = 0
+
+        print('%d archives of %d files each' % (args.archives, args.files))
+        legacy = measure(file_name, args.archives, lambda parsed: [legacy_copy(model) for model in parsed])
+        current = measure(file_name, args.archives, lambda parsed: parsed)
+        print('%-10s %10.0f bytes per archive' % ('legacy', legacy))
+        print('%-10s %10.0f bytes per archive' % ('slotted', current))
+        print('saving:    %9.1f%%' % (100 * (1 - current / legacy)))
+
+
+if __name__ == "__main__":
+    main()
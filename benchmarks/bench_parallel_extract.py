@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import zip7
+from synth7z import build_archive, make_data
+
+"""
+Benchmark for Zip7.extract_parallel: decompression throughput of a many-folder archive as worker processes are added
+Sequential iter_members() is timed too, as the single-core baseline
+"""
+
+
+def sequential(file):
+    for member in file.iter_members():
+        for chunk in member.chunks():
+            pass
+
+
+def parallel(file, workers):
+    for name, data in file.extract_parallel(workers=workers):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks parallel folder decompression in Zip7.')
+    parser.add_argument('-n', '--files', type=int, default=32, help='number of files (one folder each); DEFAULT 32')
+    parser.add_argument('-s', '--size', type=int, default=4 << 20, help='bytes per file; DEFAULT 4 MiB')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timing repetitions (best is kept); DEFAULT 3')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    worker_counts = sorted({1 << i for i in range(cpus.bit_length()) if 1 << i <= cpus} | {cpus})
+
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'bench.7z')
+        build_archive(file_name, [('file_%d.bin' % i, make_data(args.size, i)) for i in range(args.files)])
+        total = args.files * args.size / (1 << 20)
+        print('%d folders, %.1f MiB unpacked, %d CPUs' % (args.files, total, cpus))
+
+        with zip7.Zip7(file_name, lazy=True) as file:
+            cases = [('iter_members', lambda: sequential(file))]
+            cases += [('%d workers' % workers, lambda workers=workers: parallel(file, workers)) for workers in worker_counts]
+            for name, case in cases:
+                best = None
+                for i in range(args.repeat):
+                    start = time.perf_counter()
+                    case()
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                print('%-14s %8.2f s %10.1f MiB/s' % (name, best, total / best))
+
+
+if __name__ == "__main__":
+    main()
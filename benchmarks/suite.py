@@ -0,0 +1,361 @@
+#!/usr/bin/python3
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC)
+import zip7
+from zip7helpers import Footer
+from synth7z import build_archive, make_data
+
+"""
+Benchmark suite for the core library and scripts, over synthetic archives of every shape that matters
+(pack stream counts, file counts, footer sizes, steg payloads from KB up to GB)
+Every case runs in a fresh interpreter, so its peak RSS is its own; the best time of a few repetitions is kept
+Results can be saved as JSON and compared against an earlier run, to catch regressions in time and memory
+Startup is tracked too: import times and whole invocations of the scripts, each in a new interpreter (their peak RSS
+is only that of the process starting them), and a stream of archives run one process each against 7ztool.py serve
+"""
+
+KiB = 1 << 10
+MiB = 1 << 20
+GiB = 1 << 30
+
+# Archive shapes: name -> (build_archive keyword arguments, files as (count, bytes each), scales it's built for)
+# Only what's needed for the chosen scale is built; 'full' adds the GB-sized steg payloads
+ARCHIVES = {
+    'small': (dict(), (16, 64 * KiB), ('quick', 'full')),
+    'many_streams': (dict(packed_footer=False), (2000, 1 * KiB), ('quick', 'full')),
+    'many_files': (dict(solid=True, mtime=132000000000000000, attributes=0x20), (20000, 64), ('quick', 'full')),
+    'files_8m': (dict(), (8, MiB), ('quick', 'full')),
+    'steg_4k': (dict(center=4 * KiB, bottom=4 * KiB), (4, 16 * KiB), ('quick', 'full')),
+    'steg_64m': (dict(center=64 * MiB, bottom=64 * MiB), (4, 16 * KiB), ('quick', 'full')),
+    'steg_1g': (dict(center=GiB, bottom=GiB), (4, 16 * KiB), ('full',)),
+}
+SCAN_COPIES = 200
+SERVE_COPIES = 50
+RSS_UNITS = 1 if sys.platform == 'darwin' else KiB
+
+
+def build(folder, name):
+    kwargs, (count, size), scales = ARCHIVES[name]
+    file_name = os.path.join(folder, name + '.7z')
+    if not os.path.exists(file_name):
+        build_archive(file_name, [('file_%05d.bin' % i, make_data(size, i)) for i in range(count)], **kwargs)
+    return file_name
+
+
+def steg_module():
+    # 7zsteg can't be imported by name in the usual way (it starts with a digit), and needs natsort
+    return importlib.import_module('7zsteg')
+
+
+## Cases: each gets an archive and a scratch folder, does its setup, and returns the function to time
+# Setup runs again before every repetition, so cases that change files always start from the original
+def case_open(file_name, scratch):
+    return lambda: zip7.Zip7(file_name)
+
+
+def case_open_lazy(file_name, scratch):
+    def run():
+        with zip7.Zip7(file_name, lazy=True):
+            pass
+    return run
+
+
+# Just the opcode loop over the (decoded) footer that describes the archive contents
+def case_footer_process(file_name, scratch):
+    file = zip7.Zip7(file_name, lazy=True)
+    data = file.archive_footer.data
+
+    def run():
+        footer = Footer()
+        footer.data = data
+        file.parse_footer(footer)
+    return run
+
+
+def case_files(file_name, scratch):
+    def run():
+        with zip7.Zip7(file_name, lazy=True) as file:
+            file.files
+    return run
+
+
+def case_save(file_name, scratch):
+    file = zip7.Zip7(file_name, lazy=True)
+    file.steg.center_data = b'saved'
+    return lambda: file.save(os.path.join(scratch, 'saved.7z'))
+
+
+def case_steg_inject(file_name, scratch):
+    target = os.path.join(scratch, 'inject.7z')
+    shutil.copyfile(file_name, target)
+    steg = steg_module()
+    data = os.urandom(MiB)
+    return lambda: steg.inject_files([target], data, False, 1)
+
+
+def case_steg_extract(file_name, scratch):
+    steg = steg_module()
+
+    def run():
+        for data in steg.extract_files([file_name], True, 1):
+            pass
+    return run
+
+
+def case_parse7z(file_name, scratch):
+    parse7z = importlib.import_module('parse7z')
+
+    def run():
+        sys.argv = ['parse7z.py', file_name]
+        with contextlib.redirect_stdout(io.StringIO()):
+            parse7z.main()
+    return run
+
+
+# The members of file_name, extracted under scratch (once) as the input for new archives
+def extract_members(file_name, scratch):
+    folder = os.path.join(scratch, 'members')
+    if not os.path.exists(folder):
+        with zip7.Zip7(file_name, lazy=True) as file:
+            for name, path in file.extract_parallel(folder, 1):
+                pass
+    return folder
+
+
+def case_create(file_name, scratch):
+    zip7writer = importlib.import_module('zip7writer')
+    folder = extract_members(file_name, scratch)
+    return lambda: zip7writer.write_archive(os.path.join(scratch, 'created.7z'), [folder])
+
+
+# One folder per worker, compressed in parallel
+def case_create_parallel(file_name, scratch):
+    zip7writer = importlib.import_module('zip7writer')
+    folder = extract_members(file_name, scratch)
+    workers = os.cpu_count() or 1
+    return lambda: zip7writer.write_archive(os.path.join(scratch, 'created.7z'), [folder], workers, workers=workers)
+
+
+# A folder of count copies of file_name, made the first time; returns it along with the copies' names
+def make_copies(file_name, folder, count):
+    names = [os.path.join(folder, 'copy_%03d.7z' % i) for i in range(count)]
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+        for name in names:
+            shutil.copyfile(file_name, name)
+    return folder, names
+
+
+def case_parse7z_scan(file_name, scratch):
+    parse7z = importlib.import_module('parse7z')
+    folder, names = make_copies(file_name, os.path.join(scratch, 'scan'), SCAN_COPIES)
+
+    def run():
+        sys.argv = ['parse7z.py', '--scan', folder]
+        with contextlib.redirect_stdout(io.StringIO()):
+            parse7z.main()
+    return run
+
+
+# fix_header -n over a folder of copies, one of them cut off part way through its footer: the batch has to report
+# it as an error and carry on with the rest
+def case_fix_header_batch(file_name, scratch):
+    fix_header = importlib.import_module('fix_header')
+    fresh = not os.path.exists(os.path.join(scratch, 'fix'))
+    folder, names = make_copies(file_name, os.path.join(scratch, 'fix'), SCAN_COPIES)
+    if fresh:
+        with zip7.Zip7(names[0], lazy=True) as file:
+            cut = file.header.footer_start + file.header.footer_length // 2
+        os.truncate(names[0], cut)
+
+    def run():
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            fix_header.main(['-n', folder])
+        summary = '%d checked, 0 broken, 0 fixed, 1 errors' % SCAN_COPIES
+        if not output.getvalue().endswith(summary + '\n'):
+            raise AssertionError('fix_header -n: expected %r, got %r' % (summary, output.getvalue()[-200:]))
+    return run
+
+
+## Startup: everything below runs in a new interpreter, the way the scripts are run from shell loops
+def python_run(args, stdin=None):
+    subprocess.run([sys.executable] + args, cwd=SRC, input=stdin, stdout=subprocess.DEVNULL, check=True)
+
+
+# Import module (None: nothing) in a new interpreter; the archive isn't used
+def import_case(module):
+    code = 'import importlib; importlib.import_module(%r)' % module if module else 'pass'
+
+    def case(file_name, scratch):
+        return lambda: python_run(['-c', code])
+    return case
+
+
+case_interpreter = import_case(None)
+case_import_zip7 = import_case('zip7')
+case_import_parse7z = import_case('parse7z')
+case_import_fix_header = import_case('fix_header')
+case_import_7zsteg = import_case('7zsteg')
+case_import_7ztool = import_case('7ztool')
+
+
+def case_exec_parse7z(file_name, scratch):
+    return lambda: python_run(['parse7z.py', '-S', file_name])
+
+
+def case_exec_7ztool(file_name, scratch):
+    return lambda: python_run(['7ztool.py', 'parse', '-S', file_name])
+
+
+# SERVE_COPIES archives, one process each...
+def case_exec_loop(file_name, scratch):
+    folder, names = make_copies(file_name, os.path.join(scratch, 'loop'), SERVE_COPIES)
+
+    def run():
+        for name in names:
+            python_run(['parse7z.py', '-S', name])
+    return run
+
+
+# ...against the same archives streamed through a single server
+def case_serve(file_name, scratch):
+    folder, names = make_copies(file_name, os.path.join(scratch, 'serve'), SERVE_COPIES)
+    paths = '\n'.join(names).encode()
+    return lambda: python_run(['7ztool.py', 'serve', 'parse', '-S'], paths)
+
+
+# (case, archive) pairs making up the suite, in the order they're run
+CASES = [
+    ('open', 'small'), ('open', 'many_streams'), ('open', 'many_files'), ('open', 'steg_64m'), ('open', 'steg_1g'),
+    ('open_lazy', 'small'), ('open_lazy', 'many_files'), ('open_lazy', 'steg_64m'), ('open_lazy', 'steg_1g'),
+    ('footer_process', 'many_streams'), ('footer_process', 'many_files'),
+    ('files', 'many_files'),
+    ('save', 'small'), ('save', 'steg_64m'), ('save', 'steg_1g'),
+    ('steg_inject', 'steg_4k'), ('steg_inject', 'steg_64m'),
+    ('steg_extract', 'steg_4k'), ('steg_extract', 'steg_64m'), ('steg_extract', 'steg_1g'),
+    ('parse7z', 'small'), ('parse7z', 'many_files'),
+    ('parse7z_scan', 'small'), ('fix_header_batch', 'small'),
+    ('create', 'files_8m'), ('create_parallel', 'files_8m'),
+    ('interpreter', 'small'), ('import_zip7', 'small'), ('import_parse7z', 'small'), ('import_fix_header', 'small'),
+    ('import_7zsteg', 'small'), ('import_7ztool', 'small'),
+    ('exec_parse7z', 'small'), ('exec_7ztool', 'small'),
+    ('exec_loop', 'small'), ('serve', 'small'),
+]
+
+
+# Linux carries ru_maxrss over from the (forked) parent, so the high-water mark of this process's own memory is
+# read from /proc where there is one
+def peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * KiB
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNITS
+
+
+# Run one case in this process and print its result as JSON (the parent runs each case this way)
+def run_child(case, file_name, scratch, repeat):
+    factory = globals()['case_' + case]
+    best = None
+    for i in range(repeat):
+        run = factory(file_name, scratch)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(json.dumps({'seconds': best, 'peak_rss': peak_rss()}))
+
+
+def run_case(case, archive, file_name, scratch, repeat):
+    process = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', case, file_name, scratch, str(repeat)],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        return {'error': (process.stderr.strip().splitlines() or ['exit code %d' % process.returncode])[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+# Cases more than threshold slower (or bigger) than in the baseline, as printable lines
+def regressions(results, baseline, threshold):
+    lines = list()
+    for name, result in results.items():
+        old = baseline.get(name)
+        if not old or 'error' in old or 'error' in result:
+            continue
+        for key in ('seconds', 'peak_rss'):
+            if result[key] > old[key] * (1 + threshold):
+                lines.append('%-32s %-9s %+.1f%%' % (name, key, 100 * (result[key] / old[key] - 1)))
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the benchmark suite over synthetic archives.')
+    parser.add_argument('--scale', choices=['quick', 'full'], default='quick', help='full adds GB-sized steg payloads; DEFAULT quick')
+    parser.add_argument('-k', metavar='SUBSTRING', help='only run cases whose name contains SUBSTRING')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timing repetitions (best is kept); DEFAULT 3')
+    parser.add_argument('--data', metavar='FOLDER', help='keep generated archives in FOLDER and reuse them between runs')
+    parser.add_argument('--save', metavar='JSON_FILE', help='write the results to JSON_FILE')
+    parser.add_argument('--compare', metavar='JSON_FILE', help='compare against results saved earlier with --save')
+    parser.add_argument('--threshold', type=float, default=0.10, help='slowdown (or growth) reported as a regression; DEFAULT 0.10')
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        case, file_name, scratch, repeat = args.child
+        run_child(case, file_name, scratch, int(repeat))
+        return 0
+
+    baseline = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    results = dict()
+    with tempfile.TemporaryDirectory() as temp:
+        data = args.data or temp
+        os.makedirs(data, exist_ok=True)
+        print('%-32s %12s %12s' % ('case', 'seconds', 'peak RSS'))
+        for case, archive in CASES:
+            name = '%s[%s]' % (case, archive)
+            if args.scale not in ARCHIVES[archive][2] or (args.k and args.k not in name):
+                continue
+            file_name = build(data, archive)
+            scratch = os.path.join(temp, name)
+            os.mkdir(scratch)
+            result = results[name] = run_case(case, archive, file_name, scratch, args.repeat)
+            shutil.rmtree(scratch)
+            if 'error' in result:
+                print('%-32s %s' % (name, result['error']))
+            else:
+                print('%-32s %12.4f %9.1f MiB' % (name, result['seconds'], result['peak_rss'] / MiB))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'scale': args.scale, 'python': sys.version.split()[0], 'results': results}, f, indent=1)
+    if args.compare:
+        lines = regressions(results, baseline, args.threshold)
+        print('\n%d regression(s) against %s' % (len(lines), args.compare))
+        for line in lines:
+            print(line)
+        return 1 if lines else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+import argparse
+import lzma
+import os
+import random
+import sys
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from zip7writer import encode_bits, encode_file_property, encode_number, encode_property, encode_start_header, encode_streams_info
+
+"""
+Synthetic 7z archive generator for the benchmarks
+Builds valid LZMA2 archives (one folder per file, one solid folder, or anything in between) with plain or packed
+headers, and optional steganographic data in the center (before the footer) and bottom (after it)
+Steg data can be given as a size instead, to generate (and write) that much random data a chunk at a time
+"""
+
+# The dictionary size has to be spelled out, since it is declared in the folder properties
+LZMA2_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 1, 'dict_size': 1 << 20}]
+PACKED_FOOTER_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 6, 'dict_size': 1 << 20}]
+CHUNK_SIZE = 1 << 20
+
+
+def compress(data, filters=LZMA2_FILTERS):
+    return lzma.compress(data, format=lzma.FORMAT_RAW, filters=filters)
+
+
+# FilesInfo for files given by name (and whether each is empty); mtime (a FILETIME) and attributes, if given, are used
+# for every file, and left out otherwise (unlike zip7writer.encode_files_info, which always writes both)
+def encode_files_info(names, empty, mtime=None, attributes=None):
+    data = bytearray(b'\x05') + encode_number(len(names))
+    if any(empty):
+        data += encode_property(0x0E, encode_bits(empty))
+        # Every empty stream is an (empty) file rather than a directory
+        data += encode_property(0x0F, encode_bits([True] * sum(empty)))
+    data += encode_property(0x11, b'\x00' + b''.join(name.encode('utf-16-le') + b'\x00\x00' for name in names))
+    if mtime is not None:
+        data += encode_file_property(0x14, [mtime] * len(names), 8)
+    if attributes is not None:
+        data += encode_file_property(0x15, [attributes] * len(names), 4)
+    return data + b'\x00'
+
+
+# Write steg data: bytes as they are, or an int as that many random bytes
+def write_steg(f, data, seed=0):
+    if not isinstance(data, int):
+        f.write(data)
+        return len(data)
+    rng = random.Random(seed)
+    for position in range(0, data, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, data - position)
+        f.write(rng.getrandbits(8 * size).to_bytes(size, 'little'))
+    return data
+
+
+# Write an archive holding files [(name, data), ...]
+# Files go one per folder, or with solid, all in one; folder_count=N spreads them (in order) over N folders instead
+def build_archive(file_name, files, solid=False, packed_footer=True, center=b'', bottom=b'', filters=LZMA2_FILTERS, mtime=None, attributes=None, folder_count=None):
+    stored = [(name, data) for name, data in files if data]
+    if folder_count is None:
+        folder_count = 1 if solid else len(stored)
+    folder_count = max(1, min(folder_count, len(stored)))
+    groups = [stored[i * len(stored) // folder_count: (i + 1) * len(stored) // folder_count] for i in range(folder_count)] if stored else []
+
+    folders = list()
+    with open(file_name, 'wb') as f:
+        f.write(b'\x00' * 0x20)
+        for group in groups:
+            unpacked = b''.join(data for name, data in group)
+            packed = compress(unpacked, filters)
+            f.write(packed)
+            folders.append((len(packed), len(unpacked), zlib.crc32(unpacked), [(len(data), zlib.crc32(data)) for name, data in group], filters[-1]['dict_size']))
+        body_length = sum(folder[0] for folder in folders)
+
+        footer = b'\x01\x04' + encode_streams_info(0, folders)
+        footer += encode_files_info([name for name, data in files], [not data for name, data in files], mtime, attributes) + b'\x00'
+
+        if packed_footer:
+            packed = compress(footer, PACKED_FOOTER_FILTERS)
+            f.write(packed)
+            folder = (len(packed), len(footer), zlib.crc32(footer), [(len(footer), zlib.crc32(footer))], PACKED_FOOTER_FILTERS[-1]['dict_size'])
+            footer = b'\x17' + encode_streams_info(body_length, [folder], substreams=False)
+            body_length += len(packed)
+
+        center_length = write_steg(f, center, 1)
+        f.write(footer)
+        write_steg(f, bottom, 2)
+
+        f.seek(0)
+        f.write(encode_start_header(body_length + center_length, footer))
+
+
+# Mildly compressible pseudo-random data, so the LZMA2 work is realistic
+def make_data(size, seed=0):
+    rng = random.Random(seed)
+    words = [bytes(rng.getrandbits(8) for i in range(rng.randint(2, 9))) for i in range(512)]
+    return b''.join(rng.choices(words, k=size // 2 + 1))[:size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates synthetic 7z archives for benchmarking.')
+    parser.add_argument('file', metavar='FILENAME', type=str, help='archive to create')
+    parser.add_argument('-n', '--files', type=int, default=16, help='number of files; DEFAULT 16')
+    parser.add_argument('-s', '--size', type=int, default=1 << 20, help='bytes per file; DEFAULT 1 MiB')
+    parser.add_argument('--solid', action='store_true', help='put every file in one folder')
+    parser.add_argument('--folders', type=int, help='spread the files over this many folders (pack streams); DEFAULT one per file')
+    parser.add_argument('--plain-footer', action='store_true', help='do not pack the footer')
+    parser.add_argument('--center', type=int, default=0, help='bytes of random center steg data')
+    parser.add_argument('--bottom', type=int, default=0, help='bytes of random bottom steg data')
+    args = parser.parse_args()
+
+    files = [('file_%d.bin' % i, make_data(args.size, i)) for i in range(args.files)]
+    build_archive(args.file, files, args.solid, not args.plain_footer, args.center, args.bottom, folder_count=args.folders)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,46 +2,84 @@
 import argparse
 import os
 import zip7
-import re, fnmatch
-from natsort import natsorted
+import zip7batch
+import zip7volumes
 import sys
 
 """
 For injecting or extracting steganographic data from 7z files.
+It's often run once per archive, so whatever only some runs need (regexes, natsort for ordering many matches, the
+cache, streaming, the injection journal) is imported when it's used, keeping startup down to the core library.
 """
 
 BASE_FILE_PATTERN = '^{prompt}\\.7z$'
+JOURNAL_NAME = '.7zsteg.journal'
 
-def main():
+def main(argv=None, prog=None):
     # Set up argparse
-    parser = argparse.ArgumentParser(description='Allows for the injection or extraction of steganographic data from 7z files.')
-    parser.add_argument('file_pattern', metavar='PATTERN', type=str, help='pattern for files (?/* are wildcards); if more than one file is matched, the steganographic data will be striped across all matching files in alphabetical order')
+    parser = argparse.ArgumentParser(prog=prog, description='Allows for the injection or extraction of steganographic data from 7z files.')
+    parser.add_argument('file_pattern', metavar='PATTERN', type=str, help='pattern for files (?/* are wildcards); if more than one file is matched, the steganographic data will be striped across all matching files in alphabetical order; - extracts from an archive streamed in on stdin')
     parser.add_argument('-r', action='store_true', dest='regex', help='use regular expression for matching patterns')
     parser.add_argument('-c/-b', action='store_true', help='steganographic data location; DEFAULT center (-c) or bottom (-b)')
     parser.add_argument('-c', action='store_true', default=True, dest='center', help=argparse.SUPPRESS)
     parser.add_argument('-b', action='store_false', dest='center', help=argparse.SUPPRESS)
-    parser.add_argument('-d', metavar='DATA_FILE', help='if provided, data from DATA_FILE will be injected; otherwise, the script will extract')
+    parser.add_argument('-d', metavar='DATA_FILE', help='if provided, data from DATA_FILE (- for stdin) will be injected; otherwise, the script will extract')
+    parser.add_argument('--length', metavar='BYTES', type=int, help='size of the data to inject; only needed when it is piped in (-d -)')
+    parser.add_argument('--stripe', choices=['equal', 'size'], default='equal', help='how injected data is divided among the files: equally, or in proportion to their sizes; DEFAULT equal')
+    parser.add_argument('--journal', metavar='FOLDER', help='when injecting, stage the changes to every file in FOLDER before any file is patched; an interrupted injection is finished by running it again; DEFAULT %s next to the files' % JOURNAL_NAME)
+    parser.add_argument('--cache', metavar='CACHE_FILE', help='when extracting, keep parsed metadata in CACHE_FILE so unchanged files are not parsed again')
+    parser.add_argument('--stats', action='store_true', help='print timings, bytes read/written and other parser statistics to stderr when done')
+    parser.add_argument('-j', metavar='JOBS', type=int, default=zip7batch.DEFAULT_WORKERS, dest='jobs', help='number of files to parse/extract concurrently; DEFAULT %d' % zip7batch.DEFAULT_WORKERS)
 
     # Use argparse for... arg parsing
-    args = vars(parser.parse_args())
+    args = vars(parser.parse_args(argv))
     file_pattern = args['file_pattern']
     data_file = args['d']
     center = args['center']
     use_regex = args['regex']
+    jobs = args['jobs']
+    cache_file = args['cache']
+    length = args['length']
+    stats = zip7.Zip7Stats(trace_memory=True) if args['stats'] else None
+
+    # A streamed archive is extracted as it comes in; there's nothing to match or inject into
+    if file_pattern == '-':
+        if data_file:
+            print('Data can only be injected into files. QUITTING!')
+            return 1
+        import zip7stream
+        try:
+            zip7stream.extract_stream(sys.stdin.buffer, sys.stdout.buffer, center, stats=stats)
+        except zip7.Zip7FileException as e:
+            print('%s QUITTING!' % e, file=sys.stderr)
+            return 1
+        sys.stdout.buffer.flush()
+        print_stats(stats)
+        return 0
 
     path = os.path.abspath(file_pattern)
     folder, file_pattern = get_path_info(path)
 
-    all_files = os.listdir(folder)
     matching_files = list()
-
     if use_regex:
+        import re
         file_pattern = BASE_FILE_PATTERN.format(prompt=file_pattern)
-        for file in all_files:
+        for file in os.listdir(folder):
             if re.match(file_pattern, file):
                 matching_files.append(file)
+    elif not any(c in file_pattern for c in '*?['):
+        # A plain file name can only match itself: no need to list (possibly huge) folders
+        if os.path.isfile(folder + file_pattern):
+            matching_files.append(file_pattern)
     else:
-        matching_files = fnmatch.filter(all_files, file_pattern)
+        import fnmatch
+        matching_files = fnmatch.filter(os.listdir(folder), file_pattern)
+
+    # A split archive is opened from its first volume; the rest of its volumes would only match it again
+    # (whether a name is a volume can depend on what else is in its folder, so they're looked at with the folder on)
+    first_volumes = set(matching_files)
+    matching_files = [file for file in matching_files if not (zip7volumes.is_continuation(folder + file) and os.path.basename(zip7volumes.first_volume(folder + file)) in first_volumes)]
+    matching_files = [file for file in matching_files if file != JOURNAL_NAME]
 
     if len(matching_files) == 0:
         print('No files match pattern. QUITTING!')
@@ -52,60 +90,128 @@ def main():
         matching_files[i] = folder + file
 
     # Natsort them (i.e., 1 -> 2 -> 10, not 1 -> 10 -> 2)
-    files = natsorted(matching_files)
+    files = matching_files
+    if len(files) > 1:
+        from natsort import natsorted
+        files = natsorted(files)
 
     if data_file:
+        # The data is streamed into the files rather than read in whole, so it can be as large as the files allow
         try:
-            with open(data_file, 'rb') as f:
-                data = f.read()
+            stream = sys.stdin.buffer if data_file == '-' else open(data_file, 'rb')
         except FileNotFoundError:
             print('Data file not found. QUITTING!')
             return 1
+        import zip7stream
+        length = zip7stream.stream_length(stream) if length is None else length
+        if length is None:
+            print('The length of piped data must be given with --length. QUITTING!')
+            return 1
 
-        inject_files(files, data, center)
-    else:
-        extracted = extract_files(files, center)
-        # Write the bytes directly instead of printing and dealing with codecs
-        sys.stdout.buffer.write(extracted)
-
-def inject_files(files, all_data, center):
-    file_count = len(files)
-    chunks = create_chunks(all_data, file_count)
-    zips = list()
-    for file, data in zip(files, chunks):
-        z = zip7.Zip7(file)
-        zips.append(z)
-        inject(z, data, center)
-
-    # The reason to separate these is for batching: decrease odds of a partial-injection due to an error in later files
-    for file in zips:
-        file.update_header()
-        file.save(file_overwrite=True, update_crcs=True)
-
-# For dividing up data ~equally among large chunks
-def create_chunks(data, i):
-    if i == 0:
-        return []
-
-    split_pos = int(len(data) * 1/i)
-    return [data[:split_pos]] + create_chunks(data[split_pos:], i-1)
-
-def inject(file, data, center):
-    if center:
-        file.steg.center_data = data
-        file.header.footer_start = file.steg.center_start - file.HEADER_LEN + len(data)
+        try:
+            inject_stream(files, stream, length, center, jobs, args['stripe'] == 'size', stats, args['journal'])
+        except (zip7.Zip7FileException, zip7.Zip7UnimplementedException, zip7.Zip7UnknownException) as e:
+            print('%s QUITTING!' % e)
+            return 1
+        finally:
+            stream.close()
     else:
-        file.steg.bottom_data = data
-
-
-def extract_files(files, center):
-    count = len(files)
-    data = b''
-    for i in range(count):
-        file = zip7.Zip7(files[i])
-        new_data = extract(file, center)
-        data += new_data
-
+        cache = None
+        if cache_file:
+            import zip7cache
+            cache = zip7cache.MetadataCache(cache_file)
+        # Write the bytes directly instead of printing and dealing with codecs, as soon as each file's are ready
+        # Errors go to stderr, after whatever was extracted from the files before the one that failed
+        try:
+            for extracted in extract_files(files, center, jobs, cache, stats):
+                sys.stdout.buffer.write(extracted)
+                sys.stdout.buffer.flush()
+        except (zip7.Zip7FileException, zip7.Zip7UnimplementedException, zip7.Zip7UnknownException) as e:
+            print('%s QUITTING!' % e, file=sys.stderr)
+            return 1
+        finally:
+            if cache:
+                cache.close()
+    print_stats(stats)
+
+# Statistics go to stderr, since stdout may be carrying extracted data
+def print_stats(stats):
+    if not stats:
+        return
+    for name, value in stats.report(zip7.Zip7.OPCODE_NAMES):
+        print('%-21s %s' % (name, value), file=sys.stderr)
+
+# The journal folder a batch of injections into files goes through, unless another is given: next to the first file
+def default_journal(files):
+    return os.path.join(os.path.dirname(os.path.abspath(files[0])), JOURNAL_NAME)
+
+# Injection is a two-phase commit (see zip7stage): every file is staged in the journal before any is patched, so a run
+# that fails part way leaves either nothing injected or a journal to finish it from, by running it again
+def inject_files(files, all_data, center, jobs=zip7batch.DEFAULT_WORKERS, weighted=False, stats=None, journal=None):
+    import zip7stage
+    chunks = create_chunks(all_data, len(files), file_weights(files) if weighted else None)
+    plan = {'center': center, 'length': len(all_data), 'weighted': weighted, 'crc': zip7stage.data_crc(all_data)}
+    zip7stage.commit_batch(journal or default_journal(files), files, chunks, lambda file, data: file.inject(data, center), region(center), plan, jobs, stats=stats)
+
+# Like inject_files, but the data is `length` bytes read from stream as the files are staged, never all at once
+# Data on a pipe can't be checked against an interrupted run's up front, only piece by piece as it's staged
+def inject_stream(files, stream, length, center, jobs=zip7batch.DEFAULT_WORKERS, weighted=False, stats=None, journal=None):
+    import zip7stage, zip7stream
+    bounds = chunk_bounds(length, len(files), file_weights(files) if weighted else None)
+    chunks, unordered = zip7stream.split_stream(stream, [end - start for start, end in bounds])
+    crc = zip7stage.data_crc(zip7.StreamData(stream, length, stream.tell())) if unordered else None
+    plan = {'center': center, 'length': length, 'weighted': weighted, 'crc': crc}
+    # A pipe can only be read in order, so its pieces have to be staged one file at a time
+    zip7stage.commit_batch(journal or default_journal(files), files, chunks, lambda file, data: file.inject(data, center), region(center), plan, jobs, not unordered, stats)
+
+# Striping in proportion to file size keeps the share of steg data in each file about the same
+def file_weights(files):
+    return [os.path.getsize(file) for file in files]
+
+def region(center):
+    return 'center' if center else 'bottom'
+
+# For dividing up data among i chunks; yields zero-copy views of data, in order
+# Split ~equally by default, or in proportion to weights (e.g. the size of each file the chunk goes into)
+def create_chunks(data, i, weights=None):
+    with memoryview(data) as view:
+        for start, end in chunk_bounds(len(view), i, weights):
+            yield view[start:end]
+
+# The (start, end) of each chunk of length bytes split i ways; each chunk gets its share of what's left, so the
+# last one absorbs the rounding
+def chunk_bounds(length, i, weights=None):
+    if weights is not None and not sum(weights):
+        weights = None
+    remaining_weight = sum(weights) if weights is not None else i
+    start = 0
+    for n in range(i):
+        weight = weights[n] if weights is not None else 1
+        end = start + (length - start) * weight // remaining_weight if remaining_weight else length
+        yield start, end
+        remaining_weight -= weight
+        start = end
+
+# Yields each file's steganographic data in order; files are parsed and read concurrently
+def extract_files(files, center, jobs=zip7batch.DEFAULT_WORKERS, cache=None, stats=None):
+    return zip7batch.imap_ordered(lambda file: extract_file(file, center, cache, stats), files, jobs)
+
+def extract_file(file_name, center, cache=None, stats=None):
+    # With a cache, the steg location of unchanged files is already known: just read it
+    # Anything the cache can't vouch for (errors, bad magic) goes through Zip7 below, to fail the usual way
+    if cache:
+        record = cache.scan_file(file_name)
+        if not record['error'] and record['magic'] == zip7.Zip7.MAGIC.hex():
+            start, length = (record['center_start'], record['center_length']) if center else (record['bottom_start'], record['bottom_length'])
+            with zip7volumes.VolumeSet.open(file_name) as volumes:
+                data = volumes.read_at(start, length)
+            if stats:
+                stats.add_read(len(data))
+            return data
+    with zip7.Zip7(file_name, lazy=True, stats=stats) as file:
+        data = bytes(extract(file, center))
+    if stats:
+        stats.add_read(len(data))
     return data
 
 def extract(file, center):
@@ -115,9 +221,8 @@ def extract(file, center):
         return file.steg.bottom_data
 
 def get_path_info(path):
-    folder = '\\'.join(path.split('\\')[:-1]) or os.getcwd()
-    folder = os.path.abspath(folder) + '\\'
-    file_pattern = ''.join(path.split('\\')[-1])
+    folder, file_pattern = os.path.split(path)
+    folder = os.path.join(os.path.abspath(folder or os.getcwd()), '')
     return folder, file_pattern
 
 if __name__ == "__main__":
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+import os
+import sys
+
+"""
+One entry point for all of the scripts, as subcommands: 7ztool.py COMMAND [OPTIONS] ...
+Only the script behind the command being run is imported (and with it argparse and the core library), so help and
+usage errors cost next to nothing. serve runs a command over archive paths read from stdin, one per line, so the
+interpreter starts (and everything is imported) once for a whole stream of archives rather than once per archive
+"""
+
+# Command -> (module, description)
+COMMANDS = {
+    'parse': ('parse7z', 'retrieve file metadata for 7z files (parse7z.py)'),
+    'fix': ('fix_header', 'fix header metadata for 7z files (fix_header.py)'),
+    'steg': ('7zsteg', 'inject or extract steganographic data (7zsteg.py)'),
+    'create': ('create7z', 'create 7z files from files and folders (create7z.py)'),
+}
+SERVE = 'serve'
+USAGE = """usage: {prog} COMMAND [OPTIONS] ...
+       {prog} serve [-0] COMMAND [OPTIONS]
+
+Runs one of the 7z scripts; {prog} COMMAND --help shows the options of each.
+
+commands:
+{commands}
+  serve     run COMMAND (with OPTIONS) on every archive path read from stdin, in one process"""
+
+
+def usage(prog):
+    commands = '\n'.join('  %-9s %s' % (name, description) for name, (module, description) in COMMANDS.items())
+    return USAGE.format(prog=prog, commands=commands)
+
+
+# Run a command's main() with argv, returning its exit code; argparse exits (--help, bad options) are returned too,
+# so a server keeps going
+def run(command, argv, prog):
+    module = __import__(COMMANDS[command][0])
+    try:
+        return module.main(argv, '%s %s' % (prog, command)) or 0
+    except SystemExit as e:
+        return e.code if isinstance(e.code, int) else int(e.code is not None)
+
+
+# Archive paths from stream: one per line, or NUL-separated (e.g. from find -print0)
+def read_paths(stream, null=False):
+    if not null:
+        for line in stream:
+            path = line.rstrip('\n')
+            if path:
+                yield path
+        return
+    pending = b''
+    for chunk in iter(lambda: stream.buffer.read(1 << 16), b''):
+        pending += chunk
+        *paths, pending = pending.split(b'\0')
+        for path in paths:
+            if path:
+                yield os.fsdecode(path)
+    if pending:
+        yield os.fsdecode(pending)
+
+
+# Run command on each path from stdin in turn, flushing its output after every archive so it can be consumed as it
+# comes; an archive that fails is reported on stderr and the rest carry on. Exits with 1 if any of them failed
+def serve(argv, prog):
+    import argparse
+    parser = argparse.ArgumentParser(prog='%s %s' % (prog, SERVE), description='Runs COMMAND on every archive path read from stdin, in one process.')
+    parser.add_argument('-0', '--null', action='store_true', help='paths are separated by NUL characters (find -print0) instead of newlines')
+    parser.add_argument('command', metavar='COMMAND', choices=list(COMMANDS), help='command to run: %s' % ', '.join(COMMANDS))
+    parser.add_argument('options', metavar='OPTIONS', nargs=argparse.REMAINDER, help='options for COMMAND, used for every archive')
+    args = vars(parser.parse_args(argv))
+
+    failed = False
+    for path in read_paths(sys.stdin, args['null']):
+        try:
+            code = run(args['command'], args['options'] + ['--', path], prog)
+        except BrokenPipeError:
+            raise
+        except Exception as e:
+            print('%s: Error: %s: %s' % (path, type(e).__name__, e), file=sys.stderr)
+            code = 1
+        failed = failed or bool(code)
+        sys.stdout.flush()
+    return int(failed)
+
+
+def main():
+    prog = os.path.basename(sys.argv[0])
+    argv = sys.argv[1:]
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage(prog))
+        return 0 if argv else 1
+    command, argv = argv[0], argv[1:]
+    try:
+        if command == SERVE:
+            return serve(argv, prog)
+        if command not in COMMANDS:
+            print('Unknown command %s (expected one of %s, %s). QUITTING' % (command, ', '.join(COMMANDS), SERVE))
+            return 1
+        return run(command, argv, prog)
+    except BrokenPipeError:
+        # Whatever was reading the output (e.g. head) has gone away; point stdout at nothing so exit stays quiet
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+import argparse
+import os
+import zip7
+import zip7writer
+
+"""
+For building new 7z archives out of files and folders, without 7-Zip (e.g. carriers for 7zsteg.py)
+Files are LZMA2 compressed into one solid folder by default; with --folders, they're spread over more folders, which
+are compressed in parallel (-j)
+"""
+
+DEFAULT_JOBS = os.cpu_count() or 1
+
+def main(argv=None, prog=None):
+    # Set up argparse
+    parser = argparse.ArgumentParser(prog=prog, description='Creates 7z files from files and folders.')
+    parser.add_argument('file', metavar='FILENAME', type=str, help='7zip file to create')
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+', help='files and folders (recursively) to put in it')
+    parser.add_argument('--folders', metavar='N', type=int, default=1, help='spread the files over N folders (0 for one per file); DEFAULT 1 (solid)')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS, help='folders to compress in parallel; DEFAULT %d' % DEFAULT_JOBS)
+    parser.add_argument('-l', '--level', type=int, choices=range(10), default=zip7writer.DEFAULT_PRESET, metavar='0-9', help='compression level; DEFAULT %d' % zip7writer.DEFAULT_PRESET)
+    parser.add_argument('--plain-header', action='store_true', help='Do not compress the header')
+    parser.add_argument('-f', '--force', action='store_true', help='Overwrite FILENAME if it exists')
+    parser.add_argument('--stats', action='store_true', help='Show timings and bytes read/written')
+
+    # Use argparse for... arg parsing
+    args = vars(parser.parse_args(argv))
+    file_name = args['file']
+    stats = zip7.Zip7Stats(trace_memory=True) if args['stats'] else None
+
+    if os.path.exists(file_name) and not args['force']:
+        print('%s already exists (use -f to overwrite it). QUITTING' % file_name)
+        return 1
+    missing = [path for path in args['paths'] if not os.path.exists(path)]
+    if missing:
+        print('Not found: %s. QUITTING' % ', '.join(missing))
+        return 1
+
+    members = zip7writer.collect(args['paths'])
+    try:
+        folders = zip7writer.write_members(file_name, members, args['folders'] or None, args['level'], args['jobs'], not args['plain_header'], stats)
+    except zip7.Zip7UnimplementedException as e:
+        print('%s QUITTING' % e)
+        return 1
+
+    unpacked = sum(folder[1] for folder in folders)
+    print('%s: %d files in %d folders, 0x%x bytes (0x%x unpacked)' % (file_name, len(members), len(folders), os.path.getsize(file_name), unpacked))
+    if stats:
+        for name, value in stats.report():
+            print('%-21s %s' % (name, value))
+
+
+if __name__ == "__main__":
+    main()
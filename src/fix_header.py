@@ -1,44 +1,136 @@
 #!/usr/bin/python3
 import argparse
-import zip7
+import os
 import struct
+import zip7
+import zip7batch
+import zip7scan
 
 """
 For fixing broken headers (i.e., primarily CRCs)
 Also intended as a primer to see how to make a script using the zip7 core library
+Any number of files (or folders of them) can be checked in one go: only broken headers are rewritten
 """
 
-def main():
+# Versions (minor; the major is always 0) that 7-Zip has written; anything else is replaced by DEFAULT_VERSION
+KNOWN_VERSIONS = {2, 3, 4}
+DEFAULT_VERSION = 4
+HEADER_FIELDS = ['magic', 'version', 'header_crc', 'footer_crc']
+# How checking or fixing a file can fail; each is reported against the file, and the batch goes on
+# (the parser raises garbled or truncated metadata as Zip7FileException)
+FILE_ERRORS = (OSError, zip7.Zip7FileException, zip7.Zip7UnimplementedException, zip7.Zip7UnknownException)
+
+def main(argv=None, prog=None):
     # Set up argparse
-    parser = argparse.ArgumentParser(description='Fixes header metadata for 7z files.')
-    parser.add_argument('file', metavar='FILENAME', type=str, help='7zip file that needs to be fixed')
+    parser = argparse.ArgumentParser(prog=prog, description='Fixes header metadata for 7z files.')
+    parser.add_argument('file', metavar='FILENAME', type=str, nargs='+', help='7zip file that needs to be fixed (or files and folders of them, with -i, -O or -n)')
     parser.add_argument('-o', '--out-file', default='out.7z', help='Output file name for fixed 7z file')
+    parser.add_argument('-O', '--out-dir', help='Write fixed copies of broken files into OUT_DIR (under their own names)')
+    parser.add_argument('-i', '--in-place', action='store_true', help='Fix FILENAME itself, rewriting only its header')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='Only report what would be changed; nothing is written')
+    parser.add_argument('-j', '--jobs', type=int, default=zip7batch.DEFAULT_WORKERS, help='files to check/fix concurrently; DEFAULT %d' % zip7batch.DEFAULT_WORKERS)
+    parser.add_argument('--pattern', type=str, default=zip7scan.DEFAULT_PATTERN, help='names of the files to fix in folders; DEFAULT %s' % zip7scan.DEFAULT_PATTERN)
+    parser.add_argument('--version', type=int, help='Version to write; DEFAULT the existing one if it is valid, otherwise %d' % DEFAULT_VERSION)
+    parser.add_argument('--stats', action='store_true', help='Show timings, bytes read/written and other parser statistics')
 
     # Use argparse for... arg parsing
-    args = vars(parser.parse_args())
-    file_name = args['file']
+    args = vars(parser.parse_args(argv))
+    paths = args['file']
     out_file = args['out_file']
+    out_dir = args['out_dir']
+    in_place = args['in_place']
+    dry_run = args['dry_run']
+    version = args['version']
+    stats = zip7.Zip7Stats(trace_memory=True) if args['stats'] else None
 
-    # Open the file into the 7zip file class
-    try:
-        file = zip7.Zip7(file_name)
-    except FileNotFoundError:
-        print("File not found. QUITTING")
+    # A single file can go to -o; anything more has to be fixed in place or into a folder
+    batch = len(paths) > 1 or os.path.isdir(paths[0])
+    if batch and not (in_place or out_dir or dry_run):
+        print("Fixing more than one file needs -i, -O or -n. QUITTING")
         return 1
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+
+    def fix(file_name):
+        if in_place or dry_run:
+            target = None
+        elif out_dir:
+            target = os.path.join(out_dir, os.path.basename(file_name))
+        else:
+            target = out_file
+        return file_name, fix_file(file_name, target, dry_run, version, stats)
+
+    # Checked on a thread pool: the work is all CRCs and small reads and writes, which don't hold the GIL
+    counts = dict.fromkeys(['checked', 'broken', 'fixed', 'errors'], 0)
+    for file_name, (status, changes) in zip7batch.imap_ordered(fix, zip7scan.iter_archives(paths, args['pattern']), args['jobs']):
+        counts['checked'] += 1
+        counts['broken'] += status != 'error' and bool(changes)
+        counts['fixed'] += status == 'fixed'
+        counts['errors'] += status == 'error'
+        if status == 'error':
+            print('%s: Error: %s' % (file_name, changes))
+        elif not changes:
+            print('%s: OK' % file_name)
+        else:
+            print('%s: %s (%s)' % (file_name, 'would fix' if dry_run else 'fixed', ', '.join(describe_change(name, old, new) for name, old, new in changes)))
+    if batch:
+        print('%(checked)d checked, %(broken)d broken, %(fixed)d fixed, %(errors)d errors' % counts)
+
+    if stats:
+        for name, value in stats.report(zip7.Zip7.OPCODE_NAMES):
+            print('%-21s %s' % (name, value))
+
+def describe_change(name, old, new):
+    if name in ('header_crc', 'footer_crc'):
+        return '%s 0x%x -> 0x%x' % (name, old, new)
+    return '%s %r -> %r' % (name, old, new)
+
+# Check one file, and unless it's intact (or this is a dry run) fix it: in place, or into target
+# Returns (status, changes): status is 'ok', 'broken' (not written), 'fixed' or 'error' (changes is then the message),
+# and changes lists (field, old value, new value) for every header field that is (or would be) rewritten
+def fix_file(file_name, target=None, dry_run=False, version=None, stats=None):
+    # An interrupted patch is rolled back first; a dry run only says it's there, since recovering rewrites the file
+    if dry_run and os.path.exists(zip7.journal_name(file_name)):
+        return 'error', 'Interrupted patch left %s; run without -n to recover it.' % zip7.journal_name(file_name)
+    try:
+        zip7.Zip7.recover(file_name)
+        # Unmapped, since only the header and footer are read (and, for copies, the rest is copied file to file)
+        file = zip7.Zip7(file_name, ignore_magic=True, lazy=True, mapped=False, stats=stats)
+    except FILE_ERRORS as e:
+        return 'error', str(e)
+
+    try:
+        old = {name: getattr(file.header, name) for name in HEADER_FIELDS}
+        new_version = version if version is not None else (old['version'] if old['version'] in KNOWN_VERSIONS else DEFAULT_VERSION)
+        if file.header.header_crc_valid and file.header.footer_crc_valid and old['magic'] == file.MAGIC and new_version == old['version']:
+            return 'ok', []
 
-    # Recreate the header from scratch
-    file.header.magic = file.MAGIC
-    file.header.version = 4
-    file.header.footer_start = file.header.footer_start - file.HEADER_LEN
-    file.header.footer_length = file.header.footer_length
+        # Recreate the header from scratch
+        file.header.magic = file.MAGIC
+        file.header.version = new_version
+        file.header.footer_start = file.header.footer_start - file.HEADER_LEN
+        file.header.footer_length = file.header.footer_length
+        file.update_header()
+        file.update_crcs()
+        file.header.header_crc, = struct.unpack('<I', file.header.data[0x8:0xC])
+        file.header.footer_crc, = struct.unpack('<I', file.header.data[0x1C:file.HEADER_LEN])
+        changes = [(name, old[name], getattr(file.header, name)) for name in HEADER_FIELDS if getattr(file.header, name) != old[name]]
 
-    # Save the file
-    file.update_header()
-    file.save(file_name=out_file, update_crcs=True)
-    print('Fixed file output saved to: %s' % out_file)
+        # Save the file
+        if dry_run:
+            return 'broken', changes
+        if target is None:
+            file.patch(update_crcs=False)
+        else:
+            file.save(file_name=target, update_crcs=False)
+        return 'fixed', changes
+    except FILE_ERRORS as e:
+        return 'error', str(e)
+    finally:
+        file.close()
 
 
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,11 +1,16 @@
 #!/usr/bin/python3
 import argparse
+import os
+import sys
 import zip7
+import zip7batch
+import zip7scan
 
 """
 For extracting metadata about 7z files.
 
 The library parses more data than is displayed below; tweak as necessary.
+Modules only some modes need (CSV/JSON output, the cache, verification, anomaly scoring) are imported when used.
 """
 
 DIVIDER = '====================================='
@@ -31,33 +36,108 @@ Center Data - - - - - {center_data}
 Bottom Start- - - - - 0x{bottom_start:x}
 Bottom Length - - - - 0x{bottom_length:x}
 Bottom Data - - - - - {bottom_data}"""
+PRINT_VERIFY = """--------- CRC Verification ----------"""
+PRINT_STATS = """------------ Statistics -------------"""
+LABEL_WIDTH = 22
 
-def main():
+
+# Pad a label out to the value column the same way as the templates above
+def label(name):
+    return name + ''.join('-' if i % 2 == 0 else ' ' for i in range(len(name), LABEL_WIDTH)) if len(name) < LABEL_WIDTH else name + ' '
+
+
+def describe_check(check):
+    if check.error:
+        return 'Error: %s' % check.error
+    if not check.valid:
+        return 'False (0x%x, expected 0x%x)' % (check.actual, check.expected)
+    return 'True (0x%x bytes, %.1f MB/s)' % (check.length, check.rate)
+
+
+# Stream one line per archive, as JSON or CSV, as soon as each one has been scanned
+# In CSV, lists (e.g. pack_sizes) are joined with spaces, and anything not in fields is left out
+def write_scan(records, output_format, out, fields=zip7scan.FIELDS):
+    import csv, json
+    if output_format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+    for record in records:
+        if output_format == 'csv':
+            for name in fields:
+                if isinstance(record[name], list):
+                    record[name] = ' '.join(str(value) for value in record[name])
+            writer.writerow(record)
+        else:
+            out.write(json.dumps(record) + '\n')
+        out.flush()
+
+
+def main(argv=None, prog=None):
     # Set up argparse
-    parser = argparse.ArgumentParser(description='Retrieves file metadata for 7z files.')
-    parser.add_argument('file', metavar='FILENAME', type=str, help='7zip file for parsing')
+    parser = argparse.ArgumentParser(prog=prog, description='Retrieves file metadata for 7z files.')
+    parser.add_argument('file', metavar='FILENAME', type=str, nargs='+', help='7zip file for parsing (or files and folders, with --scan)')
     parser.add_argument('-H', default=False, action='store_true', help='Show only header information')
     parser.add_argument('-F', default=False, action='store_true', help='Show only footer information')
     parser.add_argument('-B', default=False, action='store_true', help='Show only body information')
     parser.add_argument('-S', default=False, action='store_true', help='Show only steg information')
+    parser.add_argument('-V', '--verify', default=False, action='store_true', help='Verify every stored CRC (decompresses the archive)')
+    parser.add_argument('-j', '--jobs', type=int, default=zip7batch.DEFAULT_WORKERS, help='threads to verify folders (or scan archives) on; DEFAULT %d' % zip7batch.DEFAULT_WORKERS)
+    parser.add_argument('-R', '--scan', default=False, action='store_true', help='Scan files and folders (recursively), reading only headers and footers')
+    parser.add_argument('-A', '--anomalies', default=False, action='store_true', help='Rank files and folders (recursively) by how suspicious their center and bottom data look')
+    parser.add_argument('--top', metavar='N', type=int, help='with --anomalies, only report the N highest scoring archives')
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl', help='scan (or anomaly report) output format; DEFAULT jsonl')
+    parser.add_argument('--cache', metavar='CACHE_FILE', type=str, help='with --scan, keep parsed metadata in CACHE_FILE and skip archives that have not changed')
+    parser.add_argument('--stats', default=False, action='store_true', help='Show timings, bytes read and other parser statistics (on stderr with --scan or --anomalies)')
+    parser.add_argument('--pattern', type=str, default=zip7scan.DEFAULT_PATTERN, help='names of the files to scan in folders; DEFAULT %s' % zip7scan.DEFAULT_PATTERN)
 
     # Use argparse for... arg parsing
-    args = vars(parser.parse_args())
-    file_name = args['file']
+    args = vars(parser.parse_args(argv))
+    stats = zip7.Zip7Stats(trace_memory=True) if args['stats'] else None
+    if args['scan'] or args['anomalies']:
+        cache = None
+        if args['cache'] and args['scan']:
+            import zip7cache
+            cache = zip7cache.MetadataCache(args['cache'])
+        try:
+            if args['anomalies']:
+                import zip7anomaly
+                # Ranking needs every score first, so nothing is written until the whole sweep is done
+                write_scan(zip7anomaly.rank(args['file'], args['pattern'], args['jobs'], args['top'], stats), args['format'], sys.stdout, zip7anomaly.FIELDS)
+            else:
+                write_scan(zip7scan.scan(args['file'], args['pattern'], args['jobs'], cache, stats), args['format'], sys.stdout)
+        except BrokenPipeError:
+            # Whatever was reading the output (e.g. head) has gone away; point stdout at nothing so exit stays quiet
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        finally:
+            if cache:
+                cache.close()
+        # Statistics go to stderr, so they don't end up mixed in with the records
+        if stats:
+            for name, value in stats.report(zip7.Zip7.OPCODE_NAMES):
+                print(label(name) + value, file=sys.stderr)
+        return 0
+    if len(args['file']) > 1:
+        print("Only one file can be parsed at a time (use --scan or --anomalies for more). QUITTING")
+        return 1
+    file_name = args['file'][0]
     show_header = args['H']
     show_footer = args['F']
     show_body = args['B']
     show_steg = args['S']
-    # If none specified, then all
-    if not show_header and not show_footer and not show_body and not show_steg:
+    show_verify = args['verify']
+    # If none specified, then all (but verification, which reads the whole archive, only when asked for)
+    if not show_header and not show_footer and not show_body and not show_steg and not show_verify:
         show_header = show_footer = show_body = show_steg = True
 
-    # Open the file into the 7zip file class
+    # Open the file into the 7zip file class; lazily, since only metadata is needed
     try:
-        file = zip7.Zip7(file_name)
+        file = zip7.Zip7(file_name, lazy=True, stats=stats)
     except FileNotFoundError:
         print("File not found. QUITTING")
         return 1
+    except (zip7.Zip7FileException, zip7.Zip7UnimplementedException, zip7.Zip7UnknownException) as e:
+        print("%s QUITTING" % e)
+        return 1
 
     ## Print out all of the relevant parsed information
     # Print out header information
@@ -80,7 +160,7 @@ def main():
         footer_data = {
             'data_offset': file.footer.data_offset,
             'pack_sizes': str(['0x%x'%size for size in file.footer.pack_size]).replace("'",''),
-            'compression': file.footer.encoders[0].encoding
+            'compression': file.footer.encoders[0].encoding if file.footer.num_encoders else ''
         }
         print(PRINT_FOOTER.format(**footer_data))
     # Print out body information
@@ -96,14 +176,37 @@ def main():
         steg_data = {
             'center_start': file.steg.center_start,
             'center_length': file.steg.center_length,
-            'center_data': file.steg.center_data,
+            'center_data': bytes(file.steg.center_data),
             'bottom_start': file.steg.bottom_start,
             'bottom_length': file.steg.bottom_length,
-            'bottom_data': file.steg.bottom_data,
+            'bottom_data': bytes(file.steg.bottom_data),
         }
         print(PRINT_STEG.format(**steg_data))
+    # Print out CRC verification results
+    if show_verify:
+        print(DIVIDER)
+        print(PRINT_VERIFY)
+        import time, zip7verify
+        started = time.perf_counter()
+        with file.phase('verify'):
+            checks = zip7verify.verify(file, args['jobs'])
+        seconds = time.perf_counter() - started
+        if stats:
+            stats.add_read(len(file.data))
+        for check in checks:
+            print(label(check.name) + describe_check(check))
+        # Overall throughput is over the whole archive, in wall clock time (folders are checked concurrently)
+        valid = sum(check.valid for check in checks)
+        print(label('Checks Valid') + '%d/%d (0x%x bytes, %.1f MB/s)' % (valid, len(checks), len(file.data), len(file.data) / seconds / 1e6 if seconds else 0.0))
+    # Print out parser statistics
+    if stats:
+        print(DIVIDER)
+        print(PRINT_STATS)
+        for name, value in stats.report(zip7.Zip7.OPCODE_NAMES):
+            print(label(name) + value)
     # Print final divider
     print(DIVIDER)
+    file.close()
 
 
 if __name__ == "__main__":
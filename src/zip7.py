@@ -1,11 +1,28 @@
 from zip7helpers import *
+from zip7io import *
+from zip7codec import decompress, decode_folder_task, FolderReader, MemberReader
+import zip7batch
+from zip7volumes import VolumeSet, base_name, is_volume
+from collections import OrderedDict
+import threading
+import os
+import sys
+from array import array
+from itertools import accumulate
 import zlib
 import struct
+import mmap
+from contextlib import nullcontext
 
 '''
 Core 7z file parser. Has a decent bit of unimplemented functionality: CTRL-F "UnimplementedException"
 '''
 
+# Stands in for a stats phase when there are no stats to record to
+NO_STATS = nullcontext()
+# What garbled or truncated metadata can make the parsing code itself trip over; these are raised as Zip7FileException
+PARSE_ERRORS = (struct.error, ValueError, IndexError, KeyError, OverflowError)
+
 class Zip7(object):
     # Constants related to the file format
     MAGIC = b'7z\xBC\xAF\x27\x1C'
@@ -14,16 +31,49 @@ class Zip7(object):
         0x21: 'LZMA2'
     }
     HEADER_LEN = 0x20
+    # Flips a bitmap of 0/1 bytes, e.g. EmptyStream bits into which files have a stream
+    INVERT_BITMAP = bytes.maketrans(b'\x00\x01', b'\x01\x00')
 
     ## Predefining some object types for the IDE
     data = bytes()
 
     # Constructor
-    def __init__(self, file_name, ignore_magic=False):
+    def __init__(self, file_name, ignore_magic=False, lazy=False, mapped=True, data=None, stats=None):
         self.file_name = file_name
+        self.lazy = lazy
+        # Optional Zip7Stats to record phase timings, bytes read/written and opcode counts into
+        self.stats = stats
+        # Where each region came from, as (data, offset); unmodified regions can be copied straight from the source
+        self.source_regions = dict()
         # Open file and grab data
-        with open(file_name, 'rb') as z:
-            self.data = z.read()
+        # Lazy mode maps the file instead, so only the pages that actually get touched (header, footer) are read
+        # The source stays open in lazy mode: saves copy unmodified regions from it, even after it gets replaced
+        # With mapped=False, lazy mode reads the regions with pread as they're sliced instead, which is cheaper than
+        # setting up a map when only the header and footer will be looked at (e.g. scanning many archives)
+        # Data that is already at hand (bytes, or anything that slices like them) can be handed over instead of a file
+        # Split archives (name.7z.001, ...) are read across their volumes in place; lazily, only as they're sliced
+        self.source = None
+        self.volumes = None
+        with self.phase('read'):
+            if data is not None:
+                self.data = data
+            elif is_volume(file_name):
+                self.volumes = VolumeSet.open(file_name)
+                if lazy:
+                    self.data = self.volumes.range()
+                else:
+                    with self.volumes:
+                        self.data = self.volumes.read_at(0, len(self.volumes))
+                    if stats:
+                        stats.add_read(len(self.data))
+            elif lazy:
+                self.source = open(file_name, 'rb')
+                self.data = self.map_file(self.source) if mapped else self.range_file(self.source)
+            else:
+                with open(file_name, 'rb') as z:
+                    self.data = z.read()
+                if stats:
+                    stats.add_read(len(self.data))
 
         # Verify the file is 7zip
         test_magic = self.data[:len(self.MAGIC)]
@@ -31,214 +81,651 @@ class Zip7(object):
             if test_magic != self.MAGIC:
                 raise Zip7FileException('Not a 7zip file.')
 
-        # Initialize dataclass objects
+        # Initialize model objects
         self.header = Header()
         self.header.magic = test_magic
         self.footer = Footer()
+        self._decoded_footer = None
         self.body = Body()
         self.steg = Steg()
 
         # Perform various data parsing to populate the class information
-        self.parse_header()
-        self.parse_footer()
-        self.parse_body()
-        self.parse_steg()
+        # Whatever way that fails, the file isn't left open behind an object nobody gets to close
+        try:
+            self.parse_header()
+            self.parse_footer()
+            self.parse_body()
+            self.parse_steg()
+        except BaseException as e:
+            self.close()
+            if isinstance(e, PARSE_ERRORS):
+                raise Zip7FileException('Malformed archive (%s: %s).' % (type(e).__name__, e)) from e
+            raise
+        # Lazily, only the header and footer have been read so far
+        if stats and (lazy or data is not None):
+            stats.add_read(self.HEADER_LEN + self.header.footer_length)
+
+    # Time a phase into self.stats; does nothing (at next to no cost) without stats
+    def phase(self, name):
+        return self.stats.phase(name) if self.stats else NO_STATS
+
+    # Context manager support, mostly so lazy-mode maps get closed deterministically
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def map_file(file):
+        try:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # mmap refuses zero-length files
+            raise Zip7FileException('Empty files cannot be 7zip files.')
+
+    @staticmethod
+    def range_file(file):
+        length = os.fstat(file.fileno()).st_size
+        if not length:
+            raise Zip7FileException('Empty files cannot be 7zip files.')
+        return FileRange(file.fileno(), 0, length)
+
+    # Get a slice of the file; in lazy mode, this is a zero-copy view that is only read from disk when accessed
+    def region(self, start, end):
+        if hasattr(self.data, 'window'):
+            return self.data.window(start, end)
+        if self.lazy:
+            return memoryview(self.data)[start:end]
+        return self.data[start:end]
+
+    # Release the file map (lazy mode only); any views handed out by region() are unusable afterwards
+    def close(self):
+        if self.volumes:
+            self.volumes.close()
+        if not self.lazy or not self.source or self.source.closed:
+            return
+        views = [data for data, offset in self.source_regions.values()]
+        for view in views + [self.body.data, self.steg.center_data, self.steg.bottom_data]:
+            if isinstance(view, memoryview):
+                view.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.source.close()
 
     ## Parsing the various parts of the file to <think of word later, propoagat einfo basically>
     def parse_header(self):
+        with self.phase('parse_header'):
+            self.read_header()
+
+    def read_header(self):
         # Extract information about the file and footer from the header
         self.header.data = data = self.data[:self.HEADER_LEN]
         self.header.version = struct.unpack('>H', data[0x6:0x8])[0]
         self.header.header_crc = struct.unpack('<I', data[0x8:0xC])[0]
         self.header.header_crc_valid = (self.header.header_crc == zlib.crc32(data[0xC:self.HEADER_LEN]))
         # The following footer information comes FROM the header
-        self.header.footer_start = self.HEADER_LEN + struct.unpack('<Q', data[0xC:0x14])[0]
-        self.header.footer_length = struct.unpack('<Q', data[0x14:0x1C])[0]
+        self.header.footer_start, self.header.footer_length = self.footer_location(data)
         self.header.footer_crc = struct.unpack('<I', data[0x1C:self.HEADER_LEN])[0]
         # Populate the footer data and use it to validate the footer CRC
         self.footer.data = self.data[self.header.footer_start:self.header.footer_start + self.header.footer_length]
-        self.header.footer_crc_valid = (self.header.footer_crc == zlib.crc32(self.footer.data))
-
-    def parse_footer(self):
-        self.footer.stream = Zip7ByteStream(self.footer.data)
-        while not self.footer.stream.eof():
-            opcode = self.footer.stream.read_int()
-            #print('%02x' % opcode)
-            self.footer_process(opcode)
-
-    # Process the footer opcodes
-    def footer_process(self, opcode):
-        if len(self.footer.expected):
-            if opcode not in self.footer.expected:
-                raise Zip7UnknownException('Invalid opcode pattern (%02x came after %02x).' % (opcode, self.footer.stream._stream[self.footer.stream._cursor-2]))
-
-        self.footer.expected = []
-        # kEnd
-        if opcode == 0x00: # End the current block
-            return
-        # Header
-        if opcode == 0x01: # Unpacked header section
-            self.footer.type = "Unpacked"
-            self.footer.expected = [0x04] # MainStreamsInfo
-            return
-        # MainStreamsInfo
-        if opcode == 0x04: # Unpacked header follow-up data
-            self.footer.expected = [0x06] # PackInfo
-            return
-        # FilesInfo
-        if opcode == 0x05: # Get file data when it's available within the footer
-            self.footer.num_files = self.footer.stream.read_number()
-            self.footer.expected = [0x0E, 0x0F, 0x19]
-            return
-        # PackInfo
-        if opcode == 0x06: # The second byte following 0x17 - PackedHeader
-            self.footer.data_offset = self.footer.stream.read_number()
-            # Read more bytes to determine how many streams there are
-            self.footer.stream_count = self.footer.stream.read_int()
-            self.footer.expected = [0x09]
-            return
-        # UnpackInfo
-        if opcode == 0x07:
-            self.footer.expected = [0x0B] # Folder
-            return
-        # kSize
-        if opcode == 0x09:
-            for i in range(self.footer.stream_count):
-                self.footer.pack_size.append(self.footer.stream.read_number())
-            self.footer.expected = [0x00]
-            return
-        # UnpackDigest/CRC
-        if opcode == 0x0A:
-            crc_bool = self.footer.stream.read_int()
-            if not crc_bool:
-                raise Zip7UnimplementedException('CRC Boolean is false, not implemented.')
-
-            self.body.crc = self.footer.stream.read(4)
-            self.footer.expected = [0x00]
-            return
-        # Folder
-        if opcode == 0x0B:
-            self.footer.folders = self.footer.stream.read_int()
-            # Determine if the folder is external
-            external = self.footer.stream.read_bool()
-            if external:
-                raise Zip7UnimplementedException("External folders are not implemented.")
-            else:
-                # Get the number of encoders
-                self.footer.num_encoders = self.footer.stream.read_number()
-
-            # Iterate through the encoders for their information
-            self.footer.encoders = list()
-            for i in range(self.footer.num_encoders):
-                # Create the encoder dictionary and append it to the encoders
-                enc = Encoder()
-                self.footer.encoders.append(enc)
-
-                # Get the encoder flag and then break apart its bitmask properties
-                enc.flag = self.footer.stream.read_int()
-                enc.flag_size = enc.flag & 0b00001111
-                enc.flag_complex = enc.flag & 0b00010000
-                enc.flag_attributes = enc.flag & 0b00100000
-                enc.flag_reserved = enc.flag & 0b11000000
-
-                # Get the number of encodings used
-                if enc.flag_complex:
-                    raise Zip7UnimplementedException('Complex encoders are not implemented.')
-
-                # Get the encoder
-                padding = 4 - enc.flag_size
-                enc.encoding_id = self.footer.stream.read_int(enc.flag_size, endian='big')
-
-                if enc.encoding_id not in self.ACCEPTED_ENCODINGS.keys():
-                    raise Zip7UnimplementedException('Only LZMA & LZMA2 compression supported.')
-                enc.encoding = self.ACCEPTED_ENCODINGS[enc.encoding_id]
-
-                # TODO: Maybe. NumInStreams/NumOutStreams are for Complex Codecs only - Skipping
-                # Address attributes/properties
-                if enc.flag_attributes:
-                    enc.properties_count = self.footer.stream.read_number()
-                    enc.properties = self.footer.stream.read(enc.properties_count) # "Dangerous" but no real harm
-
-            # Next up: either CoderUnpackSize, UnpackDigest, or END
-            self.footer.expected = [0x0C, 0x0A, 0x00]
-            return
-        # EncoderUnpackSize
-        if opcode == 0x0C:
-            self.footer.encoder_unpack_size = self.footer.stream.read_number()
-            # TODO: Strangely, I've found 7z's that have extra data here until 0x0A? But 0x0A is optional
-            # No GOOD fix really addresses it. For now, just skip them until getting to 0x0A
-            # If anyone knows anything about this, please let me know!
-            while self.footer.stream.read_int() != 0x0A:
-                if self.footer.stream.eof():
-                    raise Zip7UnknownException('Files without UnpackDigest CRCs not supported due to weird bug.')
-
-            return self.footer_process(0x0A)
-        # FileName
-        if opcode == 0x11:
-            # Get the length of the file's name
-            name_len = self.footer.stream.read_number()
-            external = self.footer.stream.read_bool()
-            if external:
-                raise Zip7UnimplementedException('External FileName Streams are not implemented.')
-
-            self.footer.file_name = self.footer.stream.read(name_len - 1).decode('utf-16')
-            self.expected = [0x00, 0x14, 0x19]
-            return
-        # MTime
-        if opcode == 0x14:
-            # Get the length of MTime
-            mtime_size = self.footer.stream.read_number()
-            external = self.footer.stream.read_bool()
-            if external:
-                self.footer.mtime_info = self.footer.stream.read(mtime_size-1)
-            else:
-                raise Zip7UnimplementedException('Internal MTime values not implemented.')
-
-            self.footer.expected = [0x12, 0x13, 0x15]
-            return
-        # Attributes
-        if opcode == 0x15:
-            # Get attribute length
-            attribute_size = self.footer.stream.read_number()
-            external = self.footer.stream.read_bool()
-            if external:
-                self.footer.attribute_info = self.footer.stream.read(attribute_size-1)
-            else:
-                raise Zip7UnimplementedException('Internal Attribute values not implemented.')
-
-            self.footer.expected = [0x00]
-            return
-        # EncodedHeader
-        if opcode == 0x17:
-            self.footer.type = "Packed"
-            self.footer.expected = [0x06]
-            return
-        # "Dummy" AKA nop
-        if opcode == 0x19:
-            nop_count = self.footer.stream.read_number()
-            for i in range(nop_count):
-                test_data = self.footer.stream.read_int()
-                if test_data != 0x00:
-                    raise Zip7FileException('Data found which should have been 0x00s for nopping: %02x' % test_data)
-            # Perhaps I should have expected follow-ups here, but I don't know where all nop can go
-            return
-
-        # Many opcodes aren't usually in 7zip, and so are not implemented here
-        if opcode in self.UNIMPLEMENTED:
-            raise Zip7UnknownException('Opcode %02x not implemented or maybe invalid.' % opcode)
-
+        self.source_regions['header'] = (self.header.data, 0)
+        self.source_regions['footer'] = (self.footer.data, self.header.footer_start)
+        with self.phase('crc'):
+            self.header.footer_crc_valid = (self.header.footer_crc == zlib.crc32(self.footer.data))
+
+    # Where the footer is, as (absolute start, length), from the 32-byte start header alone
+    @classmethod
+    def footer_location(cls, data):
+        return cls.HEADER_LEN + struct.unpack('<Q', data[0xC:0x14])[0], struct.unpack('<Q', data[0x14:0x1C])[0]
+
+    def parse_footer(self, footer=None):
+        footer = footer or self.footer
+        footer.parse = FooterParse(Zip7ByteStream(footer.data), opcodes={} if self.stats else None)
+        try:
+            with self.phase('parse_footer'):
+                while not footer.parse.stream.eof():
+                    opcode = footer.parse.stream.read_int()
+                    #print('%02x' % opcode)
+                    self.footer_process(opcode, footer)
+        except PARSE_ERRORS as e:
+            raise Zip7FileException('Malformed footer near offset 0x%x (%s: %s).' % (footer.parse.stream._cursor, type(e).__name__, e)) from e
+        finally:
+            if self.stats:
+                self.stats.add_opcodes(footer.parse.opcodes)
+            footer.parse = None
+
+    # Process the footer opcodes, through the handlers registered in FOOTER_OPCODES
+    # A handler may return another opcode to process straight away (instead of reading one from the stream)
+    def footer_process(self, opcode, footer=None):
+        footer = footer or self.footer
+        while opcode is not None:
+            if footer.parse.opcodes is not None:
+                footer.parse.opcodes[opcode] = footer.parse.opcodes.get(opcode, 0) + 1
+            if len(footer.parse.expected):
+                if opcode not in footer.parse.expected:
+                    raise Zip7UnknownException('Invalid opcode pattern (%02x came after %02x).' % (opcode, footer.parse.stream._stream[footer.parse.stream._cursor-2]))
+
+            if opcode not in self.FOOTER_OPCODES:
+                # FilesInfo properties all carry their size, so the ones that aren't parsed can just be skipped
+                if footer.parse.sections[-1:] == ['FilesInfo']:
+                    footer.parse.stream.read(footer.parse.stream.read_number())
+                    footer.parse.expected = []
+                    return
+                # Many opcodes aren't usually in 7zip, and so are not implemented here
+                raise Zip7UnknownException('Opcode %02x not implemented or maybe invalid.' % opcode)
+            handler, successors = self.FOOTER_OPCODES[opcode]
+            footer.parse.expected = list(successors or [])
+            opcode = handler(self, footer)
+
+    ## Footer opcode handlers; each gets the Footer being parsed, and is registered in FOOTER_OPCODES below
+    # Sections are tracked on footer.parse.sections, since some property IDs (kSize, kCRC) mean different things in each
+    # kEnd
+    def footer_end(self, footer): # End the current block
+        section = footer.parse.sections.pop() if footer.parse.sections else None
+        if section in ('SubStreamsInfo', 'MainStreamsInfo', 'EncodedHeader'):
+            self.finish_substreams(footer)
+        elif section == 'FilesInfo':
+            self.finish_files(footer)
+
+    # Folders holding a single stream don't list its size/CRC in SubStreamsInfo (nor need SubStreamsInfo at all)
+    def finish_substreams(self, footer):
+        if not footer.substream_sizes:
+            for folder in footer.folder_info:
+                if folder.num_unpack_streams == 1:
+                    footer.substream_sizes.append(folder.unpack_size)
+        if not footer.substream_crcs:
+            for folder in footer.folder_info:
+                if folder.num_unpack_streams == 1:
+                    footer.substream_crcs.append(folder.crc)
+                else:
+                    footer.substream_crcs.extend([None] * folder.num_unpack_streams)
+
+    # Once FilesInfo is complete: tell directories from empty files, and place each file with data in its folder
+    # Built a column at a time, since archives can hold hundreds of thousands of files
+    def finish_files(self, footer):
+        files = footer.files
+        empty_files = iter(footer.parse.empty_files)
+        files.is_dir = bytearray(0 if has_stream else not next(empty_files, False) for has_stream in files.has_stream)
+
+        # Per stream, in order: its folder, index within the folder, and offset within the folder's data
+        folders = list()
+        streams = list()
+        offsets = list()
+        sizes = footer.substream_sizes
+        for folder_index, folder in enumerate(footer.folder_info):
+            first = len(streams)
+            if folder.num_unpack_streams:
+                offsets.append(0)
+                offsets.extend(accumulate(sizes[first: first + folder.num_unpack_streams - 1]))
+                offsets.extend([offsets[-1]] * (len(streams) + folder.num_unpack_streams - len(offsets)))
+            folders.extend([folder_index] * folder.num_unpack_streams)
+            streams.extend(range(folder.num_unpack_streams))
+        sizes = list(sizes) + [0] * (len(streams) - len(sizes))
+        crcs = list(footer.substream_crcs) + [None] * (len(streams) - len(footer.substream_crcs))
+
+        # The stream each file gets, in order; files without data (or left over once the streams run out) get -1,
+        # and the leftovers keep folder -1 for member_layout() to report
+        numbers = iter(range(len(streams)))
+        file_streams = [next(numbers, -1) if has_stream else -1 for has_stream in files.has_stream]
+        files.folder = int64_array([folders[s] if s >= 0 else -1 for s in file_streams])
+        files.stream = uint64_array([streams[s] if s >= 0 else 0 for s in file_streams])
+        files.offset = uint64_array([offsets[s] if s >= 0 else 0 for s in file_streams])
+        files.size = uint64_array([sizes[s] if s >= 0 else 0 for s in file_streams])
+        file_crcs = [crcs[s] if s >= 0 else None for s in file_streams]
+        files.crc = uint32_array([crc or 0 for crc in file_crcs])
+        files.crc_defined = bytearray(crc is not None for crc in file_crcs)
+
+    # Header
+    def footer_header(self, footer): # Unpacked header section
+        footer.type = "Unpacked"
+        footer.parse.sections.append('Header')
+
+    # MainStreamsInfo
+    def footer_main_streams_info(self, footer): # Unpacked header follow-up data
+        footer.parse.sections.append('MainStreamsInfo')
+
+    # FilesInfo
+    def footer_files_info(self, footer): # Get file data when it's available within the footer
+        footer.parse.sections.append('FilesInfo')
+        footer.num_files = footer.parse.stream.read_number()
+        footer.files = FileTable.allocate(footer.num_files)
+
+    # PackInfo
+    def footer_pack_info(self, footer): # The second byte following 0x17 - PackedHeader
+        footer.parse.sections.append('PackInfo')
+        footer.data_offset = footer.parse.stream.read_number()
+        # Read more bytes to determine how many streams there are
+        footer.stream_count = footer.parse.stream.read_number()
+
+    # UnpackInfo
+    def footer_unpack_info(self, footer):
+        footer.parse.sections.append('UnpackInfo')
+
+    # SubStreamsInfo
+    def footer_substreams_info(self, footer):
+        footer.parse.sections.append('SubStreamsInfo')
+
+    # kSize: pack stream sizes in PackInfo, or the sizes of all but the last substream of each folder in SubStreamsInfo
+    def footer_size(self, footer):
+        if footer.parse.sections[-1:] == ['SubStreamsInfo']:
+            for folder in footer.folder_info:
+                if not folder.num_unpack_streams:
+                    continue
+                sizes = footer.parse.stream.read_numbers(folder.num_unpack_streams - 1)
+                footer.substream_sizes.extend(sizes)
+                footer.substream_sizes.append(folder.unpack_size - sum(sizes))
+        else:
+            footer.pack_size.extend(footer.parse.stream.read_numbers(footer.stream_count))
+
+    # UnpackDigest/CRC
+    def footer_crc(self, footer):
+        section = footer.parse.sections[-1:]
+        if section == ['UnpackInfo']:
+            crcs = self.read_crcs(footer, footer.folders)
+            for folder, crc in zip(footer.folder_info, crcs):
+                folder.crc = crc
+            if footer is self.footer and crcs and crcs[0] is not None:
+                self.body.crc = struct.pack('<I', crcs[0])
+        elif section == ['SubStreamsInfo']:
+            # Folders holding a single stream with a known CRC don't repeat it here
+            known = [folder.num_unpack_streams == 1 and folder.crc is not None for folder in footer.folder_info]
+            crcs = self.read_crcs(footer, sum(folder.num_unpack_streams for folder, skip in zip(footer.folder_info, known) if not skip))
+            footer.substream_crcs = list()
+            position = 0
+            for folder, skip in zip(footer.folder_info, known):
+                if skip:
+                    footer.substream_crcs.append(folder.crc)
+                else:
+                    footer.substream_crcs.extend(crcs[position: position + folder.num_unpack_streams])
+                    position += folder.num_unpack_streams
+        else:
+            footer.pack_crcs = self.read_crcs(footer, footer.stream_count)
+
+    # Digests: a flag for whether all are defined (else a bit vector of which ones are), then a CRC for each defined one
+    def read_crcs(self, footer, count):
+        all_defined = footer.parse.stream.read_int()
+        defined = [True] * count if all_defined else footer.parse.stream.read_bits(count)
+        crcs = self.read_uint_array(footer.parse.stream, 'I', sum(defined))
+        if all_defined:
+            return crcs.tolist()
+        crcs = iter(crcs)
+        return [next(crcs) if is_defined else None for is_defined in defined]
+
+    # count little endian unsigned integers of the typecode's size, read in one go
+    @staticmethod
+    def read_uint_array(stream, typecode, count):
+        values = array(typecode)
+        raw = stream.read(values.itemsize * count)
+        if len(raw) != values.itemsize * count:
+            raise Zip7FileException('Ran out of data reading 0x%x values (0x%x bytes found).' % (count, len(raw)))
+        values.frombytes(raw)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return values
+
+    # Folder
+    def footer_folder(self, footer):
+        footer.folders = footer.parse.stream.read_number()
+        # Determine if the folder is external
+        external = footer.parse.stream.read_bool()
+        if external:
+            raise Zip7UnimplementedException("External folders are not implemented.")
+
+        footer.folder_info = [self.read_folder(footer) for i in range(footer.folders)]
+        if footer.folder_info:
+            footer.encoders = footer.folder_info[0].encoders
+            footer.num_encoders = len(footer.encoders)
+
+    def read_folder(self, footer):
+        folder = Folder()
+        # Get the number of encoders
+        num_encoders = footer.parse.stream.read_number()
+
+        # Iterate through the encoders for their information
+        for i in range(num_encoders):
+            # Get the encoder flag and then break apart its bitmask properties
+            flag = footer.parse.stream.read_int()
+            flag_size = flag & 0b00001111
+            flag_complex = flag & 0b00010000
+            flag_attributes = flag & 0b00100000
+            flag_reserved = flag & 0b11000000
+
+            # Get the encoder
+            encoding_id = footer.parse.stream.read_int(flag_size, endian='big')
+
+            if encoding_id not in self.ACCEPTED_ENCODINGS.keys():
+                raise Zip7UnimplementedException('Only LZMA & LZMA2 compression supported.')
+
+            # NumInStreams/NumOutStreams are for Complex Codecs only, which LZMA/LZMA2 never are
+            if flag_complex:
+                raise Zip7UnimplementedException('Complex encoders are not implemented.')
+            # Address attributes/properties
+            property_count = 0
+            properties = b''
+            if flag_attributes:
+                property_count = footer.parse.stream.read_number()
+                properties = footer.parse.stream.read(property_count) # "Dangerous" but no real harm
+
+            # Encoders are frozen, so each is only created once it has been read in full (and only once per footer)
+            encoder = Encoder(flag, flag_size, flag_complex, flag_attributes, flag_reserved, encoding_id,
+                              self.ACCEPTED_ENCODINGS[encoding_id], property_count, properties)
+            folder.encoders.append(footer.parse.encoders.setdefault(encoder, encoder))
+
+        # With simple coders, each has one input and one output; chained coders are joined up by bind pairs
+        for i in range(num_encoders - 1):
+            folder.bind_pairs.append((footer.parse.stream.read_number(), footer.parse.stream.read_number()))
+        bound = {in_index for in_index, out_index in folder.bind_pairs}
+        unbound = [i for i in range(num_encoders) if i not in bound]
+        if len(unbound) == 1:
+            folder.packed_streams = uint64_array(unbound)
+        else:
+            folder.packed_streams = uint64_array(footer.parse.stream.read_numbers(len(unbound)))
+        return folder
+
+    # CodersUnpackSize: the size of every coder's output, for each folder
+    def footer_encoder_unpack_size(self, footer):
+        for folder in footer.folder_info:
+            folder.unpack_sizes = uint64_array(footer.parse.stream.read_numbers(len(folder.encoders)))
+        if footer.folder_info:
+            footer.encoder_unpack_size = footer.folder_info[0].unpack_size
+
+    # NumUnpackStream: how many files each folder holds
+    def footer_num_unpack_stream(self, footer):
+        for folder in footer.folder_info:
+            folder.num_unpack_streams = footer.parse.stream.read_number()
+
+    # FileName
+    def footer_file_name(self, footer):
+        # Get the length of the file's name
+        name_len = footer.parse.stream.read_number()
+        external = footer.parse.stream.read_bool()
+        if external:
+            raise Zip7UnimplementedException('External FileName Streams are not implemented.')
+
+        footer.file_name = footer.parse.stream.read(name_len - 1).decode('utf-16')
+        footer.file_names = footer.file_name.split('\x00')[:footer.num_files]
+        files = footer.files
+        files.names[:len(footer.file_names)] = footer.file_names
+        # Built back to front, so a name appearing more than once maps to its first file
+        files.index = dict(zip(reversed(files.names), range(len(files.names) - 1, -1, -1)))
+
+    # EmptyStream: which files have no data at all (directories and empty files)
+    def footer_empty_stream(self, footer):
+        size = footer.parse.stream.read_number()
+        empty = Zip7ByteStream(footer.parse.stream.read(size)).read_bitmap(footer.num_files)
+        footer.files.has_stream = bytearray(empty.translate(self.INVERT_BITMAP))
+
+    # EmptyFile: which of the empty streams are files (the rest are directories)
+    def footer_empty_file(self, footer):
+        size = footer.parse.stream.read_number()
+        empty_streams = footer.num_files - sum(footer.files.has_stream)
+        footer.parse.empty_files = Zip7ByteStream(footer.parse.stream.read(size)).read_bits(empty_streams)
+
+    # File properties (times, attributes): a defined bit for each file, whether the values are stored elsewhere,
+    # then the values of the defined files, each typecode-sized (little endian)
+    # Returns the raw property data, the values as a column with one entry per file, and the defined mask
+    def read_file_property(self, footer, typecode):
+        data = footer.parse.stream.read(footer.parse.stream.read_number())
+        stream = Zip7ByteStream(data)
+        count = footer.num_files
+        defined = bytearray(b'\x01') * count if stream.read_int() else bytearray(stream.read_bitmap(count))
+        if stream.read_int():
+            raise Zip7UnimplementedException('External file properties are not implemented.')
+
+        values = self.read_uint_array(stream, typecode, sum(defined))
+        if len(values) == count:
+            return data, values, defined
+        values = iter(values)
+        return data, array(typecode, [next(values) if is_defined else 0 for is_defined in defined]), defined
+
+    # CTime
+    def footer_ctime(self, footer):
+        data, footer.files.ctime, footer.files.ctime_defined = self.read_file_property(footer, 'Q')
+
+    # ATime
+    def footer_atime(self, footer):
+        data, footer.files.atime, footer.files.atime_defined = self.read_file_property(footer, 'Q')
+
+    # MTime
+    def footer_mtime(self, footer):
+        footer.mtime_info, footer.files.mtime, footer.files.mtime_defined = self.read_file_property(footer, 'Q')
+
+    # Attributes
+    def footer_attributes(self, footer):
+        footer.attribute_info, footer.files.attributes, footer.files.attributes_defined = self.read_file_property(footer, 'I')
+
+    # EncodedHeader
+    def footer_encoded_header(self, footer):
+        footer.type = "Packed"
+        footer.parse.sections.append('EncodedHeader')
+
+    # "Dummy" AKA nop
+    def footer_dummy(self, footer):
+        nop_count = footer.parse.stream.read_number()
+        test_data = footer.parse.stream.read(nop_count).lstrip(b'\x00')
+        if test_data:
+            raise Zip7FileException('Data found which should have been 0x00s for nopping: %02x' % test_data[0])
+
+    # Footer opcode -> (handler, opcodes allowed to come next); None allows anything next
+    # Subclasses can support more property IDs by extending this table
+    FOOTER_OPCODES = {
+        0x00: (footer_end, None),
+        0x01: (footer_header, [0x04]), # MainStreamsInfo
+        0x04: (footer_main_streams_info, [0x06]), # PackInfo
+        0x05: (footer_files_info, None),
+        0x06: (footer_pack_info, [0x09]),
+        0x07: (footer_unpack_info, [0x0B]), # Folder
+        0x08: (footer_substreams_info, [0x0D, 0x09, 0x0A, 0x00]),
+        0x09: (footer_size, [0x0A, 0x00]),
+        0x0A: (footer_crc, [0x00]),
+        # Next up: CoderUnpackSize
+        0x0B: (footer_folder, [0x0C]),
+        0x0C: (footer_encoder_unpack_size, [0x0A, 0x00]),
+        0x0D: (footer_num_unpack_stream, [0x09, 0x0A, 0x00]),
+        0x0E: (footer_empty_stream, None),
+        0x0F: (footer_empty_file, None),
+        0x11: (footer_file_name, None),
+        # FilesInfo properties may come in any order
+        0x12: (footer_ctime, None),
+        0x13: (footer_atime, None),
+        0x14: (footer_mtime, None),
+        0x15: (footer_attributes, None),
+        0x17: (footer_encoded_header, [0x06]),
+        # Perhaps I should have expected follow-ups here, but I don't know where all nop can go
+        0x19: (footer_dummy, None)
+    }
+    # Opcode -> handler name (without footer_), for labeling opcode counts
+    OPCODE_NAMES = {opcode: handler.__name__[len('footer_'):] for opcode, (handler, successors) in FOOTER_OPCODES.items()}
+
+    ## Packed ("EncodedHeader") footers just point at the real header, which is compressed at the end of the body
+    # Decoded headers are cached by the CRC of the footer pointing at them, when they carry a CRC to verify against
+    DECODED_FOOTER_CACHE_SIZE = 256
+    decoded_footer_cache = OrderedDict()
+    decoded_footer_lock = threading.Lock()
+
+    # The real header of a packed footer, parsed like any other footer; decoded the first time it's used
+    @property
+    def decoded_footer(self):
+        if self.footer.type != 'Packed':
+            return None
+        if self._decoded_footer is None:
+            footer = Footer()
+            with self.phase('decode_footer'):
+                footer.data = self.decode_packed_footer()
+            self.parse_footer(footer)
+            self._decoded_footer = footer
+        return self._decoded_footer
+
+    # Whichever footer actually describes the archive's contents
+    @property
+    def archive_footer(self):
+        return self.decoded_footer or self.footer
+
+    def decode_packed_footer(self):
+        if not self.footer.folder_info:
+            raise Zip7FileException('Packed footer does not describe where the real header is.')
+        folder = self.footer.folder_info[0]
+        key = zlib.crc32(self.footer.data)
+        with self.decoded_footer_lock:
+            if key in self.decoded_footer_cache:
+                self.decoded_footer_cache.move_to_end(key)
+                return self.decoded_footer_cache[key]
+
+        # Stream the packed bytes through the decompressor, checking the CRC as it goes
+        if self.stats:
+            self.stats.add_read(sum(self.footer.pack_size))
+        data = bytearray()
+        crc = 0
+        for chunk in decompress(self.iter_folder(self.footer, 0), folder.encoders, folder.unpack_size):
+            data += chunk
+            crc = zlib.crc32(chunk, crc)
+        if folder.crc is not None and crc != folder.crc:
+            raise Zip7FileException('Packed footer CRC is invalid (0x%x, expected 0x%x).' % (crc, folder.crc))
+
+        data = bytes(data)
+        if folder.crc is not None:
+            with self.decoded_footer_lock:
+                self.decoded_footer_cache[key] = data
+                while len(self.decoded_footer_cache) > self.DECODED_FOOTER_CACHE_SIZE:
+                    self.decoded_footer_cache.popitem(last=False)
+        return data
+
+    ## Members (the files stored in the archive)
+    # The archive's FileTable: every member's name, location, size, CRC, times and attributes, as columns
+    @property
+    def files(self):
+        return self.archive_footer.files
+
+    # (name, is_dir, folder index, index within the folder, size, crc) for each member, in archive order
+    # Members without data (directories, empty files) have no folder: None
+    def member_layout(self):
+        return [self.member_entry(i) for i in range(len(self.files))]
+
+    def member_entry(self, i):
+        files = self.files
+        if not files.has_stream[i]:
+            return files.names[i], bool(files.is_dir[i]), None, 0, 0, None
+        if files.folder[i] < 0:
+            raise Zip7FileException('Footer describes more files with data than streams to hold them.')
+        return files.names[i], False, files.folder[i], files.stream[i], files.size[i], files.crc[i] if files.crc_defined[i] else None
+
+    def member_names(self):
+        return [name for name, is_dir, folder_index, index, size, crc in self.member_layout()]
+
+    def folder_reader(self, folder_index):
+        footer = self.archive_footer
+        folder = footer.folder_info[folder_index]
+        return FolderReader(decompress(self.iter_folder(footer, folder_index), folder.encoders, folder.unpack_size))
+
+    # Yields a file-like MemberReader for each member, in order, each folder being decompressed only once
+    # Since members of a solid folder come out one after another, whatever isn't read of one is skipped once the next is wanted
+    def iter_members(self):
+        folder_index = reader = None
+        for name, is_dir, member_folder, index, size, crc in self.member_layout():
+            if member_folder is None:
+                yield MemberReader(FolderReader([]), name, 0, None, is_dir)
+                continue
+            if member_folder != folder_index:
+                folder_index = member_folder
+                reader = self.folder_reader(folder_index)
+            member = MemberReader(reader, name, size, crc, is_dir)
+            yield member
+            member.skip()
+
+    # A file-like MemberReader for one member; in a solid folder, the members ahead of it are decompressed and skipped
+    def open_member(self, name):
+        i = self.files.index.get(name)
+        if i is None:
+            raise Zip7FileException('No member named %s.' % name)
+        name, is_dir, folder_index, index, size, crc = self.member_entry(i)
+        if folder_index is None:
+            return MemberReader(FolderReader([]), name, 0, None, is_dir)
+
+        reader = self.folder_reader(folder_index)
+        reader.skip(self.files.offset[i])
+        return MemberReader(reader, name, size, crc, is_dir)
+
+    # Decompress every folder in a pool of worker processes, each reading its own packed range of the file on disk
+    # Yields (name, data) for each member in archive order, or (name, path) once written, if out_folder is given
+    # Without out_folder, each member's data comes back from its worker whole, so the largest has to fit in memory;
+    # with it, members are streamed to disk a chunk at a time
+    # Directories and empty files are handled here rather than in the workers
+    def extract_parallel(self, out_folder=None, workers=None):
+        from concurrent.futures import ProcessPoolExecutor
+        workers = workers or os.cpu_count() or 1
+        footer = self.archive_footer
+        layout = self.member_layout()
+
+        # Each folder's members, by their index within it; folders nobody refers to aren't decoded at all
+        folder_members = dict()
+        for name, is_dir, folder_index, index, size, crc in layout:
+            if folder_index is not None:
+                folder_members.setdefault(folder_index, dict())[index] = (name, size, crc)
+        folder_indexes = sorted(folder_members)
+        tasks = list()
+        for folder_index in folder_indexes:
+            start, end = self.folder_range(footer, folder_index)
+            folder = footer.folder_info[folder_index]
+            members = folder_members[folder_index]
+            tasks.append((self.file_name, start, end, folder.encoders, folder.unpack_size, [members[index] for index in sorted(members)], out_folder))
+        results = zip(folder_indexes, zip7batch.imap_ordered(decode_folder_task, tasks, workers, executor=ProcessPoolExecutor))
+
+        # Folders come back in order; each one's results are kept (by member index) until its last member comes up
+        folder_results = dict()
+        for name, is_dir, member_folder, index, size, crc in layout:
+            if member_folder is None:
+                if out_folder is None:
+                    yield name, b''
+                    continue
+                path = member_path(out_folder, name)
+                if is_dir:
+                    os.makedirs(path, exist_ok=True)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    open(path, 'wb').close()
+                yield name, path
+                continue
+
+            while member_folder not in folder_results:
+                folder_index, outputs = next(results)
+                folder_results[folder_index] = dict(zip(sorted(folder_members[folder_index]), outputs))
+            outputs = folder_results[member_folder]
+            output = outputs.pop(index)
+            if not outputs:
+                folder_results[member_folder] = None
+            yield name, output
+
+    # Absolute (start, end) of the packed stream feeding a folder
+    def folder_range(self, footer, folder_index):
+        if len(footer.folder_info[folder_index].packed_streams) != 1:
+            raise Zip7UnimplementedException('Folders with more than one packed stream are not implemented.')
+        stream_index = sum(len(folder.packed_streams) for folder in footer.folder_info[:folder_index])
+        start = self.HEADER_LEN + footer.data_offset + sum(footer.pack_size[:stream_index])
+        return start, start + footer.pack_size[stream_index]
+
+    # The packed bytes of a folder, in chunks
+    def iter_folder(self, footer, folder_index, chunk_size=CHUNK_SIZE):
+        start, end = self.folder_range(footer, folder_index)
+        if end > len(self.data):
+            raise Zip7FileException('Packed stream runs past the end of the file.')
+        for position in range(start, end, chunk_size):
+            yield self.data[position: min(end, position + chunk_size)]
 
     def parse_body(self):
         self.body.length = self.footer.data_offset + sum(self.footer.pack_size)
-        self.body.data = self.data[0x20: 0x20 + self.body.length]
+        self.body.data = self.region(self.HEADER_LEN, self.HEADER_LEN + self.body.length)
+        self.source_regions['body'] = (self.body.data, self.HEADER_LEN)
 
     def parse_steg(self):
         self.steg.center_start = self.HEADER_LEN + self.body.length
         self.steg.center_length = self.header.footer_start - self.steg.center_start
-        self.steg.center_data = self.data[self.steg.center_start: self.steg.center_start + self.steg.center_length]
+        self.steg.center_data = self.region(self.steg.center_start, self.steg.center_start + self.steg.center_length)
         self.steg.bottom_start = self.header.footer_start + self.header.footer_length
         self.steg.bottom_length = len(self.data) - self.steg.bottom_start
-        self.steg.bottom_data = self.data[self.steg.bottom_start: self.steg.bottom_start + self.steg.bottom_length]
+        self.steg.bottom_data = self.region(self.steg.bottom_start, self.steg.bottom_start + self.steg.bottom_length)
+        self.source_regions['center'] = (self.steg.center_data, self.steg.center_start)
+        self.source_regions['bottom'] = (self.steg.bottom_data, self.steg.bottom_start)
 
     # Propagate changes made to self.header vars to the actual self.header.data
     def update_header(self):
@@ -250,28 +737,204 @@ class Zip7(object):
         data += struct.pack('<I', 0) # Footer CRC placeholder
         self.header.data = data
 
+    # Replace the steg data in the center (moving the footer along after it) or at the bottom, and rebuild the header
+    # Only meant once per open archive: the footer is moved relative to where it was parsed
+    def inject(self, data, center=True):
+        if center:
+            self.steg.center_data = data
+            self.header.footer_start = self.steg.center_start - self.HEADER_LEN + len(data)
+        else:
+            self.steg.bottom_data = data
+            # The footer stays put, but update_header() expects its offset relative to the end of the header
+            self.header.footer_start = self.header.footer_start - self.HEADER_LEN
+        self.update_header()
+
+    # The regions of the file, in the order they are written
+    def layout(self):
+        return [
+            ('header', self.header.data),
+            ('body', self.body.data),
+            ('center', self.steg.center_data),
+            ('footer', self.footer.data),
+            ('bottom', self.steg.bottom_data)
+        ]
+
+    # The layout as (name, data, offset) triples, plus the total length of the file it describes
+    def layout_offsets(self):
+        placed = list()
+        position = 0
+        for name, data in self.layout():
+            placed.append((name, data, position))
+            position += len(data)
+        return placed, position
+
+    def set_region(self, name, data):
+        if name == 'header':
+            self.header.data = data
+        elif name == 'body':
+            self.body.data = data
+        elif name == 'center':
+            self.steg.center_data = data
+        elif name == 'footer':
+            self.footer.data = data
+        elif name == 'bottom':
+            self.steg.bottom_data = data
+
+    # Record the current regions as what is on disk, once they have been written to self.file_name
+    def reset_source_regions(self):
+        placed, length = self.layout_offsets()
+        self.source_regions = {name: (data, offset) for name, data, offset in placed}
+
+    # Recalculate both CRCs in self.header.data from the current footer and header contents
+    def update_crcs(self):
+        with self.phase('crc'):
+            self.write_crcs()
+
+    def write_crcs(self):
+        mutable_header_data = bytearray(self.header.data)
+        new_footer_crc = struct.pack('<I', zlib.crc32(self.footer.data))
+        mutable_header_data[0x1C:self.HEADER_LEN] = new_footer_crc
+
+        new_header_crc = struct.pack('<I', zlib.crc32(mutable_header_data[0x0C:self.HEADER_LEN]))
+        mutable_header_data[0x08:0x0C] = new_header_crc
+        self.header.data = bytes(mutable_header_data)
+
+    # Write one region to fd, copying it file-to-file when it is still exactly what was read from the source
+    def write_region(self, fd, name, data):
+        source_data, offset = self.source_regions.get(name, (None, 0))
+        if data is source_data and self.source and not self.source.closed:
+            copy_range(self.source.fileno(), fd, offset, len(data))
+        else:
+            write_data(fd, data)
+
     # Commit changes (specifically: the .data sections) to the actual file (or a new file)
+    # Regions are streamed to a temp file that only replaces the target once complete
     def save(self, file_name='', file_overwrite=False, update_crcs=True):
+        with self.phase('save'):
+            self.write_file(file_name, file_overwrite, update_crcs)
+
+    def write_file(self, file_name='', file_overwrite=False, update_crcs=True):
         if not file_name:
             if not file_overwrite:
-                file_name = ''.join(self.file_name.split('.')[:-1]) + '_EDITED.7z'
+                file_name = ''.join(base_name(self.file_name).split('.')[:-1]) + '_EDITED.7z'
             else:
                 file_name = self.file_name
+        # Split archives are saved whole, to a file of their own: never over a volume that's still being read from
+        if self.volumes and os.path.abspath(file_name) in map(os.path.abspath, self.volumes.file_names):
+            raise Zip7UnimplementedException('Split archives can only be saved to a new file, not over their volumes.')
 
         # Fixing CRCs in the header if necessary
         if update_crcs:
-            mutable_header_data = bytearray(self.header.data)
-            new_footer_crc = struct.pack('<I', zlib.crc32(self.footer.data))
-            mutable_header_data[0x1C:self.HEADER_LEN] = new_footer_crc
-
-            new_header_crc = struct.pack('<I', zlib.crc32(mutable_header_data[0x0C:self.HEADER_LEN]))
-            mutable_header_data[0x08:0x0C] = new_header_crc
-            self.header.data = bytes(mutable_header_data)
-
-
-        write_data = self.header.data + self.body.data + self.steg.center_data + self.footer.data + self.steg.bottom_data
-        with open(file_name, 'wb+') as f:
-            f.write(write_data)
-
-
+            self.update_crcs()
+
+        with atomic_write(file_name) as fd:
+            for name, data in self.layout():
+                self.write_region(fd, name, data)
+        if self.stats:
+            self.stats.add_written(self.layout_offsets()[1])
+
+        # The source was replaced: copy from the new file from now on (the old map stays alive for existing views)
+        if os.path.abspath(file_name) == os.path.abspath(self.file_name):
+            self.reset_source_regions()
+            if self.source:
+                self.source.close()
+                self.source = open(self.file_name, 'rb')
+
+    # Commit changes to self.file_name in place, rewriting only the byte ranges that changed
+    # The header is patched on its own; everything from the first modified region onward is rewritten, since
+    # the regions after it may have moved (e.g. CRC fixes touch 32 bytes, bottom injection only the tail)
+    # The original bytes of those ranges are journaled first, so a failure part way through gets rolled back,
+    # and a crash can be undone with Zip7.recover()
+    def patch(self, update_crcs=True):
+        with self.phase('patch'):
+            self.patch_file(update_crcs)
+
+    def patch_file(self, update_crcs=True):
+        if update_crcs:
+            self.update_crcs()
+        writes, length, original_length = self.patch_ranges()
+        if not writes and length == original_length:
+            return
 
+        fd = os.open(self.file_name, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            if os.fstat(fd).st_size != original_length:
+                raise Zip7FileException('%s changed on disk since it was parsed.' % self.file_name)
+
+            # Journal the header and everything from the first rewritten region to the (original) end of file,
+            # copied over a chunk at a time
+            originals = list()
+            if writes and writes[0][0] == 'header':
+                originals.append((0, read_at(fd, 0, self.HEADER_LEN)))
+            tail_start = min([offset for name, data, offset in writes if name != 'header'] + [length])
+            if tail_start < original_length:
+                originals.append((tail_start, FileRange(fd, tail_start, original_length)))
+            placed = write_journal(self.file_name, originals, original_length)
+
+            with open(journal_name(self.file_name), 'rb') as journal:
+                # In lazy mode, a region that's only moving is still a view of bytes that may be overwritten before
+                # it's written out; those are copied from the journal instead, never through memory
+                moved = dict()
+                if self.lazy and self.source and tail_start < original_length:
+                    tail_position = placed[-1][0]
+                    for data, offset in self.source_regions.values():
+                        if offset >= tail_start and len(data):
+                            moved[id(data)] = StreamData(journal, len(data), tail_position + offset - tail_start)
+                writes = [(name, moved.get(id(data), data), offset) for name, data, offset in writes]
+                journaled = {name for name, data, offset in writes if isinstance(data, StreamData) and data.stream is journal}
+
+                try:
+                    apply_ranges(fd, [(offset, data) for name, data, offset in writes], length)
+                except BaseException:
+                    apply_ranges(fd, *read_journal(journal))
+                    remove_journal(self.file_name)
+                    raise
+            remove_journal(self.file_name)
+        finally:
+            os.close(fd)
+        if self.stats:
+            self.stats.add_written(sum(len(data) for name, data, offset in writes))
+
+        # Moved regions are read from where they are now
+        for name, data, offset in writes:
+            self.set_region(name, FileRange(self.source.fileno(), offset, offset + len(data)) if name in journaled else data)
+        self.reset_source_regions()
+
+    # What patch() would write: the header if it changed, and every region from the first one that changed (or moved)
+    # onward, as (name, data, offset), along with the new and the original length of the file
+    # In lazy mode, data may still be a view of the file itself
+    def patch_ranges(self):
+        if self.volumes:
+            raise Zip7UnimplementedException('Split archives cannot be patched in place; save() them to a new file.')
+        placed, length = self.layout_offsets()
+        original_length = max(offset + len(data) for data, offset in self.source_regions.values())
+
+        writes = list()
+        if self.header.data != self.source_regions['header'][0]:
+            writes.append(('header', self.header.data, 0))
+        changed = False
+        for name, data, offset in placed[1:]:
+            source_data, source_offset = self.source_regions[name]
+            changed = changed or data is not source_data or offset != source_offset
+            if changed:
+                writes.append((name, data, offset))
+        return writes, length, original_length
+
+    # Roll back an in-place patch() that was interrupted (e.g. by a crash) using its leftover journal
+    # Returns True if the file had to be restored
+    @staticmethod
+    def recover(file_name):
+        if not os.path.exists(journal_name(file_name)):
+            return False
+
+        with open(journal_name(file_name), 'rb') as f:
+            journal = read_journal(f)
+            # A torn journal means the crash happened before the file itself was touched
+            if journal is not None:
+                fd = os.open(file_name, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+                try:
+                    apply_ranges(fd, *journal)
+                finally:
+                    os.close(fd)
+        remove_journal(file_name)
+        return journal is not None
@@ -0,0 +1,198 @@
+import heapq
+import math
+from collections import Counter
+import zip7
+import zip7batch
+import zip7scan
+from zip7helpers import RegionProfile
+from zip7verify import iter_range
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Anomaly scoring for the regions of an archive that 7-Zip itself leaves empty: the center (between the packed body
+and the footer) and the bottom (the slack after footer_length)
+Each region is profiled in one pass over the mapped file, a chunk at a time: byte histogram, Shannon entropy, and
+the offsets of known file signatures. Archives are then ranked by score, so a large corpus can be triaged quickly
+NumPy is used when it's installed, for the histograms and to find signature candidates (around ten times faster);
+without it, the same is done with Counter and bytes.find
+"""
+
+# Magic numbers worth flagging when they turn up in steg data
+# Random data matches a 3-byte magic every 16 MiB or so, so those are only looked for at the start of a region
+SIGNATURES = [
+    ('7Z', b'7z\xbc\xaf\x27\x1c'),
+    ('ZIP', b'PK\x03\x04'),
+    ('RAR', b'Rar!\x1a\x07'),
+    ('GZIP', b'\x1f\x8b\x08'),
+    ('XZ', b'\xfd7zXZ\x00'),
+    ('BZIP2', b'BZh'),
+    ('PNG', b'\x89PNG\r\n\x1a\n'),
+    ('JPEG', b'\xff\xd8\xff'),
+    ('GIF', b'GIF8'),
+    ('PDF', b'%PDF-'),
+    ('ELF', b'\x7fELF'),
+    ('MACHO', b'\xcf\xfa\xed\xfe'),
+    ('CLASS', b'\xca\xfe\xba\xbe'),
+    ('SQLITE', b'SQLite format 3\x00'),
+    ('OPENSSL', b'Salted__'),
+    ('PGP', b'-----BEGIN PGP'),
+]
+ANYWHERE_LENGTH = 4
+LONGEST_SIGNATURE = max(len(magic) for name, magic in SIGNATURES)
+# Signatures by their first two bytes (as a little-endian 16-bit value), which is how candidates are found with NumPy
+SIGNATURE_PREFIXES = dict()
+for name, magic in SIGNATURES:
+    SIGNATURE_PREFIXES.setdefault(magic[0] | magic[1] << 8, []).append((name, magic))
+# Offsets kept per signature per region; any more are ignored (bounds memory on crafted data)
+MAX_HITS = 16
+
+## Score weights: a region scores log2(its length), scaled from 1/9 (all one byte value) up to 1 (8 bits of entropy per
+# byte, i.e. encrypted or compressed), plus SIGNATURE_WEIGHT per distinct signature (double if it starts the region)
+SIGNATURE_WEIGHT = 8.0
+# Per stored CRC that doesn't match: a sign of an archive edited by hand
+BAD_CRC_WEIGHT = 4.0
+
+REGIONS = ['center', 'bottom']
+# Column order for tabular (CSV) output; histograms only go into JSON
+FIELDS = ['rank', 'score', 'file', 'size', 'error', 'header_crc_valid', 'footer_crc_valid'] + [
+    '%s_%s' % (region, column) for region in REGIONS for column in ('start', 'length', 'entropy', 'signatures')
+]
+
+if numpy is not None:
+    PREFIX_TABLE = numpy.zeros(1 << 16, dtype=bool)
+    PREFIX_TABLE[list(SIGNATURE_PREFIXES)] = True
+
+
+# Shannon entropy of a histogram, in bits per byte (0 to 8)
+def entropy(counts):
+    total = sum(counts)
+    return sum(count / total * math.log2(total / count) for count in counts if count)
+
+
+# Where a signature might start in data: every position (in order) whose first two bytes begin one
+# Both 16-bit alignments are looked up in PREFIX_TABLE at once, which leaves a few hundred candidates per MiB of noise
+def candidates(data):
+    if numpy is None:
+        return sorted(position for name, magic in SIGNATURES for position in find_all(data, magic))
+    even = numpy.frombuffer(data, dtype='<u2', count=len(data) // 2)
+    odd = numpy.frombuffer(data, dtype='<u2', count=(len(data) - 1) // 2, offset=1)
+    positions = numpy.concatenate([numpy.flatnonzero(PREFIX_TABLE.take(even)) * 2, numpy.flatnonzero(PREFIX_TABLE.take(odd)) * 2 + 1])
+    positions.sort()
+    return positions.tolist()
+
+
+def find_all(data, magic):
+    position = data.find(magic)
+    while position >= 0:
+        yield position
+        position = data.find(magic, position + 1)
+
+
+# Byte histogram (256 counts) and signature hits, as (name, offset) pairs, of some chunks, in a single pass
+# Hits straddling two chunks are found through the tail of the previous chunk that is carried over
+def profile_chunks(chunks):
+    counts = numpy.zeros(256, dtype=numpy.int64) if numpy is not None else Counter()
+    hits = list()
+    found = Counter()
+    tail = b''
+    offset = 0
+    for chunk in chunks:
+        if numpy is not None:
+            counts += numpy.bincount(numpy.frombuffer(chunk, dtype=numpy.uint8), minlength=256)
+        else:
+            counts.update(chunk)
+
+        data = tail + bytes(chunk)
+        base = offset - len(tail)
+        for position in candidates(data):
+            for name, magic in SIGNATURE_PREFIXES.get(data[position] | data[position + 1] << 8, ()) if position + 1 < len(data) else ():
+                # Anything that ends inside the carried-over tail was already found in the previous chunk
+                if position + len(magic) <= len(tail) or found[name] >= MAX_HITS:
+                    continue
+                if (len(magic) >= ANYWHERE_LENGTH or base + position == 0) and data.startswith(magic, position):
+                    hits.append((name, base + position))
+                    found[name] += 1
+        offset += len(chunk)
+        tail = data[-(LONGEST_SIGNATURE - 1):]
+
+    histogram = counts.tolist() if numpy is not None else [counts[value] for value in range(256)]
+    return histogram, hits
+
+
+def score_region(profile):
+    if not profile.length:
+        return 0.0
+    score = math.log2(1 + profile.length) * (1 + profile.entropy) / 9
+    first = dict()
+    for name, offset in profile.signatures:
+        first[name] = min(offset, first.get(name, offset))
+    return score + sum(SIGNATURE_WEIGHT * (2 if offset == 0 else 1) for offset in first.values())
+
+
+# Profile data[start:start + length] in a single pass
+def profile_region(data, name, start, length):
+    profile = RegionProfile(name, start, max(0, length))
+    if profile.length:
+        profile.histogram, profile.signatures = profile_chunks(iter_range(data, start, start + profile.length))
+        profile.entropy = entropy(profile.histogram)
+    profile.score = score_region(profile)
+    return profile
+
+
+# Profiles of the center and bottom of an open Zip7, in file order
+def profile_archive(file):
+    with file.phase('profile'):
+        profiles = [
+            profile_region(file.data, 'center', file.steg.center_start, file.steg.center_length),
+            profile_region(file.data, 'bottom', file.steg.bottom_start, file.steg.bottom_length)
+        ]
+    if file.stats:
+        file.stats.add_read(sum(profile.length for profile in profiles))
+    return profiles
+
+
+def archive_score(file, profiles):
+    score = sum(profile.score for profile in profiles)
+    return score + BAD_CRC_WEIGHT * ((not file.header.header_crc_valid) + (not file.header.footer_crc_valid))
+
+
+# One flat record per archive, like zip7scan.scan_file()'s; archives that can't be parsed get their error instead
+def analyze_file(file_name, stats=None):
+    record = dict.fromkeys(FIELDS)
+    record.update({'file': file_name, 'score': 0.0})
+    try:
+        with zip7.Zip7(file_name, ignore_magic=True, lazy=True, stats=stats) as file:
+            profiles = profile_archive(file)
+            record.update({
+                'score': round(archive_score(file, profiles), 3),
+                'size': len(file.data),
+                'header_crc_valid': file.header.header_crc_valid,
+                'footer_crc_valid': file.header.footer_crc_valid
+            })
+            for profile in profiles:
+                record.update({
+                    profile.name + '_start': profile.start,
+                    profile.name + '_length': profile.length,
+                    profile.name + '_entropy': round(profile.entropy, 4),
+                    profile.name + '_signatures': ['%s@0x%x' % hit for hit in profile.signatures],
+                    profile.name + '_histogram': profile.histogram or None
+                })
+    # As with scans, a (possibly corrupt) archive that fails to parse is reported rather than ending the sweep
+    except Exception as e:
+        record['error'] = '%s: %s' % (type(e).__name__, e)
+    return record
+
+
+# Records for every archive under paths, highest score first (only the `top` highest, if given)
+# Archives are analyzed up to `workers` at a time; with top, only that many records are ever held
+def rank(paths, pattern=zip7scan.DEFAULT_PATTERN, workers=zip7batch.DEFAULT_WORKERS, top=None, stats=None):
+    records = zip7batch.imap_ordered(lambda file_name: analyze_file(file_name, stats), zip7scan.iter_archives(paths, pattern), workers)
+    key = lambda record: record['score']
+    ranked = heapq.nlargest(top, records, key) if top else sorted(records, key=key, reverse=True)
+    for i, record in enumerate(ranked):
+        record['rank'] = i + 1
+    return ranked
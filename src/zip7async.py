@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import weakref
+import zip7
+import zip7batch
+import zip7verify
+from concurrent.futures import ThreadPoolExecutor
+
+"""
+asyncio front end for the core library
+Every blocking step (opening and parsing, reading regions, CRCs, saving) runs on a bounded thread pool, so an event
+loop can juggle thousands of archives without stalling and without a thread per archive
+Archives are always opened lazily: only the header and footer are read up front, the rest only when awaited
+"""
+
+DEFAULT_LIMIT = 256
+
+
+# The pool blocking work runs on, plus a cap on how much of it may be queued up at once
+# One runner is meant to be shared by every archive an application has open; the cap then holds across all of them
+class Zip7Runner(object):
+    def __init__(self, workers=zip7batch.DEFAULT_WORKERS, limit=DEFAULT_LIMIT):
+        self.workers = workers
+        self.limit = limit
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        # Semaphores belong to a single event loop (and older Pythons bind them on creation): one per loop
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    # Run func(*args, **kwargs) on the pool; waits its turn while `limit` calls are already queued or running
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.semaphores[loop] = asyncio.Semaphore(self.limit)
+        async with semaphore:
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+
+_default_runner = None
+
+
+# The runner used when none is given, created on first use
+def default_runner():
+    global _default_runner
+    if _default_runner is None:
+        _default_runner = Zip7Runner()
+    return _default_runner
+
+
+# An open Zip7 whose blocking operations are awaited rather than called
+# The parsed metadata (header, footer, body, steg) is plain data and can be read directly; anything that touches the
+# file goes through the runner
+class AsyncZip7(object):
+    def __init__(self, file, runner=None):
+        self.file = file
+        self.runner = runner or default_runner()
+
+    @classmethod
+    async def open(cls, file_name, ignore_magic=False, mapped=True, runner=None):
+        runner = runner or default_runner()
+        file = await runner.run(zip7.Zip7, file_name, ignore_magic=ignore_magic, lazy=True, mapped=mapped)
+        return cls(file, runner)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self.runner.run(self.file.close)
+
+    @property
+    def file_name(self):
+        return self.file.file_name
+
+    @property
+    def header(self):
+        return self.file.header
+
+    @property
+    def footer(self):
+        return self.file.footer
+
+    @property
+    def body(self):
+        return self.file.body
+
+    @property
+    def steg(self):
+        return self.file.steg
+
+    ## Regions, read from disk on the pool (the views Zip7 hands out in lazy mode are only paged in when copied)
+    async def read_body(self):
+        return await self.runner.run(bytes, self.file.body.data)
+
+    async def read_center(self):
+        return await self.runner.run(bytes, self.file.steg.center_data)
+
+    async def read_bottom(self):
+        return await self.runner.run(bytes, self.file.steg.bottom_data)
+
+    async def read_steg(self, center=True):
+        return await (self.read_center() if center else self.read_bottom())
+
+    # Packed headers are decompressed the first time they're needed
+    async def archive_footer(self):
+        return await self.runner.run(getattr, self.file, 'archive_footer')
+
+    async def files(self):
+        return await self.runner.run(getattr, self.file, 'files')
+
+    async def read_member(self, name):
+        return await self.runner.run(lambda: self.file.open_member(name).read())
+
+    ## Changes; the steg data is replaced through Zip7.inject, as 7zsteg does (so only once per open archive)
+    def inject(self, data, center=True):
+        self.file.inject(data, center)
+
+    async def update_crcs(self):
+        await self.runner.run(self.file.update_crcs)
+
+    async def save(self, file_name='', file_overwrite=False, update_crcs=True):
+        await self.runner.run(self.file.save, file_name, file_overwrite, update_crcs)
+
+    async def patch(self, update_crcs=True):
+        await self.runner.run(self.file.patch, update_crcs)
+
+    # Every stored CRC, as zip7verify.verify() checks them; a single pool slot is used for the whole archive
+    async def verify(self):
+        return await self.runner.run(zip7verify.verify, self.file)
+
+    @staticmethod
+    async def recover(file_name, runner=None):
+        return await (runner or default_runner()).run(zip7.Zip7.recover, file_name)
+
+
+# Opens (and closes) each archive in turn for func, an async function of an AsyncZip7, running them all concurrently
+# Returns func's results in input order; at most `limit` archives are open at any one time
+async def map_archives(func, file_names, limit=DEFAULT_LIMIT, runner=None, ignore_magic=False, mapped=True):
+    runner = runner or default_runner()
+    semaphore = asyncio.Semaphore(limit)
+
+    async def process(file_name):
+        async with semaphore:
+            async with await AsyncZip7.open(file_name, ignore_magic, mapped, runner) as file:
+                return await func(file)
+
+    return await asyncio.gather(*[process(file_name) for file_name in file_names])
@@ -0,0 +1,31 @@
+import os
+from collections import deque
+
+"""
+Batch helpers for running the core library over many archives at once
+Threads are enough for most of it: the work is mostly file I/O and zlib, both of which release the GIL
+"""
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+
+# Like map(), but func runs on a thread pool and results are yielded in input order as soon as each is ready
+# At most `window` calls are in flight at a time, so memory stays bounded no matter how many items there are
+# CPU-bound work can pass executor=ProcessPoolExecutor instead (func and items must then be picklable)
+def imap_ordered(func, items, workers=DEFAULT_WORKERS, window=0, executor=None):
+    if executor is None:
+        from concurrent.futures import ThreadPoolExecutor as executor
+    window = window or workers * 2
+    pending = deque()
+    with executor(max_workers=workers) as pool:
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # The consumer stopped early (or something failed): don't start anything that hasn't started yet
+            for future in pending:
+                future.cancel()
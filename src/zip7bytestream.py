@@ -1,5 +1,22 @@
 import struct
 
+# Precompiled unpackers for the common integer widths; anything else goes through int.from_bytes
+_STRUCTS = {
+    'little': {1: struct.Struct('<B'), 2: struct.Struct('<H'), 4: struct.Struct('<I'), 8: struct.Struct('<Q')},
+    'big': {1: struct.Struct('>B'), 2: struct.Struct('>H'), 4: struct.Struct('>I'), 8: struct.Struct('>Q')}
+}
+
+# For 7z 'numbers': the count of leading 1 bits in the first byte is how many extra bytes follow it,
+# and the rest of the first byte holds the highest bits of the value (none are left once it's 8)
+_EXTRA_BYTES = bytes(8 - (b ^ 0xFF).bit_length() for b in range(256))
+_HIGH_MASKS = tuple(0xFF >> (1 + extra) if extra < 8 else 0 for extra in range(9))
+# The extra bytes are read as one 8 byte word when there's room, then masked down to size
+_LOW_MASKS = tuple((1 << (8 * extra)) - 1 for extra in range(9))
+_UINT64 = _STRUCTS['little'][8]
+# Each byte value spelled out as 8 bytes of 0/1, most significant bit first, for unpacking bit vectors in bulk
+_BITMAPS = [bytes((b >> (7 - i)) & 1 for i in range(8)) for b in range(256)]
+
+
 class Zip7ByteStream(object):
     _cursor = 0
     _stream = b''
@@ -7,10 +24,24 @@ class Zip7ByteStream(object):
 
     def __init__(self, data=b''):
         self._stream = data
-        self._length = len(data)
+        self._view = memoryview(data).cast('B')
+        self._length = len(self._view)
+
+    # Bad input raises Zip7FileException (imported here rather than at the top, as zip7helpers imports this module)
+    @staticmethod
+    def _error(message):
+        from zip7helpers import Zip7FileException
+        return Zip7FileException(message)
+
+    # The error for running out of data at cursor (by default, the current position)
+    def _short(self, count, what, cursor=None):
+        cursor = self._cursor if cursor is None else cursor
+        return self._error('Not enough data left for %s at offset 0x%x (0x%x bytes needed, 0x%x left).' % (what, cursor, count, max(0, self._length - cursor)))
 
     def read(self, count=1, dont_advance_cursor=False):
-        data = self._stream[self._cursor: self._cursor + count]
+        if count < 0 or self._cursor + count > self._length:
+            raise self._short(count, '%d bytes' % count)
+        data = bytes(self._view[self._cursor: self._cursor + count])
         if not dont_advance_cursor:
             self._cursor += count
         return data
@@ -20,34 +51,90 @@ class Zip7ByteStream(object):
         if count == 0:
             # There are algorithmic reasons why read_int(0) might be called, so just return 0 for them
             return 0
-
-        data = self.read(count)
-        if count not in [i+1 for i in range(8)]:
-            raise Exception("Valid integer lengths: 1-8")
-
-        padding = (8 - count) * b'\x00'
-        if endian == 'big':
-            data = padding + data
-            return struct.unpack('>Q', data)[0]
-        elif endian == 'little':
-            data += padding
-            return struct.unpack('<Q', data)[0]
-        else:
+        if not 0 < count <= 8:
+            raise self._error('Valid integer lengths: 1-8 (0x%x at offset 0x%x).' % (count, self._cursor))
+        if endian not in _STRUCTS:
             raise Exception('Valid endian choices: big, little')
 
+        cursor = self._cursor
+        if cursor + count > self._length:
+            raise self._short(count, 'a %d byte integer' % count)
+        self._cursor = cursor + count
+        unpacker = _STRUCTS[endian].get(count)
+        if unpacker:
+            return unpacker.unpack_from(self._view, cursor)[0]
+        return int.from_bytes(self._view[cursor: self._cursor], endian)
+
     def read_bool(self):
-        data = self.read()
-        return struct.unpack('?', data)[0]
+        if self._cursor >= self._length:
+            raise self._short(1, 'a bool')
+        self._cursor += 1
+        return self._view[self._cursor - 1] != 0
 
     # 7zip determines 'numbers' byte length based on bitmasking within the first byte
+    # Read the docs: https://py7zr.readthedocs.io/en/stable/archive_format.html
     def read_number(self):
-        # This is impossible to explain in comments
-        # Read the docs: https://py7zr.readthedocs.io/en/stable/archive_format.html
-        test_byte = self.read_int()
-        for i in range(8):
-            if (test_byte >> (7 - i) & 1) == 0:
-                return ((test_byte & (0xFF >> (1+i))) << (8 * i)) + self.read_int(i)
-        return self.read_int(8)
+        view = self._view
+        cursor = self._cursor
+        if cursor >= self._length:
+            raise self._short(1, 'a number')
+        first = view[cursor]
+        extra = _EXTRA_BYTES[first]
+        if not extra:
+            self._cursor = cursor + 1
+            return first
+
+        end = cursor + 1 + extra
+        if cursor + 9 <= self._length:
+            low = _UINT64.unpack_from(view, cursor + 1)[0] & _LOW_MASKS[extra]
+        elif end <= self._length:
+            low = int.from_bytes(view[cursor + 1: end], 'little')
+        else:
+            raise self._short(1 + extra, 'a %d byte number' % (1 + extra))
+        self._cursor = end
+        return ((first & _HIGH_MASKS[extra]) << (8 * extra)) + low
+
+    # Bulk version of read_number, for the long runs of sizes in PackInfo/SubStreamsInfo
+    def read_numbers(self, count):
+        view = self._view
+        length = self._length
+        cursor = self._cursor
+        unpack_from = _UINT64.unpack_from
+        # Every number takes at least a byte, so a (garbled) count beyond that is refused before anything's allocated
+        if count > length - cursor:
+            raise self._short(count, '%d numbers' % count)
+        numbers = [0] * count
+        # Indexing past the end is caught rather than checked for on every number
+        try:
+            for i in range(count):
+                first = view[cursor]
+                extra = _EXTRA_BYTES[first]
+                if not extra:
+                    numbers[i] = first
+                    cursor += 1
+                    continue
+
+                end = cursor + 1 + extra
+                if cursor + 9 <= length:
+                    low = unpack_from(view, cursor + 1)[0] & _LOW_MASKS[extra]
+                elif end <= length:
+                    low = int.from_bytes(view[cursor + 1: end], 'little')
+                else:
+                    raise self._short(1 + extra, 'a %d byte number' % (1 + extra), cursor)
+                numbers[i] = ((first & _HIGH_MASKS[extra]) << (8 * extra)) + low
+                cursor = end
+        except IndexError:
+            raise self._short(1, 'a number', cursor) from None
+        self._cursor = cursor
+        return numbers
+
+    # Bit vectors (e.g. which CRCs are defined) are packed most significant bit first
+    def read_bits(self, count):
+        return [bit == 1 for bit in self.read_bitmap(count)]
+
+    # A bit vector as one byte (0 or 1) per bit, which long vectors (e.g. one bit per file) are far cheaper as
+    def read_bitmap(self, count):
+        return b''.join([_BITMAPS[b] for b in self.read((count + 7) // 8)])[:count]
 
     def eof(self):
         return self._cursor == self._length
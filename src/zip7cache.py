@@ -0,0 +1,145 @@
+import os
+import json
+import sqlite3
+import threading
+import zip7scan
+import zip7volumes
+from zip7io import read_at
+
+"""
+Persistent metadata cache for archives, in SQLite
+Stores the zip7scan record of each archive keyed by its path, size, mtime and (32-byte) start header, so unchanged
+archives are never parsed twice; any change to the file (or a different header) invalidates its entry automatically
+The cached records can also be queried directly (steg length, compression, CRC validity) without touching the files
+"""
+
+# Bump whenever the table layout or the meaning of a record changes; older caches are then rebuilt
+SCHEMA_VERSION = 1
+HEADER_LEN = 0x20
+
+# Record fields stored as their own columns; pack_sizes is stored as JSON, and 'file' is the key (as an absolute path)
+COLUMNS = [name for name in zip7scan.FIELDS if name != 'file']
+BOOLEAN_COLUMNS = {'header_crc_valid', 'footer_crc_valid'}
+
+
+class MetadataCache(object):
+    def __init__(self, file_name):
+        self.file_name = file_name
+        # Scans look records up from many threads at once; one connection, used under a lock, is plenty for that
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file_name, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            self.db.execute('DROP TABLE IF EXISTS archives')
+        self.db.execute('CREATE TABLE IF NOT EXISTS archives (path TEXT PRIMARY KEY, mtime_ns INTEGER, header BLOB, %s)' % ', '.join(COLUMNS))
+        for column in ('compression', 'center_length', 'bottom_length'):
+            self.db.execute('CREATE INDEX IF NOT EXISTS archives_%s ON archives (%s)' % (column, column))
+        self.db.execute('PRAGMA user_version=%d' % SCHEMA_VERSION)
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    # What an entry is keyed on besides its path: (size, mtime_ns, start header), or None if the file can't be read
+    # Split archives are keyed on all of their volumes: their total size and the latest mtime
+    @staticmethod
+    def file_key(file_name):
+        try:
+            with open(file_name, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                size, mtime_ns, header = stat.st_size, stat.st_mtime_ns, read_at(f.fileno(), 0, HEADER_LEN)
+            if zip7volumes.is_volume(file_name):
+                stats = [os.stat(name) for name in zip7volumes.volume_names(file_name)]
+                size, mtime_ns = sum(stat.st_size for stat in stats), max(stat.st_mtime_ns for stat in stats)
+            return size, mtime_ns, header
+        except OSError:
+            return None
+
+    # The cached record for file_name if it's still current, or None
+    def get(self, file_name, key=None):
+        key = key or self.file_key(file_name)
+        if key is None:
+            return None
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime_ns, header, %s FROM archives WHERE path = ?' % ', '.join(COLUMNS), (os.path.abspath(file_name),)).fetchone()
+        if row is None or tuple(row[:3]) != key:
+            return None
+        return self.to_record(file_name, row[3:])
+
+    def put(self, file_name, key, record):
+        values = [self.to_column(name, record[name]) for name in COLUMNS]
+        values[COLUMNS.index('size')] = key[0]
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO archives (path, mtime_ns, header, %s) VALUES (?, ?, ?, %s)' % (', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))),
+                            [os.path.abspath(file_name), key[1], key[2]] + values)
+            self.db.commit()
+
+    # The record for file_name, straight from the cache when the file hasn't changed, otherwise scanned (and cached)
+    # The key is taken before scanning, so a file changing mid-scan is simply scanned again next time
+    def scan_file(self, file_name, stats=None):
+        key = self.file_key(file_name)
+        if key is None:
+            return zip7scan.scan_file(file_name, stats)
+        record = self.get(file_name, key)
+        if record is None:
+            record = zip7scan.scan_file(file_name, stats)
+            self.put(file_name, key, record)
+        return record
+
+    ## Queries over whatever has been cached, without touching the archives themselves
+    # Every condition given must hold: compression (e.g. 'LZMA2'), total steg data of at least min_steg_length bytes,
+    # both header CRCs valid (or not), and footer_type ('Packed' or 'Unpacked')
+    def query(self, compression=None, min_steg_length=None, crc_valid=None, footer_type=None):
+        conditions = ['error IS NULL']
+        parameters = list()
+        if compression is not None:
+            conditions.append('compression = ?')
+            parameters.append(compression)
+        if min_steg_length is not None:
+            conditions.append('center_length + bottom_length >= ?')
+            parameters.append(min_steg_length)
+        if crc_valid is not None:
+            conditions.append('(header_crc_valid AND footer_crc_valid) = ?')
+            parameters.append(int(crc_valid))
+        if footer_type is not None:
+            conditions.append('footer_type = ?')
+            parameters.append(footer_type)
+
+        with self.lock:
+            rows = self.db.execute('SELECT path, %s FROM archives WHERE %s ORDER BY path' % (', '.join(COLUMNS), ' AND '.join(conditions)), parameters).fetchall()
+        return [self.to_record(row[0], row[1:]) for row in rows]
+
+    # Drop the entries of archives that no longer exist; returns how many were dropped
+    def prune(self):
+        with self.lock:
+            paths = [row[0] for row in self.db.execute('SELECT path FROM archives')]
+            missing = [(path,) for path in paths if not os.path.exists(path)]
+            self.db.executemany('DELETE FROM archives WHERE path = ?', missing)
+            self.db.commit()
+        return len(missing)
+
+    @staticmethod
+    def to_column(name, value):
+        if name == 'pack_sizes':
+            return None if value is None else json.dumps(value)
+        if name in BOOLEAN_COLUMNS and value is not None:
+            return int(value)
+        return value
+
+    @staticmethod
+    def to_record(file_name, values):
+        record = {'file': file_name}
+        for name, value in zip(COLUMNS, values):
+            if name == 'pack_sizes' and value is not None:
+                value = json.loads(value)
+            elif name in BOOLEAN_COLUMNS and value is not None:
+                value = bool(value)
+            record[name] = value
+        return {name: record[name] for name in zip7scan.FIELDS}
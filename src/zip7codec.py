@@ -0,0 +1,172 @@
+import io
+import os
+import lzma
+import zlib
+from zip7helpers import Zip7FileException, Zip7UnimplementedException
+from zip7io import CHUNK_SIZE, member_path
+from zip7volumes import VolumeSet
+
+"""
+Decompression helpers for 7z folders
+Builds raw lzma filters from the parsed Encoder properties, then streams packed data through them
+Members are read sequentially out of their folder's decompressed data, so memory stays bounded
+"""
+
+
+# Translate a parsed LZMA/LZMA2 Encoder into the equivalent raw lzma module filter
+def lzma_filter(encoder):
+    properties = encoder.properties
+    if encoder.encoding == 'LZMA':
+        if len(properties) != 5:
+            raise Zip7FileException('LZMA properties should be 5 bytes, not %d.' % len(properties))
+        # First byte packs lc/lp/pb together as (pb * 5 + lp) * 9 + lc, followed by the dictionary size
+        lc_lp_pb = properties[0]
+        return {
+            'id': lzma.FILTER_LZMA1,
+            'lc': lc_lp_pb % 9,
+            'lp': (lc_lp_pb // 9) % 5,
+            'pb': lc_lp_pb // 45,
+            'dict_size': int.from_bytes(properties[1:5], 'little')
+        }
+    if encoder.encoding == 'LZMA2':
+        if len(properties) != 1 or properties[0] > 40:
+            raise Zip7FileException('Invalid LZMA2 properties: %r' % properties)
+        # The one byte encodes the dictionary size as 2 or 3, shifted by its upper bits
+        bits = properties[0]
+        dict_size = 0xFFFFFFFF if bits == 40 else (2 | (bits & 1)) << (bits // 2 + 11)
+        return {'id': lzma.FILTER_LZMA2, 'dict_size': dict_size}
+
+    raise Zip7UnimplementedException('Only LZMA & LZMA2 compression supported.')
+
+
+# Decompress the packed chunks of one folder, yielding at most chunk_size bytes at a time until unpack_size is reached
+# Memory use stays bounded by chunk_size no matter how well the data compresses
+def decompress(chunks, encoders, unpack_size, chunk_size=CHUNK_SIZE):
+    if len(encoders) != 1:
+        raise Zip7UnimplementedException('Only folders with a single coder can be decompressed.')
+    decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=[lzma_filter(encoders[0])])
+
+    remaining = unpack_size
+    for chunk in chunks:
+        if not remaining or decompressor.eof:
+            break
+        data = _decompress(decompressor, chunk, min(chunk_size, remaining))
+        while True:
+            if data:
+                remaining -= len(data)
+                yield data
+            if not remaining or decompressor.eof or decompressor.needs_input:
+                break
+            data = _decompress(decompressor, b'', min(chunk_size, remaining))
+
+    if remaining:
+        raise Zip7FileException('Packed stream ended 0x%x bytes short of its unpacked size.' % remaining)
+
+
+def _decompress(decompressor, data, max_length):
+    try:
+        return decompressor.decompress(data, max_length=max_length)
+    except lzma.LZMAError as e:
+        raise Zip7FileException('Packed stream could not be decompressed: %s' % e)
+
+
+# Sequential reads over a folder's decompressed chunks, for members to pull their bytes from
+class FolderReader(object):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b'')
+        self._position = 0
+
+    # Up to count bytes (never more than what's left of the current chunk); empty once the folder is exhausted
+    def read(self, count):
+        if self._position >= len(self._buffer):
+            self._buffer = memoryview(next(self._chunks, b''))
+            self._position = 0
+        data = self._buffer[self._position: self._position + count]
+        self._position += len(data)
+        return data
+
+    # Throw away count bytes, e.g. the members ahead of the one wanted in a solid folder
+    def skip(self, count):
+        while count:
+            data = self.read(count)
+            if not len(data):
+                raise Zip7FileException('Folder ended 0x%x bytes early.' % count)
+            count -= len(data)
+
+
+# File-like, read-only access to one member, streamed out of its folder and CRC checked along the way
+class MemberReader(io.RawIOBase):
+    def __init__(self, folder, name, size, crc=None, is_dir=False):
+        super().__init__()
+        self.name = name
+        self.size = size
+        self.crc = crc
+        self.is_dir = is_dir
+        self._folder = folder
+        self._remaining = size
+        self._crc = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast('B')
+        data = self._take(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def readall(self):
+        return b''.join(self.chunks())
+
+    # The member's data in chunks as large as the decompressor hands out; the cheapest way to copy a member
+    def chunks(self):
+        while self._remaining:
+            yield self._take(self._remaining)
+
+    # Read through whatever is left (still CRC checking it), so the folder is positioned at the next member
+    def skip(self):
+        for chunk in self.chunks():
+            pass
+
+    def _take(self, count):
+        if not self._remaining:
+            return b''
+        data = self._folder.read(min(count, self._remaining))
+        if not len(data):
+            raise Zip7FileException('Folder ended before member %s was complete.' % self.name)
+
+        self._remaining -= len(data)
+        self._crc = zlib.crc32(data, self._crc)
+        if not self._remaining and self.crc is not None and self._crc != self.crc:
+            raise Zip7FileException('Member %s CRC is invalid (0x%x, expected 0x%x).' % (self.name, self._crc, self.crc))
+        return data
+
+
+# Decode one whole folder straight from the archive file (or split archive), reading only its packed range (start to end)
+# Meant to run in worker processes, hence the plain arguments: members are (name, size, crc) for each stream,
+# which are written under out_folder if given (returning their paths, a chunk at a time), or else returned as bytes
+# (each member whole, since it has to be sent back to the parent process: use out_folder for members too big for memory)
+def decode_folder(file_name, start, end, encoders, unpack_size, members, out_folder=None):
+    results = list()
+    with VolumeSet.open(file_name) as volumes:
+        chunks = (volumes.read_at(position, min(CHUNK_SIZE, end - position)) for position in range(start, end, CHUNK_SIZE))
+        reader = FolderReader(decompress(chunks, encoders, unpack_size))
+        for name, size, crc in members:
+            member = MemberReader(reader, name, size, crc)
+            if out_folder is None:
+                results.append(member.readall())
+                continue
+
+            path = member_path(out_folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as out:
+                for chunk in member.chunks():
+                    out.write(chunk)
+            results.append(path)
+    return results
+
+
+# Single-argument form of decode_folder, for pool map()s
+def decode_folder_task(args):
+    return decode_folder(*args)
@@ -1,64 +1,377 @@
-from dataclasses import dataclass, field
+from __future__ import annotations
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
 from zip7bytestream import Zip7ByteStream
-from typing import List
 
 """
 Helper class
 Primarily just for defining data classes and exceptions within the main library
+Annotations use builtins only and are left unevaluated (so typing is never imported), and tracemalloc is only imported once it's wanted
 """
 
+
+# Base of the models: plain classes whose instances get __slots__ instead of a __dict__, which matters when metadata
+# for many thousands of archives is kept around
+# Each model lists its fields in __slots__ (in declaration order) and sets every one of them in __init__; repr() shows
+# them and == compares them, but for any named in _hidden
+class Model(object):
+    __slots__ = ()
+    _hidden = ()
+
+    def _values(self):
+        return tuple(getattr(self, name) for name in self.__slots__ if name not in self._hidden)
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__qualname__, ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__ if name not in self._hidden))
+
+    def __eq__(self, other):
+        if other.__class__ is self.__class__:
+            return self._values() == other._values()
+        return NotImplemented
+
+    # Pickling slots goes through setattr, which frozen models refuse; restore the fields directly instead
+    def __getstate__(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
+
+# A model whose fields can't be changed once __init__ has set them (with object.__setattr__), so it can be hashed
+class FrozenModel(Model):
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError('cannot assign to field %r' % name)
+
+    def __delattr__(self, name):
+        raise AttributeError('cannot delete field %r' % name)
+
+    def __hash__(self):
+        return hash(self._values())
+
+
+# Unsigned 64-bit arrays, for the per-stream sizes; far smaller than lists of ints once there are many streams
+def uint64_array(values=()):
+    return array('Q', values)
+
+
+def uint32_array(values=()):
+    return array('I', values)
+
+
+def int64_array(values=()):
+    return array('q', values)
+
+
+# Seconds between the FILETIME epoch (1601) and the Unix one, and FILETIME ticks (100ns) per second
+FILETIME_EPOCH = 11644473600
+FILETIME_TICKS = 10000000
+
+
 ## Define data classes for use in the class
-@dataclass
-class Header:
-    magic: [bytes] = b''
-    version: int = 0
-    header_crc: [bytes] = b''
-    header_crc_valid: bool = False
-    footer_start: int = 0
-    footer_length: int = 0
-    footer_crc: [bytes] = b''
-    footer_crc_valid: bool = False
-    data: [bytes] = b''
-
-@dataclass
-class Encoder:
-    flag: int = 0
-    flag_size: int = 0
-    flag_complex: bool = False
-    flag_attributes: bool = False
-    flag_reserved: int = 0
-    encoding_id: int = 0
-    encoding: str = ''
-    property_count: int = 0
-    properties: [bytes] = b''
-
-@dataclass
-class Footer:
-    stream: Zip7ByteStream = field(default_factory=Zip7ByteStream)
-    expected: List[int] = field(default_factory=list)
-    pack_size: List[int] = field(default_factory=list)
-    encoders: List[Encoder] = field(default_factory=Encoder)
-    data: [bytes] = b''
-    type: str = ''
-    folders: int = 0
-    num_encoders: int = 0
-    encoder_unpack_size: int = 0
-    stream_count: int = 0
-    data_offset: int = 0
-
-@dataclass
-class Body:
-    length: int = 0
-    data: [bytes] = b''
-
-@dataclass
-class Steg:
-    center_start: int = 0
-    center_length: int = 0
-    center_data: [bytes] = b''
-    bottom_start: int = 0
-    bottom_length: int = 0
-    bottom_data: [bytes] = b''
+class Header(Model):
+    __slots__ = ('magic', 'version', 'header_crc', 'header_crc_valid', 'footer_start', 'footer_length', 'footer_crc',
+                 'footer_crc_valid', 'data')
+
+    def __init__(self, magic: bytes = b'', version: int = 0, header_crc: bytes = b'', header_crc_valid: bool = False,
+                 footer_start: int = 0, footer_length: int = 0, footer_crc: bytes = b'', footer_crc_valid: bool = False,
+                 data: bytes = b''):
+        self.magic = magic
+        self.version = version
+        self.header_crc = header_crc
+        self.header_crc_valid = header_crc_valid
+        self.footer_start = footer_start
+        self.footer_length = footer_length
+        self.footer_crc = footer_crc
+        self.footer_crc_valid = footer_crc_valid
+        self.data = data
+
+# Encoders are complete once read, so are frozen
+class Encoder(FrozenModel):
+    __slots__ = ('flag', 'flag_size', 'flag_complex', 'flag_attributes', 'flag_reserved', 'encoding_id', 'encoding',
+                 'property_count', 'properties')
+
+    def __init__(self, flag: int = 0, flag_size: int = 0, flag_complex: bool = False, flag_attributes: bool = False,
+                 flag_reserved: int = 0, encoding_id: int = 0, encoding: str = '', property_count: int = 0,
+                 properties: bytes = b''):
+        object.__setattr__(self, 'flag', flag)
+        object.__setattr__(self, 'flag_size', flag_size)
+        object.__setattr__(self, 'flag_complex', flag_complex)
+        object.__setattr__(self, 'flag_attributes', flag_attributes)
+        object.__setattr__(self, 'flag_reserved', flag_reserved)
+        object.__setattr__(self, 'encoding_id', encoding_id)
+        object.__setattr__(self, 'encoding', encoding)
+        object.__setattr__(self, 'property_count', property_count)
+        object.__setattr__(self, 'properties', properties)
+
+class Folder(Model):
+    __slots__ = ('encoders', 'bind_pairs', 'packed_streams', 'unpack_sizes', 'crc', 'num_unpack_streams')
+
+    def __init__(self, encoders: list[Encoder] | None = None, bind_pairs: list[tuple[int, int]] | None = None,
+                 packed_streams: array | None = None, unpack_sizes: array | None = None, crc: int | None = None,
+                 num_unpack_streams: int = 1):
+        self.encoders = [] if encoders is None else encoders
+        self.bind_pairs = [] if bind_pairs is None else bind_pairs
+        self.packed_streams = uint64_array() if packed_streams is None else packed_streams
+        self.unpack_sizes = uint64_array() if unpack_sizes is None else unpack_sizes
+        self.crc = crc
+        self.num_unpack_streams = num_unpack_streams
+
+    # Size of the folder's final output: the one coder output that isn't bound to another coder's input
+    @property
+    def unpack_size(self):
+        bound = {out_index for in_index, out_index in self.bind_pairs}
+        for i, size in enumerate(self.unpack_sizes):
+            if i not in bound:
+                return size
+        return 0
+
+# Every file in an archive as parallel columns (one entry per file, in archive order), plus a name -> index dict
+# Files without data (directories, empty files) have a folder of -1; otherwise folder, stream (index within the
+# folder) and offset (within the folder's unpacked data) say where the data is
+# Times are FILETIMEs (100ns ticks since 1601); optional columns have a matching *_defined mask, 0 where undefined
+class FileTable(Model):
+    __slots__ = ('names', 'index', 'has_stream', 'is_dir', 'folder', 'stream', 'offset', 'size', 'crc', 'crc_defined',
+                 'ctime', 'ctime_defined', 'atime', 'atime_defined', 'mtime', 'mtime_defined', 'attributes',
+                 'attributes_defined')
+
+    def __init__(self, names: list[str] | None = None, index: dict | None = None, has_stream: bytearray | None = None,
+                 is_dir: bytearray | None = None, folder: array | None = None, stream: array | None = None,
+                 offset: array | None = None, size: array | None = None, crc: array | None = None,
+                 crc_defined: bytearray | None = None, ctime: array | None = None,
+                 ctime_defined: bytearray | None = None, atime: array | None = None,
+                 atime_defined: bytearray | None = None, mtime: array | None = None,
+                 mtime_defined: bytearray | None = None, attributes: array | None = None,
+                 attributes_defined: bytearray | None = None):
+        self.names = [] if names is None else names
+        self.index = {} if index is None else index
+        self.has_stream = bytearray() if has_stream is None else has_stream
+        self.is_dir = bytearray() if is_dir is None else is_dir
+        self.folder = int64_array() if folder is None else folder
+        self.stream = uint64_array() if stream is None else stream
+        self.offset = uint64_array() if offset is None else offset
+        self.size = uint64_array() if size is None else size
+        self.crc = uint32_array() if crc is None else crc
+        self.crc_defined = bytearray() if crc_defined is None else crc_defined
+        self.ctime = uint64_array() if ctime is None else ctime
+        self.ctime_defined = bytearray() if ctime_defined is None else ctime_defined
+        self.atime = uint64_array() if atime is None else atime
+        self.atime_defined = bytearray() if atime_defined is None else atime_defined
+        self.mtime = uint64_array() if mtime is None else mtime
+        self.mtime_defined = bytearray() if mtime_defined is None else mtime_defined
+        self.attributes = uint32_array() if attributes is None else attributes
+        self.attributes_defined = bytearray() if attributes_defined is None else attributes_defined
+
+    # A table for count files: names unknown, every file holding data, nothing else defined yet
+    @classmethod
+    def allocate(cls, count):
+        return cls(
+            names=[''] * count, has_stream=bytearray(b'\x01') * count, is_dir=bytearray(count),
+            folder=int64_array([-1]) * count, stream=uint64_array([0]) * count, offset=uint64_array([0]) * count,
+            size=uint64_array([0]) * count, crc=uint32_array([0]) * count, crc_defined=bytearray(count),
+            ctime=uint64_array([0]) * count, ctime_defined=bytearray(count), atime=uint64_array([0]) * count,
+            atime_defined=bytearray(count), mtime=uint64_array([0]) * count, mtime_defined=bytearray(count),
+            attributes=uint32_array([0]) * count, attributes_defined=bytearray(count)
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    # Unix time of a file's ctime/atime/mtime, or None if it isn't defined
+    def timestamp(self, column, i):
+        if not getattr(self, column + '_defined')[i]:
+            return None
+        return getattr(self, column)[i] / FILETIME_TICKS - FILETIME_EPOCH
+
+
+# Transient state for parsing a footer: the stream being read, which opcodes may come next, the open sections,
+# the encoders read so far (identical ones are shared between folders; they're frozen, so that's safe),
+# and FilesInfo's EmptyFile bits (only meaningful once the whole FilesInfo has been read)
+# Only attached to its Footer while it's being parsed, so none of this is kept alive afterwards
+class FooterParse(Model):
+    __slots__ = ('stream', 'expected', 'sections', 'encoders', 'empty_files', 'opcodes')
+
+    def __init__(self, stream: Zip7ByteStream | None = None, expected: list[int] | None = None,
+                 sections: list[str] | None = None, encoders: dict | None = None, empty_files: list[bool] | None = None,
+                 opcodes: dict | None = None):
+        self.stream = Zip7ByteStream() if stream is None else stream
+        self.expected = [] if expected is None else expected
+        self.sections = [] if sections is None else sections
+        self.encoders = {} if encoders is None else encoders
+        self.empty_files = [] if empty_files is None else empty_files
+        # opcode -> times seen, only when the Zip7 has stats to report them to
+        self.opcodes = opcodes
+
+class Footer(Model):
+    __slots__ = ('parse', 'pack_size', 'pack_crcs', 'encoders', 'folder_info', 'substream_sizes', 'substream_crcs',
+                 'data', 'type', 'folders', 'num_encoders', 'encoder_unpack_size', 'stream_count', 'data_offset',
+                 'num_files', 'file_name', 'file_names', 'files', 'mtime_info', 'attribute_info')
+
+    def __init__(self, parse: FooterParse | None = None, pack_size: array | None = None,
+                 pack_crcs: list[int | None] | None = None, encoders: list[Encoder] | None = None,
+                 folder_info: list[Folder] | None = None, substream_sizes: array | None = None,
+                 substream_crcs: list[int | None] | None = None, data: bytes = b'', type: str = '', folders: int = 0,
+                 num_encoders: int = 0, encoder_unpack_size: int = 0, stream_count: int = 0, data_offset: int = 0,
+                 num_files: int = 0, file_name: str = '', file_names: list[str] | None = None,
+                 files: FileTable | None = None, mtime_info: bytes = b'', attribute_info: bytes = b''):
+        self.parse = parse
+        self.pack_size = uint64_array() if pack_size is None else pack_size
+        self.pack_crcs = [] if pack_crcs is None else pack_crcs
+        self.encoders = [] if encoders is None else encoders
+        self.folder_info = [] if folder_info is None else folder_info
+        self.substream_sizes = uint64_array() if substream_sizes is None else substream_sizes
+        self.substream_crcs = [] if substream_crcs is None else substream_crcs
+        self.data = data
+        self.type = type
+        self.folders = folders
+        self.num_encoders = num_encoders
+        self.encoder_unpack_size = encoder_unpack_size
+        self.stream_count = stream_count
+        self.data_offset = data_offset
+        self.num_files = num_files
+        self.file_name = file_name
+        self.file_names = [] if file_names is None else file_names
+        self.files = FileTable() if files is None else files
+        self.mtime_info = mtime_info
+        self.attribute_info = attribute_info
+
+class Body(Model):
+    __slots__ = ('length', 'data', 'crc')
+
+    def __init__(self, length: int = 0, data: bytes = b'', crc: bytes = b''):
+        self.length = length
+        self.data = data
+        # The first folder's UnpackDigest, packed as it's stored
+        self.crc = crc
+
+class Steg(Model):
+    __slots__ = ('center_start', 'center_length', 'center_data', 'bottom_start', 'bottom_length', 'bottom_data')
+
+    def __init__(self, center_start: int = 0, center_length: int = 0, center_data: bytes = b'', bottom_start: int = 0,
+                 bottom_length: int = 0, bottom_data: bytes = b''):
+        self.center_start = center_start
+        self.center_length = center_length
+        self.center_data = center_data
+        self.bottom_start = bottom_start
+        self.bottom_length = bottom_length
+        self.bottom_data = bottom_data
+
+# The outcome of checking one stored CRC against the data it covers
+class CrcCheck(Model):
+    __slots__ = ('name', 'expected', 'actual', 'length', 'seconds', 'error')
+
+    def __init__(self, name: str = '', expected: int | None = None, actual: int | None = None, length: int = 0,
+                 seconds: float = 0.0, error: str = ''):
+        self.name = name
+        self.expected = expected
+        self.actual = actual
+        self.length = length
+        self.seconds = seconds
+        self.error = error
+
+    @property
+    def valid(self):
+        return not self.error and self.actual == self.expected
+
+    # Throughput in MB/s, over the bytes that were actually checksummed
+    @property
+    def rate(self):
+        return self.length / self.seconds / 1e6 if self.seconds else 0.0
+
+# What one of the regions 7-Zip never writes anything into (e.g. the center) turned out to hold
+# signatures are (name, offset) pairs, offsets relative to the start of the region
+class RegionProfile(Model):
+    __slots__ = ('name', 'start', 'length', 'histogram', 'entropy', 'signatures', 'score')
+
+    def __init__(self, name: str = '', start: int = 0, length: int = 0, histogram: list | None = None,
+                 entropy: float = 0.0, signatures: list | None = None, score: float = 0.0):
+        self.name = name
+        self.start = start
+        self.length = length
+        self.histogram = [] if histogram is None else histogram
+        self.entropy = entropy
+        self.signatures = [] if signatures is None else signatures
+        self.score = score
+
+# One file or folder going into a new archive: its name in the archive, where it's read from, and what the FilesInfo
+# records for it (mtime as a FILETIME, attributes as Windows attributes with the Unix mode in the high 16 bits)
+class SourceFile(Model):
+    __slots__ = ('name', 'path', 'size', 'is_dir', 'mtime', 'attributes')
+
+    def __init__(self, name: str = '', path: str = '', size: int = 0, is_dir: bool = False, mtime: int = 0,
+                 attributes: int = 0):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.is_dir = is_dir
+        self.mtime = mtime
+        self.attributes = attributes
+
+# Opt-in instrumentation for Zip7 (and the scripts' --stats): wall time and call count per phase, bytes read and
+# written, footer opcodes seen, and with trace_memory, the peak allocation traced by tracemalloc
+# One can be shared by any number of archives, on any number of threads; it only ever accumulates
+class Zip7Stats(Model):
+    __slots__ = ('phases', 'calls', 'bytes_read', 'bytes_written', 'opcodes', 'trace_memory', 'peak_memory', 'lock')
+    _hidden = ('lock',)
+
+    def __init__(self, phases: dict | None = None, calls: dict | None = None, bytes_read: int = 0,
+                 bytes_written: int = 0, opcodes: dict | None = None, trace_memory: bool = False, peak_memory: int = 0):
+        self.phases = {} if phases is None else phases
+        self.calls = {} if calls is None else calls
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.opcodes = {} if opcodes is None else opcodes
+        self.trace_memory = trace_memory
+        self.peak_memory = peak_memory
+        self.lock = threading.Lock()
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    # Time the body of a with statement as (another call of) the named phase
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            peak = sys.modules['tracemalloc'].get_traced_memory()[1] if self.trace_memory else 0
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+                self.calls[name] = self.calls.get(name, 0) + 1
+                self.peak_memory = max(self.peak_memory, peak)
+
+    def add_read(self, count):
+        with self.lock:
+            self.bytes_read += count
+
+    def add_written(self, count):
+        with self.lock:
+            self.bytes_written += count
+
+    def add_opcodes(self, opcodes):
+        with self.lock:
+            for opcode, count in opcodes.items():
+                self.opcodes[opcode] = self.opcodes.get(opcode, 0) + count
+
+    # Everything recorded, as (label, value) pairs for printing; opcode_names labels the opcodes (e.g. 'folder')
+    def report(self, opcode_names=None):
+        opcode_names = opcode_names or {}
+        with self.lock:
+            lines = [('Phase %s' % name, '%.6f s (%d calls)' % (seconds, self.calls[name])) for name, seconds in self.phases.items()]
+            lines.append(('Bytes Read', '0x%x' % self.bytes_read))
+            lines.append(('Bytes Written', '0x%x' % self.bytes_written))
+            lines += [('Opcode %02x %s' % (opcode, opcode_names.get(opcode, '')), str(count)) for opcode, count in sorted(self.opcodes.items())]
+            if self.trace_memory:
+                lines.append(('Peak Allocation', '0x%x bytes' % self.peak_memory))
+        return lines
 
 ## Define exceptions for use by the class
 
@@ -0,0 +1,300 @@
+import os
+import errno
+import struct
+import zlib
+from contextlib import contextmanager
+from zip7helpers import Zip7FileException
+
+"""
+Low-level file I/O helpers for the core library
+Chunked writes, kernel-side range copies, atomic (temp file + rename) output and rollback journals
+"""
+
+CHUNK_SIZE = 1 << 20
+
+# Errors meaning "this kernel/filesystem can't do that copy", as opposed to actual I/O failures
+_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+
+# os.write may write less than asked for, so loop until everything is out
+def write_all(fd, data):
+    with memoryview(data) as view:
+        view = view.cast('B')
+        position = 0
+        while position < len(view):
+            position += os.write(fd, view[position: position + CHUNK_SIZE])
+
+
+def read_at(fd, offset, count):
+    if hasattr(os, 'pread'):
+        return os.pread(fd, count, offset)
+    os.lseek(fd, offset, os.SEEK_SET)
+    return os.read(fd, count)
+
+
+# Read-only, bytes-like window onto file[start:end] that only reads (with pread) the parts that get sliced
+# The unmapped alternative to an mmap, for when just a few small ranges of a file are ever wanted
+class FileRange(object):
+    def __init__(self, fd, start, end):
+        self.fd = fd
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('FileRange slices must be contiguous.')
+            return read_at(self.fd, self.start + start, max(0, stop - start))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('FileRange index out of range')
+        return read_at(self.fd, self.start + index, 1)[0]
+
+    def __bytes__(self):
+        return self[:]
+
+    # A narrower window, read no sooner than this one
+    def window(self, start, end):
+        start, end, step = slice(start, end).indices(len(self))
+        return FileRange(self.fd, self.start + start, self.start + max(start, end))
+
+
+# Stand-in for `length` bytes of data that is never held in memory all at once (e.g. a payload piped in on stdin)
+# With an offset, they're copied kernel-side from that position of stream (which must then be a regular file);
+# without one, they're the next `length` bytes read from stream, so they can only be written out once
+class StreamData(object):
+    def __init__(self, stream, length, offset=None):
+        self.stream = stream
+        self.length = length
+        self.offset = offset
+
+    def __len__(self):
+        return self.length
+
+    def write_to(self, fd):
+        if self.offset is not None:
+            copy_range(self.stream.fileno(), fd, self.offset, self.length)
+            return
+        remaining = self.length
+        while remaining:
+            data = self.stream.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                raise Zip7FileException('Stream ended early (0x%x bytes short).' % remaining)
+            write_all(fd, data)
+            remaining -= len(data)
+
+
+# Write out any region: bytes-likes as they are, StreamData (and ranges of split archives) a chunk at a time
+def write_data(fd, data):
+    if hasattr(data, 'write_to'):
+        data.write_to(fd)
+    else:
+        write_all(fd, data)
+
+
+# Copy count bytes from in_fd (at offset) to the current position of out_fd
+# Uses copy_file_range/sendfile so the data never passes through userspace, falling back to chunked reads
+def copy_range(in_fd, out_fd, offset, count):
+    end = offset + count
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        try:
+            while offset < end:
+                size = min(CHUNK_SIZE, end - offset)
+                if method == 'copy_file_range':
+                    copied = os.copy_file_range(in_fd, out_fd, size, offset)
+                else:
+                    copied = os.sendfile(out_fd, in_fd, offset, size)
+                if not copied:
+                    raise Zip7FileException('Source file ended early while copying (0x%x bytes short).' % (end - offset))
+                offset += copied
+            return
+        except OSError as e:
+            if e.errno not in _COPY_UNSUPPORTED:
+                raise
+
+    while offset < end:
+        data = read_at(in_fd, offset, min(CHUNK_SIZE, end - offset))
+        if not data:
+            raise Zip7FileException('Source file ended early while copying (0x%x bytes short).' % (end - offset))
+        write_all(out_fd, data)
+        offset += len(data)
+
+
+# Make sure a rename/unlink in a folder survives a crash (no-op where folders can't be opened, i.e. Windows)
+def fsync_folder(folder):
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# A new temp file in folder named after base ('.<base>.<random>.tmp'): (fd, name)
+# Created as 0666 like any other new file, so the umask applies to it (mkstemp's are always 0600)
+def create_temp(folder, base):
+    while True:
+        temp_name = os.path.join(folder, '.%s.%s.tmp' % (base, os.urandom(6).hex()))
+        try:
+            return os.open(temp_name, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666), temp_name
+        except FileExistsError:
+            continue
+
+
+# Yields a raw fd to a temp file next to file_name, which replaces file_name only once everything is written
+# If anything fails along the way, the temp file is removed and file_name is left untouched
+@contextmanager
+def atomic_write(file_name):
+    import shutil
+    folder = os.path.dirname(os.path.abspath(file_name))
+    fd, temp_name = create_temp(folder, os.path.basename(file_name))
+    try:
+        yield fd
+        os.fsync(fd)
+    except BaseException:
+        os.close(fd)
+        os.unlink(temp_name)
+        raise
+    os.close(fd)
+
+    # Keep the mode of the file being replaced; new files keep the one they were created with
+    try:
+        shutil.copymode(file_name, temp_name)
+    except FileNotFoundError:
+        pass
+    os.replace(temp_name, file_name)
+    fsync_folder(folder)
+
+
+# Where a member should be extracted to under folder; refuses names that would escape it
+def member_path(folder, name):
+    parts = name.replace('\\', '/').split('/')
+    if not name or name.startswith('/') or '..' in parts or ':' in parts[0]:
+        raise Zip7FileException('Refusing to extract member with unsafe name %r.' % name)
+    return os.path.join(folder, *[part for part in parts if part])
+
+
+## Rollback journal for in-place edits
+# Layout: magic, original file length, entry count, then (offset, length, original bytes) per entry, then a CRC of it all
+JOURNAL_MAGIC = b'7zJRNL01'
+JOURNAL_SUFFIX = '.journal'
+
+
+def journal_name(file_name):
+    return file_name + JOURNAL_SUFFIX
+
+
+# Durably record the original contents of every range that is about to be overwritten
+# originals are anything that slices like bytes (e.g. a FileRange of the file itself), and are copied in a chunk at a
+# time, so the journal of a large tail never has to fit in memory. Returns where each entry's bytes are in the journal
+def write_journal(file_name, entries, original_length):
+    placed = list()
+    with atomic_write(journal_name(file_name)) as fd:
+        data = JOURNAL_MAGIC + struct.pack('<QI', original_length, len(entries))
+        crc = zlib.crc32(data)
+        write_all(fd, data)
+        position = len(data)
+        for offset, original in entries:
+            data = struct.pack('<QQ', offset, len(original))
+            crc = zlib.crc32(data, crc)
+            write_all(fd, data)
+            position += len(data)
+            placed.append((position, len(original)))
+            for start in range(0, len(original), CHUNK_SIZE):
+                data = original[start: start + CHUNK_SIZE]
+                crc = zlib.crc32(data, crc)
+                write_all(fd, data)
+            position += len(original)
+        write_all(fd, struct.pack('<I', crc))
+    return placed
+
+
+# The entries of the journal open as f, with their bytes as StreamData to be copied out of it, and the original file
+# length; or None if the journal is torn (i.e. the file was never touched). It's checked a chunk at a time
+def read_journal(f):
+    size = os.fstat(f.fileno()).st_size
+    if size < 24 or read_at(f.fileno(), 0, len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+        return None
+    crc = 0
+    for start in range(0, size - 4, CHUNK_SIZE):
+        crc = zlib.crc32(read_at(f.fileno(), start, min(CHUNK_SIZE, size - 4 - start)), crc)
+    if struct.unpack('<I', read_at(f.fileno(), size - 4, 4))[0] != crc:
+        return None
+
+    original_length, count = struct.unpack('<QI', read_at(f.fileno(), 8, 12))
+    entries = list()
+    position = 20
+    for i in range(count):
+        offset, length = struct.unpack('<QQ', read_at(f.fileno(), position, 16))
+        position += 16
+        entries.append((offset, StreamData(f, length, position)))
+        position += length
+    return entries, original_length
+
+
+# Write each (offset, data) pair into fd, set the final length, and flush it all to disk
+def apply_ranges(fd, entries, length):
+    for offset, data in entries:
+        os.lseek(fd, offset, os.SEEK_SET)
+        write_data(fd, data)
+    os.ftruncate(fd, length)
+    os.fsync(fd)
+
+
+def remove_journal(file_name):
+    os.unlink(journal_name(file_name))
+    fsync_folder(os.path.dirname(os.path.abspath(file_name)))
+
+
+## Redo records, for patches staged now and applied later: the new bytes of every range, rather than the old ones
+# Applying one is idempotent, so one interrupted part way through is simply applied again
+# Layout: magic, original file length, new file length, entry count, then (offset, length, new bytes) per entry
+REDO_MAGIC = b'7zREDO01'
+REDO_HEADER = struct.Struct('<QQI')
+REDO_ENTRY = struct.Struct('<QQ')
+
+
+# Write the redo record of entries [(offset, data), ...] to file_name, atomically; data is anything write_data() takes,
+# and is streamed in. Returns where each entry's data is within the record, as (position, length) pairs
+def write_redo(file_name, entries, original_length, length):
+    placed = list()
+    position = len(REDO_MAGIC) + REDO_HEADER.size
+    with atomic_write(file_name) as fd:
+        write_all(fd, REDO_MAGIC + REDO_HEADER.pack(original_length, length, len(entries)))
+        for offset, data in entries:
+            write_all(fd, REDO_ENTRY.pack(offset, len(data)))
+            write_data(fd, data)
+            position += REDO_ENTRY.size
+            placed.append((position, len(data)))
+            position += len(data)
+    return placed
+
+
+# The entries of the redo record open as f, with their data as StreamData to be copied out of it, along with the
+# original and new file lengths
+def read_redo(f):
+    start = len(REDO_MAGIC) + REDO_HEADER.size
+    data = read_at(f.fileno(), 0, start)
+    if len(data) < start or data[:len(REDO_MAGIC)] != REDO_MAGIC:
+        raise Zip7FileException('%s is not a redo record.' % f.name)
+    original_length, length, count = REDO_HEADER.unpack(data[len(REDO_MAGIC):])
+
+    entries = list()
+    position = start
+    for i in range(count):
+        data = read_at(f.fileno(), position, REDO_ENTRY.size)
+        if len(data) < REDO_ENTRY.size:
+            raise Zip7FileException('Redo record %s is truncated.' % f.name)
+        offset, size = REDO_ENTRY.unpack(data)
+        position += REDO_ENTRY.size
+        entries.append((offset, StreamData(f, size, position)))
+        position += size
+    return entries, original_length, length
@@ -0,0 +1,71 @@
+import os
+import fnmatch
+import zip7
+import zip7batch
+
+"""
+Fast metadata scans over whole directory trees of archives
+Each archive is opened lazily and unmapped, so nothing but its 32-byte header and its footer range is ever read
+Archives are scanned on a thread pool, since the work is almost entirely waiting on small reads
+"""
+
+# Column order for tabular (CSV) output
+FIELDS = [
+    'file', 'size', 'error', 'magic', 'version', 'header_crc', 'header_crc_valid', 'footer_start', 'footer_length',
+    'footer_crc', 'footer_crc_valid', 'footer_type', 'data_offset', 'pack_sizes', 'compression', 'body_length',
+    'center_start', 'center_length', 'bottom_start', 'bottom_length'
+]
+DEFAULT_PATTERN = '*.7z'
+
+
+# Every file under paths (recursing into folders) whose name matches pattern; files named outright are always included
+# Split archives are found by their first volumes (e.g. name.7z.001 for *.7z), and opened as a whole from there
+def iter_archives(paths, pattern=DEFAULT_PATTERN):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for folder, folders, files in os.walk(path):
+            folders.sort()
+            for name in sorted(files):
+                if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(name, pattern + '.001'):
+                    yield os.path.join(folder, name)
+
+
+# The metadata parse7z shows, as a flat dict; archives that can't be parsed get their error instead
+def scan_file(file_name, stats=None):
+    record = dict.fromkeys(FIELDS)
+    record['file'] = file_name
+    try:
+        with zip7.Zip7(file_name, ignore_magic=True, lazy=True, mapped=False, stats=stats) as file:
+            record.update({
+                'size': len(file.data),
+                'magic': file.header.magic.hex(),
+                'version': file.header.version,
+                'header_crc': file.header.header_crc,
+                'header_crc_valid': file.header.header_crc_valid,
+                'footer_start': file.header.footer_start,
+                'footer_length': file.header.footer_length,
+                'footer_crc': file.header.footer_crc,
+                'footer_crc_valid': file.header.footer_crc_valid,
+                'footer_type': file.footer.type,
+                'data_offset': file.footer.data_offset,
+                'pack_sizes': list(file.footer.pack_size),
+                'compression': file.footer.encoders[0].encoding if file.footer.num_encoders else '',
+                'body_length': file.body.length,
+                'center_start': file.steg.center_start,
+                'center_length': file.steg.center_length,
+                'bottom_start': file.steg.bottom_start,
+                'bottom_length': file.steg.bottom_length
+            })
+    # Whatever way a (possibly corrupt) archive fails to parse, it's reported in its record rather than ending the scan
+    except Exception as e:
+        record['error'] = '%s: %s' % (type(e).__name__, e)
+    return record
+
+
+# Yields a scan_file() record for every archive under paths, in walk order, scanning up to `workers` at a time
+# Given a zip7cache.MetadataCache, archives that haven't changed since they were cached aren't parsed at all
+def scan(paths, pattern=DEFAULT_PATTERN, workers=zip7batch.DEFAULT_WORKERS, cache=None, stats=None):
+    scan_one = cache.scan_file if cache else scan_file
+    return zip7batch.imap_ordered(lambda file_name: scan_one(file_name, stats), iter_archives(paths, pattern), workers)
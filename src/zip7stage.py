@@ -0,0 +1,258 @@
+import json
+import os
+import re
+import threading
+import zlib
+import zip7
+import zip7batch
+from zip7helpers import Zip7FileException, Zip7UnimplementedException
+from zip7io import CHUNK_SIZE, FileRange, StreamData, apply_ranges, atomic_write, fsync_folder, read_redo, write_all, write_redo
+from zip7verify import crc32_chunks, iter_range
+
+"""
+Two-phase commits of in-place edits to many archives at once, through a journal folder
+Staging opens one archive at a time (per worker), applies the edit, and writes the ranges patch() would rewrite to a
+redo record in the journal, so nothing is held in memory past the archive being staged and no archive is touched yet.
+Once every archive is staged, the manifest is replaced (atomically) by one marked prepared, with the CRC of every
+redo record: that's the commit point. The records are then applied in place, each as it's logged
+A run that's interrupted is resumed by running it again with the same journal: before the commit point, whatever was
+staged intact is kept (as long as it was staged from the same data) and the rest is staged again; after it, the
+records not yet applied are applied, and since applying one is idempotent, the ones interrupted part way are applied
+again from the start. The journal folder is removed once every archive has been patched: only the files a batch writes
+there are ever deleted, and a folder holding anything else is refused as a journal
+"""
+
+MANIFEST_NAME = 'manifest.json'
+LOG_NAME = 'progress.log'
+MANIFEST_VERSION = 1
+REDO_NAME = re.compile(r'^\d{6}\.redo$')
+
+
+def redo_name(journal, i):
+    return os.path.join(journal, '%06d.redo' % i)
+
+
+# Whether name is one a batch writes in its journal folder, including the temporary files atomic_write leaves behind
+# when interrupted ('.<name>.<random>.tmp')
+def journal_file(name):
+    if name.startswith('.') and name.endswith('.tmp'):
+        name = name[1:-len('.tmp')].rpartition('.')[0]
+    return name in (MANIFEST_NAME, LOG_NAME) or REDO_NAME.match(name) is not None
+
+
+# Delete the files a batch wrote in journal
+def clear_journal(journal):
+    for name in os.listdir(journal):
+        if journal_file(name):
+            os.unlink(os.path.join(journal, name))
+
+
+# Delete the files a batch wrote in journal, and the folder itself if nothing else is left in it
+def remove_journal(journal):
+    clear_journal(journal)
+    try:
+        os.rmdir(journal)
+    except OSError:
+        return
+    fsync_folder(os.path.dirname(os.path.abspath(journal)))
+
+
+# What a file has to still look like for a batch to go on with it: its size and mtime
+def identity(file_name):
+    status = os.stat(file_name)
+    return [status.st_size, status.st_mtime_ns]
+
+
+# CRC32 of file_name[start:end], read a chunk at a time
+def file_crc(file_name, start=0, end=None):
+    with open(file_name, 'rb') as f:
+        data = FileRange(f.fileno(), 0, os.fstat(f.fileno()).st_size)
+        return crc32_chunks(iter_range(data, start, len(data) if end is None else end))[0]
+
+
+# CRC32 of a piece of data: bytes-likes as they are, StreamData read where it is (using it up, if it's on a pipe)
+def data_crc(data):
+    if not isinstance(data, StreamData):
+        return zlib.crc32(data)
+    if data.offset is not None:
+        return crc32_chunks(iter_range(FileRange(data.stream.fileno(), data.offset, data.offset + data.length), 0, data.length))[0]
+    crc = 0
+    remaining = data.length
+    while remaining:
+        chunk = data.stream.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            raise Zip7FileException('Stream ended early (0x%x bytes short).' % remaining)
+        crc = zlib.crc32(chunk, crc)
+        remaining -= len(chunk)
+    return crc
+
+
+def read_manifest(journal):
+    try:
+        with open(os.path.join(journal, MANIFEST_NAME), 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+    except FileNotFoundError:
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise Zip7FileException('%s holds a batch of an unknown version (%r).' % (journal, manifest.get('version')))
+    return manifest
+
+
+def write_manifest(journal, manifest):
+    with atomic_write(os.path.join(journal, MANIFEST_NAME)) as fd:
+        write_all(fd, json.dumps(manifest, indent=1).encode('utf-8'))
+
+
+# Append-only record of the batch's progress: one JSON object per line
+# A line torn by a crash is cut off when the log is next opened, so appends always start on a line of their own
+# Only records a resumed run can't do without are synced: losing any other just means redoing the step it records
+class ProgressLog(object):
+    def __init__(self, file_name):
+        self.records = list()
+        self.fd = os.open(file_name, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        self.lock = threading.Lock()
+        data = b''.join(iter(lambda: os.read(self.fd, CHUNK_SIZE), b''))
+        end = 0
+        for line in data.split(b'\n')[:-1]:
+            try:
+                self.records.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                break
+            end += len(line) + 1
+        os.ftruncate(self.fd, end)
+        os.lseek(self.fd, end, os.SEEK_SET)
+
+    # Indexes of the files logged as having reached step
+    def indexes(self, step):
+        return {record['index'] for record in self.records if record['step'] == step}
+
+    def append(self, record, sync=True):
+        with self.lock:
+            write_all(self.fd, json.dumps(record).encode('utf-8') + b'\n')
+            if sync:
+                os.fsync(self.fd)
+            self.records.append(record)
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Apply edit(file, data) to file_name and write what patching it in place would write to the redo record redo_file
+# Returns the record's length and CRC, and the CRC of the data it holds for region (the one edit puts data into)
+def stage(file_name, data, edit, region, redo_file, stats=None):
+    with zip7.Zip7(file_name, lazy=True, stats=stats) as file:
+        edit(file, data)
+        file.update_crcs()
+        writes, length, original_length = file.patch_ranges()
+        placed = write_redo(redo_file, [(offset, region_data) for name, region_data, offset in writes], original_length, length)
+    position, size = dict(zip([name for name, region_data, offset in writes], placed)).get(region, (0, 0))
+    return {'size': os.path.getsize(redo_file), 'crc': file_crc(redo_file), 'data_crc': file_crc(redo_file, position, position + size)}
+
+
+# Patch file_name in place from the redo record redo_file; returns the number of bytes written
+def apply(file_name, redo_file):
+    with open(redo_file, 'rb') as f:
+        entries, original_length, length = read_redo(f)
+        fd = os.open(file_name, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+        try:
+            apply_ranges(fd, entries, length)
+        finally:
+            os.close(fd)
+    return sum(len(data) for offset, data in entries)
+
+
+# Phase one: stage every file that isn't already, then mark the manifest prepared
+# Pieces on a pipe (ordered) can only be read in order, so are staged one file at a time
+def prepare(journal, manifest, pieces, edit, region, log, jobs, ordered, stats):
+    for entry in manifest['files']:
+        if identity(entry['file']) != entry['identity']:
+            raise Zip7FileException('%s changed since this batch was started; remove %s to start over.' % (entry['file'], journal))
+    staged = {record['index']: record for record in log.records if record['step'] == 'staged'}
+
+    def stage_entry(item):
+        i, data = item
+        file_name = manifest['files'][i]['file']
+        record = staged.get(i)
+        if record and os.path.exists(redo_name(journal, i)) and file_crc(redo_name(journal, i)) == record['crc']:
+            # Staged intact by an earlier run: it only has to have been staged from the same data
+            if data_crc(data) != record['data_crc']:
+                raise Zip7FileException('The data for %s differs from that of the interrupted run; remove %s to start over.' % (file_name, journal))
+            return record
+        record = dict(stage(file_name, data, edit, region, redo_name(journal, i), stats), step='staged', index=i)
+        log.append(record, sync=False)
+        return record
+
+    records = list(zip7batch.imap_ordered(stage_entry, enumerate(pieces), 1 if ordered else jobs))
+    if len(records) != len(manifest['files']):
+        raise Zip7FileException('Expected %d pieces of data, got %d.' % (len(manifest['files']), len(records)))
+    for entry, record in zip(manifest['files'], records):
+        entry['staged'] = {key: record[key] for key in ('size', 'crc', 'data_crc')}
+    manifest['prepared'] = True
+    write_manifest(journal, manifest)
+
+
+# Phase two: apply every redo record that hasn't been yet
+def commit(journal, manifest, log, jobs, stats):
+    applying = log.indexes('applying')
+
+    def apply_entry(i):
+        entry = manifest['files'][i]
+        if file_crc(redo_name(journal, i)) != entry['staged']['crc']:
+            raise Zip7FileException('Staged patch %s for %s is corrupt.' % (redo_name(journal, i), entry['file']))
+        # A file that was being patched when the run was interrupted is part way there; any other must be as it was
+        if i not in applying and identity(entry['file']) != entry['identity']:
+            raise Zip7FileException('%s changed since this batch was started, so cannot be patched.' % entry['file'])
+        # Synced before the file is touched, so a resumed run knows it may find it part way patched
+        log.append({'step': 'applying', 'index': i})
+        written = apply(entry['file'], redo_name(journal, i))
+        log.append({'step': 'committed', 'index': i}, sync=False)
+        return written
+
+    committed = log.indexes('committed')
+    written = sum(zip7batch.imap_ordered(apply_entry, [i for i in range(len(manifest['files'])) if i not in committed], jobs))
+    if stats:
+        stats.add_written(written)
+
+
+# Apply edit(file, data) to each of files with its piece of data (in order; bytes-likes or StreamData), committing
+# them together through the journal folder: either every file is patched, or (if interrupted) running this again with
+# the same arguments finishes the job. region names where edit puts the data, so a resumed run can tell it's the same;
+# plan is anything else (JSON-able) that has to match for a run to resume an earlier one
+def commit_batch(journal, files, pieces, edit, region, plan=None, jobs=zip7batch.DEFAULT_WORKERS, ordered=False, stats=None):
+    files = [os.path.abspath(file_name) for file_name in files]
+    plan = json.loads(json.dumps(plan))
+    os.makedirs(journal, exist_ok=True)
+
+    manifest = read_manifest(journal)
+    if manifest is None:
+        # The folder is removed along with the batch once it's done, so it can't be one that holds anything else;
+        # files an earlier batch left without a manifest are of no use, and could be mistaken for this one's
+        if not all(journal_file(name) for name in os.listdir(journal)):
+            raise Zip7FileException('%s is not empty and holds no batch; give the journal a folder of its own.' % journal)
+        clear_journal(journal)
+        for file_name in files:
+            zip7.Zip7.recover(file_name)
+        manifest = {'version': MANIFEST_VERSION, 'plan': plan, 'prepared': False, 'files': [{'file': file_name, 'identity': identity(file_name)} for file_name in files]}
+        write_manifest(journal, manifest)
+    elif manifest['plan'] != plan or [entry['file'] for entry in manifest['files']] != files:
+        raise Zip7FileException('%s holds an unfinished batch for other files or data; run that again to finish it, or remove %s to abandon it.' % (journal, journal))
+
+    phase = stats.phase if stats else lambda name: zip7.NO_STATS
+    log = ProgressLog(os.path.join(journal, LOG_NAME))
+    finished = False
+    try:
+        if not manifest['prepared']:
+            with phase('stage'):
+                prepare(journal, manifest, pieces, edit, region, log, jobs, ordered, stats)
+        with phase('commit'):
+            commit(journal, manifest, log, jobs, stats)
+        finished = True
+    except Zip7UnimplementedException:
+        # Archives that can't be patched in place at all (e.g. split ones) fail while staging, before anything has
+        # been touched, and would fail the same way again: there's nothing to resume
+        finished = not manifest['prepared']
+        raise
+    finally:
+        log.close()
+        if finished:
+            remove_journal(journal)
@@ -0,0 +1,146 @@
+import os
+import stat
+import tempfile
+import zip7
+from zip7helpers import Zip7FileException
+from zip7io import CHUNK_SIZE, StreamData
+
+"""
+Archives and payloads as streams (e.g. pipes), for when there is no file to seek around in
+Only the start header and the footer of an archive are ever kept; everything else is passed along a chunk at a time
+Streams that can seek (stdin redirected from a file) skip ahead instead of reading what isn't wanted
+"""
+
+# Bytes of a streamed archive's body and center kept in memory (before spilling to a temp file) when extracting the
+# center, which can only be told apart from the body once the footer has been read
+SPOOL_SIZE = 64 << 20
+
+
+def read_exact(stream, count):
+    data = stream.read(count)
+    while len(data) < count:
+        more = stream.read(count - len(data))
+        if not more:
+            raise Zip7FileException('Stream ended early (0x%x bytes short).' % (count - len(data)))
+        data += more
+    return data
+
+
+# Copy count bytes of stream to out a chunk at a time (or everything up to EOF, with count=None); returns bytes copied
+def copy_stream(stream, out, count=None):
+    copied = 0
+    while count is None or copied < count:
+        data = stream.read(CHUNK_SIZE if count is None else min(CHUNK_SIZE, count - copied))
+        if not data:
+            if count is not None:
+                raise Zip7FileException('Stream ended early (0x%x bytes short).' % (count - copied))
+            break
+        out.write(data)
+        copied += len(data)
+    return copied
+
+
+class _Discard(object):
+    def write(self, data):
+        pass
+
+
+def skip(stream, count):
+    if stream.seekable():
+        stream.seek(count, os.SEEK_CUR)
+    else:
+        copy_stream(stream, _Discard(), count)
+
+
+# Bytes-like view of an archive of which only some ranges were kept, as (offset, data) pairs
+# Enough for Zip7 to parse its header and footer; slicing anything that wasn't kept raises instead
+class StreamRegions(object):
+    def __init__(self, length, regions):
+        self.length = length
+        self.regions = regions
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index: index + 1][0]
+        start, stop, step = index.indices(len(self))
+        if stop <= start:
+            return b''
+        for offset, data in self.regions:
+            if offset <= start and stop <= offset + len(data):
+                return data[start - offset: stop - offset]
+        raise Zip7FileException('Bytes 0x%x-0x%x of the streamed archive were not kept.' % (start, stop))
+
+    def __bytes__(self):
+        return self[:]
+
+    def window(self, start, end):
+        start, end, step = slice(start, end).indices(len(self))
+        end = max(start, end)
+        regions = list()
+        for offset, data in self.regions:
+            low, high = max(offset, start), min(offset + len(data), end)
+            if low < high:
+                regions.append((low - start, data[low - offset: high - offset]))
+        return StreamRegions(end - start, regions)
+
+
+# Read an archive's start header and footer from stream, passing whatever lies between them to between (or skipping it)
+# Returns the Zip7 parsed from them; only metadata is available, and its bottom steg data hasn't been read yet
+def read_archive(stream, between=None, name='<stream>', ignore_magic=False, stats=None):
+    header = read_exact(stream, zip7.Zip7.HEADER_LEN)
+    # Checked now, rather than by Zip7, so junk isn't read up to wherever its "footer" would be
+    if not ignore_magic and header[:len(zip7.Zip7.MAGIC)] != zip7.Zip7.MAGIC:
+        raise Zip7FileException('Not a 7zip file.')
+    footer_start, footer_length = zip7.Zip7.footer_location(header)
+    if between is None:
+        skip(stream, footer_start - zip7.Zip7.HEADER_LEN)
+    else:
+        copy_stream(stream, between, footer_start - zip7.Zip7.HEADER_LEN)
+    footer = read_exact(stream, footer_length)
+    regions = StreamRegions(footer_start + footer_length, [(0, header), (footer_start, footer)])
+    return zip7.Zip7(name, ignore_magic=ignore_magic, data=regions, stats=stats)
+
+
+# Write the center or bottom steg data of the archive coming in on stream to out, a chunk at a time
+# The bottom follows the footer, so it's passed straight through; the center comes before it, and has to be spooled
+# (or, if stream can seek, gone back for) until the footer says where the body ends
+def extract_stream(stream, out, center=True, spool_size=SPOOL_SIZE, stats=None):
+    if not center:
+        read_archive(stream, stats=stats)
+        return copy_stream(stream, out)
+
+    if stream.seekable():
+        start = stream.tell()
+        file = read_archive(stream, stats=stats)
+        stream.seek(start + file.steg.center_start)
+        return copy_stream(stream, out, file.steg.center_length)
+
+    with tempfile.SpooledTemporaryFile(spool_size) as spool:
+        file = read_archive(stream, spool, stats=stats)
+        spool.seek(file.steg.center_start - file.HEADER_LEN)
+        return copy_stream(spool, out, file.steg.center_length)
+
+
+# Split the payload coming in on stream into StreamData pieces of the given lengths
+# Regular files are split by offset, so the pieces can be written in any order (and copied kernel-side); anything
+# else is read as it comes, so the pieces must be written in order. Returns (pieces, whether order is free)
+def split_stream(stream, lengths):
+    regular = stat.S_ISREG(os.fstat(stream.fileno()).st_mode)
+    offset = stream.tell() if regular else None
+    pieces = list()
+    for length in lengths:
+        pieces.append(StreamData(stream, length, offset))
+        if regular:
+            offset += length
+    return pieces, regular
+
+
+# Bytes left to read on stream, if it's a regular file (None for pipes and the like)
+def stream_length(stream):
+    status = os.fstat(stream.fileno())
+    if not stat.S_ISREG(status.st_mode):
+        return None
+    return status.st_size - stream.tell()
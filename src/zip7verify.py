@@ -0,0 +1,146 @@
+import time
+import zlib
+import zip7
+import zip7batch
+from zip7helpers import *
+from zip7codec import decompress, FolderReader
+from zip7io import CHUNK_SIZE
+
+"""
+CRC verification for whole archives
+Every stored CRC (start header, footer, packed streams, folders, members) is recomputed incrementally over chunks,
+never over whole regions at once, so memory stays flat and mmap'd files are only paged in as they're checked
+zlib.crc32 and the lzma decompressor both release the GIL, so folders and archives are checked on threads
+"""
+
+
+# CRC32 and total length of some chunks, continuing from crc
+def crc32_chunks(chunks, crc=0):
+    length = 0
+    for chunk in chunks:
+        crc = zlib.crc32(chunk, crc)
+        length += len(chunk)
+    return crc, length
+
+
+# Chunks of data[start:end]; zero-copy views for bytes and mmaps, positioned reads for file ranges (FileRange, or a
+# VolumeRange across the volumes of a split archive)
+def iter_range(data, start, end, chunk_size=CHUNK_SIZE):
+    if hasattr(data, 'window'):
+        for position in range(start, min(end, len(data)), chunk_size):
+            yield data[position: min(end, position + chunk_size)]
+        return
+    with memoryview(data) as view:
+        for position in range(start, min(end, len(view)), chunk_size):
+            yield view[position: min(end, position + chunk_size)]
+
+
+# Time compute(), which returns (crc, length), and record it against the expected CRC
+# Broken archives are reported through the check rather than raised, so one bad region doesn't hide the others
+def check(name, expected, compute):
+    result = CrcCheck(name, expected)
+    started = time.perf_counter()
+    try:
+        result.actual, result.length = compute()
+    except (Zip7FileException, Zip7UnimplementedException) as e:
+        result.error = str(e)
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+# The packed streams that have a CRC of their own in PackInfo (most archives leave these out)
+def verify_packed_streams(file, footer, prefix='Packed stream'):
+    checks = list()
+    start = file.HEADER_LEN + footer.data_offset
+    for i, (size, crc) in enumerate(zip(footer.pack_size, footer.pack_crcs)):
+        if crc is not None:
+            checks.append(check('%s %d' % (prefix, i), crc, lambda start=start, size=size: crc32_chunks(iter_range(file.data, start, start + size))))
+        start += size
+    return checks
+
+
+# Decompress one folder, checking its own CRC and those of the members in it in a single pass
+# members are (name, size, crc) for each stream in the folder; only defined CRCs get a check
+def verify_folder(file, footer, folder_index, members=(), name=''):
+    folder = footer.folder_info[folder_index]
+    folder_check = CrcCheck(name or 'Folder %d' % folder_index, folder.crc)
+    member_checks = [CrcCheck('Member %s' % member_name, crc, length=size) for member_name, size, crc in members]
+
+    started = time.perf_counter()
+    checked = 0
+    try:
+        reader = FolderReader(decompress(file.iter_folder(footer, folder_index), folder.encoders, folder.unpack_size))
+        crc = 0
+        for member in member_checks:
+            member_started = time.perf_counter()
+            member.actual = 0
+            remaining = member.length
+            while remaining:
+                data = reader.read(remaining)
+                if not len(data):
+                    raise Zip7FileException('Folder ended before member %s was complete.' % member.name)
+                member.actual = zlib.crc32(data, member.actual)
+                crc = zlib.crc32(data, crc)
+                remaining -= len(data)
+            member.seconds = time.perf_counter() - member_started
+            checked += 1
+        # Whatever follows the last member still counts towards the folder's CRC
+        while True:
+            data = reader.read(CHUNK_SIZE)
+            if not len(data):
+                break
+            crc = zlib.crc32(data, crc)
+        folder_check.actual = crc
+        folder_check.length = folder.unpack_size
+    except (Zip7FileException, Zip7UnimplementedException) as e:
+        folder_check.error = str(e)
+        for member in member_checks[checked:]:
+            member.error = str(e)
+    folder_check.seconds = time.perf_counter() - started
+
+    checks = [folder_check] if folder.crc is not None else []
+    return checks + [member for member in member_checks if member.expected is not None]
+
+
+# Check every CRC stored in an open Zip7, in file order; folders are decompressed on up to `workers` threads
+def verify(file, workers=1):
+    checks = [
+        check('Header', file.header.header_crc, lambda: crc32_chunks([file.header.data[0xC:file.HEADER_LEN]])),
+        check('Footer', file.header.footer_crc, lambda: crc32_chunks(iter_range(file.data, file.header.footer_start, file.header.footer_start + file.header.footer_length)))
+    ]
+    checks += verify_packed_streams(file, file.footer)
+
+    footer = file.footer
+    if footer.type == 'Packed':
+        checks += verify_folder(file, footer, 0, name='Packed footer')
+        try:
+            footer = file.archive_footer
+        except (Zip7FileException, Zip7UnimplementedException) as e:
+            return checks + [CrcCheck('Archive footer', error=str(e))]
+        checks += verify_packed_streams(file, footer)
+
+    try:
+        layout = file.member_layout()
+    except Zip7FileException as e:
+        return checks + [CrcCheck('Members', error=str(e))]
+    folders = [[(name, size, crc) for name, is_dir, index, i, size, crc in layout if index == folder_index] for folder_index in range(len(footer.folder_info))]
+    for folder_checks in zip7batch.imap_ordered(lambda folder_index: verify_folder(file, footer, folder_index, folders[folder_index]), range(len(folders)), workers):
+        checks += folder_checks
+    return checks
+
+
+# Open and verify a single archive, for running over many of them; a file that can't be opened gets a failed check
+def verify_file(file_name, workers=1):
+    try:
+        file = zip7.Zip7(file_name, lazy=True)
+    except (OSError, Zip7FileException, Zip7UnimplementedException, Zip7UnknownException) as e:
+        return [CrcCheck('Archive', error=str(e))]
+    try:
+        return verify(file, workers)
+    finally:
+        file.close()
+
+
+# Yields (file_name, checks) for each archive in order, checking up to `workers` archives at a time
+def verify_files(file_names, workers=zip7batch.DEFAULT_WORKERS):
+    return zip7batch.imap_ordered(lambda file_name: (file_name, verify_file(file_name)), file_names, workers)
@@ -0,0 +1,166 @@
+import bisect
+import errno
+import os
+import re
+from itertools import accumulate
+from zip7helpers import Zip7FileException
+from zip7io import copy_range, read_at
+
+"""
+Split (multi-volume) archives: name.7z.001, name.7z.002, ... as 7-Zip writes them with -v (or any name.001, name.002, ...)
+The volumes of a set are presented as one virtual file, and positioned reads are split across whichever volumes
+they span, so split archives are parsed, extracted from and checked in place rather than joined into one file first
+"""
+
+VOLUME_NAME = re.compile(r'^(.*)\.(\d{3,})$')
+
+
+# (name of the set, volume number digits) if file_name is a volume of a split archive, or else None
+# name.7z.NNN always is; any other name.NNN only if it's one of a set that's there (.001 and .002 both exist),
+# so that an archive of its own that happens to be named snapshot.500 (or snapshot.001) is still opened as one
+def volume_match(file_name):
+    match = VOLUME_NAME.match(file_name)
+    if not match or int(match.group(2)) < 1:
+        return None
+    base, digits = match.groups()
+    if base.lower().endswith('.7z') or all(os.path.exists('%s.%0*d' % (base, len(digits), i)) for i in (1, 2)):
+        return base, digits
+    return None
+
+
+def is_volume(file_name):
+    return volume_match(file_name) is not None
+
+
+# A volume after the first: part of a set, but not where it starts (so not an archive to open on its own)
+def is_continuation(file_name):
+    match = volume_match(file_name)
+    return bool(match) and int(match[1]) > 1
+
+
+# The name of the set without the volume number (name.7z for name.7z.001)
+def base_name(file_name):
+    match = volume_match(file_name)
+    return match[0] if match else file_name
+
+
+# The first volume of the set file_name belongs to (name.7z.001 for name.7z.002)
+def first_volume(file_name):
+    match = volume_match(file_name)
+    return '%s.%0*d' % (match[0], len(match[1]), 1) if match else file_name
+
+
+# Every volume of the set file_name belongs to, in order: from .001 up to the first number that doesn't exist
+# The name of any volume in the set may be given; a file that isn't a volume is a set of its own
+def volume_names(file_name):
+    match = volume_match(file_name)
+    if not match:
+        return [file_name]
+    base, digits = match
+    names = list()
+    while True:
+        name = '%s.%0*d' % (base, len(digits), len(names) + 1)
+        if not os.path.exists(name):
+            break
+        names.append(name)
+    if not names:
+        raise FileNotFoundError(errno.ENOENT, 'First volume not found', first_volume(file_name))
+    return names
+
+
+# The volumes of a set, open for positioned reads at offsets into their concatenation
+class VolumeSet(object):
+    def __init__(self, file_names):
+        self.file_names = list(file_names)
+        self.files = list()
+        try:
+            for name in self.file_names:
+                self.files.append(open(name, 'rb'))
+        except BaseException:
+            self.close()
+            raise
+        # Where each volume starts in the whole, plus where the last one ends
+        self.starts = list(accumulate([0] + [os.fstat(f.fileno()).st_size for f in self.files]))
+
+    @classmethod
+    def open(cls, file_name):
+        return cls(volume_names(file_name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.starts[-1]
+
+    @property
+    def closed(self):
+        return all(f.closed for f in self.files)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+    # (fd, offset within the volume, length) for each volume that count bytes from offset span, in order
+    def pieces(self, offset, count):
+        end = min(offset + count, len(self))
+        i = bisect.bisect_right(self.starts, offset) - 1
+        while offset < end:
+            size = min(end, self.starts[i + 1]) - offset
+            if size > 0:
+                yield self.files[i].fileno(), offset - self.starts[i], size
+            offset += size
+            i += 1
+
+    def read_at(self, offset, count):
+        data = list()
+        for fd, position, size in self.pieces(offset, count):
+            data.append(read_at(fd, position, size))
+            if len(data[-1]) < size:
+                raise Zip7FileException('Volume ended early (0x%x bytes short).' % (size - len(data[-1])))
+        return data[0] if len(data) == 1 else b''.join(data)
+
+    # Copy count bytes from offset to the current position of out_fd, kernel-side, a volume at a time
+    def copy_to(self, out_fd, offset, count):
+        for fd, position, size in self.pieces(offset, count):
+            copy_range(fd, out_fd, position, size)
+
+    def range(self, start=0, end=None):
+        return VolumeRange(self, start, len(self) if end is None else end)
+
+
+# A range of a VolumeSet that slices like bytes, read only when sliced (the multi-volume FileRange)
+class VolumeRange(object):
+    def __init__(self, volumes, start, end):
+        self.volumes = volumes
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('VolumeRange slices must be contiguous.')
+            return self.volumes.read_at(self.start + start, max(0, stop - start))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('VolumeRange index out of range')
+        return self.volumes.read_at(self.start + index, 1)[0]
+
+    def __bytes__(self):
+        return self[:]
+
+    # A narrower window, read no sooner than this one
+    def window(self, start, end):
+        start, end, step = slice(start, end).indices(len(self))
+        return VolumeRange(self.volumes, self.start + start, self.start + max(start, end))
+
+    # Saving copies unmodified ranges straight from the volumes
+    def write_to(self, fd):
+        self.volumes.copy_to(fd, self.start, len(self))
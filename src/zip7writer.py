@@ -0,0 +1,287 @@
+import lzma
+import os
+import stat
+import struct
+import zlib
+from contextlib import nullcontext
+import zip7batch
+from zip7helpers import FILETIME_EPOCH, FILETIME_TICKS, SourceFile, Zip7UnimplementedException
+from zip7io import CHUNK_SIZE, atomic_write, copy_range, write_all
+
+"""
+Writes new 7z archives from files on disk, without 7-Zip
+Files are streamed through LZMA2 a chunk at a time (CRCing them on the way) straight into the archive, so memory use
+doesn't depend on their size. Files go into one solid folder, one folder each, or anything in between; folders can be
+compressed in parallel by worker processes, each into a temp file that is then copied (kernel-side) into place
+The header is written with the same property IDs Zip7.footer_process parses, and is itself packed unless asked not to be
+"""
+
+MAGIC = b'7z\xBC\xAF\x27\x1C'
+VERSION = 4
+HEADER_LEN = 0x20
+# Dictionary sizes of the lzma presets; the dictionary has to be spelled out, since it's declared in the folder properties
+PRESET_DICT_SIZES = [1 << 18, 1 << 20, 1 << 21, 1 << 22, 1 << 22, 1 << 23, 1 << 23, 1 << 24, 1 << 25, 1 << 26]
+DEFAULT_PRESET = 6
+# Headers are small, so a small dictionary does as well as any
+HEADER_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': DEFAULT_PRESET, 'dict_size': 1 << 20}]
+
+# Windows attributes 7-Zip stores, and the flag saying the Unix mode is in the high 16 bits
+ATTRIBUTE_READONLY = 0x01
+ATTRIBUTE_DIRECTORY = 0x10
+ATTRIBUTE_ARCHIVE = 0x20
+ATTRIBUTE_UNIX_EXTENSION = 0x8000
+
+
+def lzma2_filters(preset=DEFAULT_PRESET):
+    return [{'id': lzma.FILTER_LZMA2, 'preset': preset, 'dict_size': PRESET_DICT_SIZES[preset]}]
+
+
+## Header encoding (the inverse of Zip7ByteStream's reads)
+
+# Encode value as a 7z number (the inverse of Zip7ByteStream.read_number)
+def encode_number(value):
+    for extra in range(8):
+        if value < 1 << (7 * (extra + 1)):
+            high = value >> (8 * extra)
+            prefix = (0xFF << (8 - extra)) & 0xFF
+            return bytes([prefix | high]) + (value & ((1 << (8 * extra)) - 1)).to_bytes(extra, 'little')
+    return b'\xFF' + value.to_bytes(8, 'little')
+
+
+def encode_numbers(values):
+    return b''.join(encode_number(value) for value in values)
+
+
+# Bits packed most significant first, as read_bits/read_bitmap expect them
+def encode_bits(bits):
+    data = bytearray((len(bits) + 7) // 8)
+    for i, bit in enumerate(bits):
+        if bit:
+            data[i >> 3] |= 0x80 >> (i & 7)
+    return bytes(data)
+
+
+# A property ID followed by its size and data (how EmptyStream, EmptyFile and the other FilesInfo properties are stored)
+def encode_property(opcode, data):
+    return bytes([opcode]) + encode_number(len(data)) + data
+
+
+# The LZMA2 property byte for the smallest dictionary at least dict_size long (the inverse of zip7codec.lzma_filter)
+def lzma2_property(dict_size):
+    for bits in range(40):
+        if (2 | (bits & 1)) << (bits // 2 + 11) >= dict_size:
+            return bits
+    return 40
+
+
+# One Folder: a single LZMA2 coder (ID 0x21, with one byte of properties)
+def encode_folder(dict_size):
+    return b'\x01\x21\x21\x01' + bytes([lzma2_property(dict_size)])
+
+
+def encode_crcs(crcs):
+    return b'\x0A\x01' + b''.join(struct.pack('<I', crc) for crc in crcs)
+
+
+# StreamsInfo: PackInfo, UnpackInfo and (optionally) SubStreamsInfo
+# folders: (packed size, unpacked size, crc, [(substream size, substream crc), ...], dict size) for each folder
+# With substreams, the CRCs go in SubStreamsInfo, one per stream, and folders get none of their own, as 7-Zip does it
+# (some readers check a folder's CRC as soon as its packed data runs out, before its last stream is decompressed)
+def encode_streams_info(pack_position, folders, substreams=True):
+    data = bytearray(b'\x06')
+    data += encode_number(pack_position) + encode_number(len(folders))
+    data += b'\x09' + encode_numbers(folder[0] for folder in folders) + b'\x00'
+
+    data += b'\x07\x0B' + encode_number(len(folders)) + b'\x00'
+    data += b''.join(encode_folder(folder[4]) for folder in folders)
+    data += b'\x0C' + encode_numbers(folder[1] for folder in folders)
+    if not substreams:
+        data += encode_crcs(folder[2] for folder in folders)
+        return data + b'\x00\x00'
+    data += b'\x00'
+
+    data += b'\x08\x0D' + encode_numbers(len(folder[3]) for folder in folders)
+    if any(len(folder[3]) > 1 for folder in folders):
+        data += b'\x09' + encode_numbers(size for folder in folders for size, crc in folder[3][:-1])
+    data += encode_crcs(crc for folder in folders for size, crc in folder[3])
+    return data + b'\x00\x00'
+
+
+# A FilesInfo property holding a value for every file: all defined, stored inline
+def encode_file_property(opcode, values, size):
+    return encode_property(opcode, b'\x01\x00' + b''.join(value.to_bytes(size, 'little') for value in values))
+
+
+# FilesInfo for members, in archive order: names, which have no data (and which of those are files), mtimes, attributes
+def encode_files_info(members):
+    data = bytearray(b'\x05') + encode_number(len(members))
+    empty = [member.is_dir or not member.size for member in members]
+    if any(empty):
+        data += encode_property(0x0E, encode_bits(empty))
+        data += encode_property(0x0F, encode_bits([not member.is_dir for member in members if member.is_dir or not member.size]))
+    names = b''.join(member.name.encode('utf-16-le') + b'\x00\x00' for member in members)
+    data += encode_property(0x11, b'\x00' + names)
+    data += encode_file_property(0x14, [member.mtime for member in members], 8)
+    data += encode_file_property(0x15, [member.attributes for member in members], 4)
+    return data + b'\x00'
+
+
+# The whole (unpacked) header
+def encode_header(members, folders):
+    return b'\x01\x04' + encode_streams_info(0, folders) + encode_files_info(members) + b'\x00'
+
+
+# The 32-byte start header pointing at the footer, each part protected by its CRC
+def encode_start_header(footer_offset, footer):
+    tail = struct.pack('<QQI', footer_offset, len(footer), zlib.crc32(footer))
+    return MAGIC + struct.pack('>H', VERSION) + struct.pack('<I', zlib.crc32(tail)) + tail
+
+
+## Members
+
+# A SourceFile for path, stored as name
+def source_file(path, name):
+    info = os.stat(path)
+    is_dir = stat.S_ISDIR(info.st_mode)
+    attributes = ATTRIBUTE_DIRECTORY if is_dir else ATTRIBUTE_ARCHIVE
+    if not info.st_mode & stat.S_IWUSR:
+        attributes |= ATTRIBUTE_READONLY
+    return SourceFile(
+        name=name, path=path, size=0 if is_dir else info.st_size, is_dir=is_dir,
+        mtime=info.st_mtime_ns // 100 + FILETIME_EPOCH * FILETIME_TICKS,
+        attributes=attributes | ATTRIBUTE_UNIX_EXTENSION | info.st_mode << 16
+    )
+
+
+# SourceFiles for paths and everything under the folders among them (in sorted order), named like 7-Zip names them:
+# relative to the folder each path is in, with / separators. Symlinks are followed
+def collect(paths):
+    members = list()
+    for path in paths:
+        top = os.path.basename(os.path.normpath(path))
+        prefix = '' if top in ('', os.curdir, os.pardir) else top
+        if prefix:
+            members.append(source_file(path, prefix))
+        if not os.path.isdir(path):
+            continue
+        for folder, folder_names, file_names in os.walk(path):
+            folder_names.sort()
+            relative = os.path.relpath(folder, path)
+            for name in folder_names + sorted(file_names):
+                parts = [part for part in (prefix, relative, name) if part and part != os.curdir]
+                members.append(source_file(os.path.join(folder, name), '/'.join(parts).replace(os.sep, '/')))
+    return members
+
+
+# Split the members holding data into folders, in order: one each without a folder_count, otherwise folder_count
+# folders of about as many bytes each (fewer, if some members are too big to share them out that evenly)
+def plan_folders(members, folder_count=None):
+    stored = [member for member in members if not member.is_dir and member.size]
+    if folder_count is None:
+        return [[member] for member in stored]
+    folder_count = max(1, folder_count)
+    total = sum(member.size for member in stored)
+    groups = [[] for i in range(folder_count)]
+    position = 0
+    for member in stored:
+        # Whichever folder the middle of the member falls into
+        groups[min(folder_count - 1, (2 * position + member.size) * folder_count // (2 * total))].append(member)
+        position += member.size
+    return [group for group in groups if group]
+
+
+## Compression
+
+# Stream the files at paths through one LZMA2 compressor into fd, CRCing them as they go
+# Returns the folder as encode_streams_info takes it; sizes are what was actually read, should a file change meanwhile
+def compress_folder(paths, fd, filters):
+    compressor = lzma.LZMACompressor(format=lzma.FORMAT_RAW, filters=filters)
+    packed_size = unpack_size = crc = 0
+    substreams = list()
+    for path in paths:
+        size = file_crc = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                size += len(chunk)
+                file_crc = zlib.crc32(chunk, file_crc)
+                crc = zlib.crc32(chunk, crc)
+                packed = compressor.compress(chunk)
+                write_all(fd, packed)
+                packed_size += len(packed)
+        substreams.append((size, file_crc))
+        unpack_size += size
+    packed = compressor.flush()
+    write_all(fd, packed)
+    return packed_size + len(packed), unpack_size, crc, substreams, filters[-1]['dict_size']
+
+
+# Compress a folder into a temp file of its own under temp_folder, returning (temp file name, folder)
+# Meant to run in worker processes, hence the plain arguments
+def compress_folder_task(args):
+    import tempfile
+    paths, temp_folder, filters = args
+    fd, temp_name = tempfile.mkstemp(dir=temp_folder, suffix='.lzma2')
+    try:
+        return temp_name, compress_folder(paths, fd, filters)
+    finally:
+        os.close(fd)
+
+
+# Compress the groups into fd one after another, yielding each folder; with more than one worker, compressed in
+# parallel into temp files next to file_name, then copied into fd in order
+def write_folders(fd, groups, filters, workers, file_name):
+    if workers <= 1 or len(groups) <= 1:
+        for group in groups:
+            yield compress_folder([member.path for member in group], fd, filters)
+        return
+
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(file_name)), prefix='.7zwriter.') as temp_folder:
+        tasks = [([member.path for member in group], temp_folder, filters) for group in groups]
+        for temp_name, folder in zip7batch.imap_ordered(compress_folder_task, tasks, workers, executor=ProcessPoolExecutor):
+            with open(temp_name, 'rb') as f:
+                copy_range(f.fileno(), fd, 0, folder[0])
+            os.unlink(temp_name)
+            yield folder
+
+
+## Archives
+
+# Write a new archive at file_name holding the SourceFiles in members (e.g. from collect()), replacing it atomically
+# Files go into folder_count folders (1: solid; None: one each), compressed by up to `workers` processes
+# Returns the folders written, as encode_streams_info takes them
+def write_members(file_name, members, folder_count=1, preset=DEFAULT_PRESET, workers=1, packed_header=True, stats=None):
+    groups = plan_folders(members, folder_count)
+    if not groups:
+        raise Zip7UnimplementedException('Archives without any file data are not implemented.')
+    filters = lzma2_filters(preset)
+
+    phase = stats.phase if stats else lambda name: nullcontext()
+    with atomic_write(file_name) as fd:
+        os.lseek(fd, HEADER_LEN, os.SEEK_SET)
+        with phase('compress'):
+            folders = list(write_folders(fd, groups, filters, workers, file_name))
+        body_length = sum(folder[0] for folder in folders)
+
+        with phase('write_header'):
+            footer = encode_header(members, folders)
+            if packed_header:
+                packed = lzma.compress(footer, format=lzma.FORMAT_RAW, filters=HEADER_FILTERS)
+                write_all(fd, packed)
+                folder = (len(packed), len(footer), zlib.crc32(footer), [(len(footer), zlib.crc32(footer))], HEADER_FILTERS[-1]['dict_size'])
+                footer = b'\x17' + encode_streams_info(body_length, [folder], substreams=False)
+                body_length += len(packed)
+            write_all(fd, footer)
+            os.lseek(fd, 0, os.SEEK_SET)
+            write_all(fd, encode_start_header(body_length, footer))
+
+    if stats:
+        stats.add_read(sum(folder[1] for folder in folders))
+        stats.add_written(HEADER_LEN + body_length + len(footer))
+    return folders
+
+
+# Write a new archive at file_name from files and folders on disk
+def write_archive(file_name, paths, folder_count=1, preset=DEFAULT_PRESET, workers=1, packed_header=True, stats=None):
+    return write_members(file_name, collect(paths), folder_count, preset, workers, packed_header, stats)
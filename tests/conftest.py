@@ -0,0 +1,11 @@
+import os
+import sys
+
+"""
+The library lives in src/ and is imported flat, as the scripts there import it; synth7z (from benchmarks/) builds the
+archives the tests run on
+"""
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
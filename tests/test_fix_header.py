@@ -0,0 +1,43 @@
+import os
+import fix_header
+import synth7z
+import zip7
+
+"""
+fix_header's dry runs write nothing, and an explicit --version is always honoured
+"""
+
+
+def build(tmp_path):
+    file_name = str(tmp_path / 'a.7z')
+    synth7z.build_archive(file_name, [('a.bin', synth7z.make_data(1000))])
+    return file_name
+
+
+def read(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read()
+
+
+def test_dry_run_leaves_journal(tmp_path):
+    file_name = build(tmp_path)
+    journal = zip7.journal_name(file_name)
+    with open(journal, 'wb') as f:
+        f.write(b'torn journal')
+    data = read(file_name)
+
+    status, message = fix_header.fix_file(file_name, dry_run=True)
+    assert status == 'error' and 'journal' in message
+    assert read(journal) == b'torn journal' and read(file_name) == data
+
+    # Without -n, the (torn, so never applied) journal is cleared and the file checked
+    assert fix_header.fix_file(file_name) == ('ok', [])
+    assert not os.path.exists(journal)
+
+
+def test_version_zero(tmp_path):
+    file_name = build(tmp_path)
+    status, changes = fix_header.fix_file(file_name, str(tmp_path / 'b.7z'), version=0)
+    assert status == 'fixed' and ('version', 4, 0) in changes
+    with zip7.Zip7(str(tmp_path / 'b.7z')) as file:
+        assert file.header.version == 0
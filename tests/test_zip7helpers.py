@@ -0,0 +1,60 @@
+import pickle
+import pytest
+from zip7helpers import Encoder, FileTable, Folder, Footer, Header, Steg, Zip7Stats
+
+"""
+The models: slotted instances, frozen encoders, and equality/repr over their fields
+"""
+
+
+def test_slots():
+    for model in (Header(), Encoder(), Folder(), Footer(), Steg(), Zip7Stats()):
+        assert not hasattr(model, '__dict__')
+    header = Header()
+    with pytest.raises(AttributeError):
+        header.not_a_field = 1
+
+
+def test_defaults():
+    assert Header().version == 0 and Folder().num_unpack_streams == 1 and Folder().crc is None
+    # Mutable defaults are made anew for every instance
+    first, second = Footer(), Footer()
+    first.pack_crcs.append(1)
+    first.files.names.append('a')
+    assert second.pack_crcs == [] and second.files.names == []
+    assert first.pack_size is not second.pack_size
+    assert Encoder(1, 2).flag_size == 2 and Encoder(encoding='LZMA2').encoding == 'LZMA2'
+
+
+def test_frozen():
+    encoder = Encoder(encoding_id=0x21, encoding='LZMA2', properties=b'\x18')
+    with pytest.raises(AttributeError):
+        encoder.encoding = 'LZMA'
+    with pytest.raises(AttributeError):
+        del encoder.properties
+    assert encoder.encoding == 'LZMA2'
+    assert hash(encoder) == hash(Encoder(encoding_id=0x21, encoding='LZMA2', properties=b'\x18'))
+    assert len({encoder, Encoder(encoding_id=0x21, encoding='LZMA2', properties=b'\x18')}) == 1
+
+
+def test_equality():
+    assert Header(version=4) == Header(version=4)
+    assert Header(version=4) != Header(version=3)
+    assert Steg() != Header()
+    assert Folder(encoders=[Encoder(1)]) == Folder(encoders=[Encoder(1)])
+    assert FileTable.allocate(3) == FileTable.allocate(3) != FileTable.allocate(2)
+    # Mutable models aren't hashable, as with dataclasses
+    with pytest.raises(TypeError):
+        hash(Header())
+
+
+def test_repr():
+    assert repr(Steg(center_start=32)) == 'Steg(center_start=32, center_length=0, center_data=b\'\', bottom_start=0, bottom_length=0, bottom_data=b\'\')'
+    # The stats' lock is neither shown nor compared
+    stats = Zip7Stats(bytes_read=1)
+    assert 'lock' not in repr(stats) and stats == Zip7Stats(bytes_read=1)
+
+
+def test_pickle():
+    for model in (Header(version=4, data=b'x' * 32), Encoder(0x21, properties=b'\x18'), Folder(encoders=[Encoder(1)], crc=5)):
+        assert pickle.loads(pickle.dumps(model)) == model
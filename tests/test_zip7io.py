@@ -0,0 +1,51 @@
+import os
+import stat
+import pytest
+from zip7io import atomic_write, write_all
+
+"""
+atomic_write: new files get the mode any new file would (under the umask), replaced files keep theirs
+"""
+
+
+def mode(file_name):
+    return stat.S_IMODE(os.stat(file_name).st_mode)
+
+
+@pytest.fixture
+def umask():
+    old = os.umask(0o022)
+    yield
+    os.umask(old)
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX modes')
+def test_new_file_mode(tmp_path, umask):
+    for mask in (0o022, 0o077):
+        os.umask(mask)
+        file_name = str(tmp_path / ('new_%o' % mask))
+        with atomic_write(file_name) as fd:
+            write_all(fd, b'data')
+        assert mode(file_name) == 0o666 & ~mask
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='POSIX modes')
+def test_replaced_file_mode(tmp_path, umask):
+    file_name = str(tmp_path / 'old')
+    with open(file_name, 'wb') as f:
+        f.write(b'old')
+    os.chmod(file_name, 0o640)
+    with atomic_write(file_name) as fd:
+        write_all(fd, b'new')
+    assert mode(file_name) == 0o640
+    with open(file_name, 'rb') as f:
+        assert f.read() == b'new'
+
+
+def test_failure_leaves_nothing(tmp_path):
+    file_name = str(tmp_path / 'file')
+    with pytest.raises(ValueError):
+        with atomic_write(file_name) as fd:
+            write_all(fd, b'partial')
+            raise ValueError
+    assert os.listdir(str(tmp_path)) == []
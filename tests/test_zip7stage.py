@@ -0,0 +1,51 @@
+import os
+import pytest
+import synth7z
+import zip7stage
+from zip7 import Zip7
+from zip7helpers import Zip7FileException
+
+"""
+Journal folders of two-phase batch injections: only what a batch writes there is ever deleted
+"""
+
+
+def build_files(folder, count=2):
+    files = list()
+    for i in range(count):
+        file_name = str(folder / ('v%d.7z' % i))
+        synth7z.build_archive(file_name, [('file.bin', synth7z.make_data(1000, i))], packed_footer=False)
+        files.append(file_name)
+    return files
+
+
+def inject(journal, files, pieces):
+    zip7stage.commit_batch(str(journal), files, pieces, lambda file, data: file.inject(data), 'center', jobs=1, ordered=True)
+
+
+def test_journal_removed_when_done(tmp_path):
+    files = build_files(tmp_path)
+    inject(tmp_path / 'journal', files, [b'one', b'two'])
+    assert not (tmp_path / 'journal').exists()
+    assert [bytes(Zip7(file_name).steg.center_data) for file_name in files] == [b'one', b'two']
+
+
+def test_foreign_folder_refused(tmp_path):
+    files = build_files(tmp_path)
+    journal = tmp_path / 'important'
+    journal.mkdir()
+    (journal / 'keep.txt').write_bytes(b'keep')
+    with pytest.raises(Zip7FileException):
+        inject(journal, files, [b'one', b'two'])
+    assert os.listdir(str(journal)) == ['keep.txt']
+    assert [bytes(Zip7(file_name).steg.center_data) for file_name in files] == [b'', b'']
+
+
+def test_leftovers_cleared(tmp_path):
+    files = build_files(tmp_path)
+    journal = tmp_path / 'journal'
+    journal.mkdir()
+    for name in ('000000.redo', 'progress.log', '.manifest.json.abc123.tmp'):
+        (journal / name).write_bytes(b'stale')
+    inject(journal, files, [b'one', b'two'])
+    assert not journal.exists()
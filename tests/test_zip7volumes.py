@@ -0,0 +1,68 @@
+import os
+import shutil
+import synth7z
+import zip7volumes
+from zip7 import Zip7
+from zip7cache import MetadataCache
+
+"""
+Which names are taken for volumes of split archives: name.7z.NNN always, any other name.NNN only as part of a set
+"""
+
+FILES = [('a.bin', synth7z.make_data(3000, 1)), ('b.bin', synth7z.make_data(2000, 2))]
+
+
+def build(file_name):
+    synth7z.build_archive(str(file_name), FILES)
+    return str(file_name)
+
+
+def split(file_name, base, count=3):
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    size = -(-len(data) // count)
+    names = list()
+    for i in range(count):
+        names.append('%s.%03d' % (base, i + 1))
+        with open(names[-1], 'wb') as f:
+            f.write(data[i * size: (i + 1) * size])
+    return names
+
+
+def members(file_name):
+    with Zip7(file_name, lazy=True) as file:
+        return [(member.name, member.readall()) for member in file.iter_members()]
+
+
+def test_standalone_numbered_archive(tmp_path):
+    for name in ('snapshot.500', 'snapshot.001'):
+        file_name = build(tmp_path / name)
+        assert not zip7volumes.is_volume(file_name)
+        assert zip7volumes.volume_names(file_name) == [file_name]
+        with Zip7(file_name) as file:
+            assert file.volumes is None
+        assert members(file_name) == FILES
+        assert MetadataCache.file_key(file_name) is not None
+
+
+def test_split_7z(tmp_path):
+    whole = build(tmp_path / 'whole.7z')
+    names = split(whole, str(tmp_path / 'sample.7z'))
+    for name in names:
+        assert zip7volumes.is_volume(name)
+        assert zip7volumes.volume_names(name) == names
+    assert zip7volumes.is_continuation(names[1]) and zip7volumes.first_volume(names[1]) == names[0]
+    assert members(names[0]) == members(names[2]) == FILES
+
+
+def test_split_other_names(tmp_path):
+    whole = build(tmp_path / 'whole.7z')
+    names = split(whole, str(tmp_path / 'backup'))
+    assert all(zip7volumes.is_volume(name) for name in names)
+    assert members(names[1]) == FILES
+    # Without a .002 next to it, backup.001 is an archive of its own
+    shutil.copy(whole, names[0])
+    for name in names[1:]:
+        os.remove(name)
+    assert not zip7volumes.is_volume(names[0])
+    assert members(names[0]) == FILES